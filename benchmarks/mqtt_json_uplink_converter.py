@@ -0,0 +1,94 @@
+#     Copyright 2022. ThingsBoard
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+
+"""
+Compares JsonMqttUplinkConverter with compiled expression plans against the conversion with
+TBUtility.get_values for every message, on the fixtures of test_mqtt_json_uplink_converter.
+
+    python -m benchmarks.mqtt_json_uplink_converter
+"""
+
+from timeit import repeat
+
+from thingsboard_gateway.connectors.mqtt.json_mqtt_uplink_converter import JsonMqttUplinkConverter
+from thingsboard_gateway.tb_utility.tb_utility import TBUtility
+from tests.converters.test_mqtt_json_uplink_converter import JsonMqttUplinkConverterTests
+
+MESSAGES_COUNT = 200
+
+
+class GetValuesJsonMqttUplinkConverter(JsonMqttUplinkConverter):
+    """
+    Conversion as it was done before the expression plans
+    """
+
+    def _convert_single_item(self, topic, data):
+        datatypes = {"attributes": "attributes",
+                     "timeseries": "telemetry"}
+        dict_result = {
+            "deviceName": self.parse_device_name(topic, data, self.config),
+            "deviceType": self.parse_device_type(topic, data, self.config),
+            "attributes": [],
+            "telemetry": []
+        }
+        for datatype in datatypes:
+            timestamp = data.get("ts", data.get("timestamp")) if datatype == 'timeseries' else None
+            for datatype_config in self.config.get(datatype, []):
+                if isinstance(datatype_config, str) and datatype_config == "*":
+                    for item in data:
+                        dict_result[datatypes[datatype]].append(
+                            self.create_timeseries_record(item, data[item], timestamp))
+                    continue
+                values = TBUtility.get_values(datatype_config["value"], data, datatype_config["type"],
+                                              expression_instead_none=False)
+                values_tags = TBUtility.get_values(datatype_config["value"], data, datatype_config["type"],
+                                                   get_tag=True)
+                keys = TBUtility.get_values(datatype_config["key"], data, datatype_config["type"],
+                                            expression_instead_none=False)
+                keys_tags = TBUtility.get_values(datatype_config["key"], data, get_tag=True)
+
+                full_key = datatype_config["key"]
+                for (key, key_tag) in zip(keys, keys_tags):
+                    is_valid_key = "${" in datatype_config["key"] and "}" in datatype_config["key"]
+                    full_key = full_key.replace('${' + str(key_tag) + '}', str(key)) if is_valid_key else key_tag
+
+                full_value = datatype_config["value"]
+                for (value, value_tag) in zip(values, values_tags):
+                    is_valid_value = "${" in datatype_config["value"] and "}" in datatype_config["value"]
+                    full_value = full_value.replace('${' + str(value_tag) + '}',
+                                                    str(value)) if is_valid_value else value
+
+                if full_key != 'None' and full_value != 'None':
+                    dict_result[datatypes[datatype]].append(
+                        self.create_timeseries_record(full_key, full_value, timestamp))
+        return dict_result
+
+
+def run_benchmark():
+    fixtures = JsonMqttUplinkConverterTests()
+    for fixture in (fixtures._get_device_1_test_data, fixtures._get_device_2_test_data,
+                    fixtures._get_device_3_test_data):
+        topic, config, data = fixture()
+        results = {}
+        for converter_class in (GetValuesJsonMqttUplinkConverter, JsonMqttUplinkConverter):
+            converter = converter_class(config)
+            results[converter_class] = converter.convert(topic, data)
+            seconds = min(repeat(lambda: converter.convert(topic, data), number=MESSAGES_COUNT, repeat=3))
+            print("%-35s %-32s %8.1f us per message" % (fixture.__name__, converter_class.__name__,
+                                                         seconds / MESSAGES_COUNT * 1000000))
+        assert results[GetValuesJsonMqttUplinkConverter] == results[JsonMqttUplinkConverter]
+
+
+if __name__ == '__main__':
+    run_benchmark()
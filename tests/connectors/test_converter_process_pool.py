@@ -0,0 +1,89 @@
+#      Copyright 2022. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+
+import gc
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from thingsboard_gateway.connectors.converter_process_pool import ConverterProcessPool
+from thingsboard_gateway.tb_utility.tb_loader import TBModuleLoader
+
+
+class TestConverterProcessPool(unittest.TestCase):
+    MAPPING = {
+        "topicFilter": "/sensor/data",
+        "converter": {
+            "type": "json",
+            "deviceNameJsonExpression": "${serialNumber}",
+            "deviceTypeJsonExpression": "${sensorType}",
+            "attributes": [{"type": "string", "key": "model", "value": "${sensorModel}"}],
+            "timeseries": [{"type": "double", "key": "temperature", "value": "${temp}"}]
+        }
+    }
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = ConverterProcessPool("mqtt", processes_count=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.stop()
+
+    def setUp(self):
+        self.converter = TBModuleLoader.import_module("mqtt", "JsonMqttUplinkConverter")(self.MAPPING)
+        self.pool.add_converter(self.converter, self.MAPPING)
+
+    @staticmethod
+    def get_message(index):
+        return {"serialNumber": "SN-%i" % index, "sensorType": "Thermometer", "sensorModel": "T1000", "temp": index}
+
+    def test_results_are_equal_to_converter_in_thread(self):
+        for index in range(3):
+            self.assertDictEqual(self.converter.convert("/sensor/data", self.get_message(index)),
+                                 self.pool.convert(self.converter, "/sensor/data", self.get_message(index)))
+
+    def test_results_are_returned_in_order(self):
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(lambda index: self.pool.convert(self.converter, "/sensor/data",
+                                                                        self.get_message(index)), range(50)))
+
+        self.assertListEqual(["SN-%i" % index for index in range(50)], [result["deviceName"] for result in results])
+
+    def test_config_update_is_passed_to_processes(self):
+        config = dict(self.converter.config)
+        config["deviceTypeJsonExpression"] = "${sensorModel}"
+        self.converter.config = config
+
+        for _ in range(4):
+            self.assertEqual("T1000", self.pool.convert(self.converter, "/sensor/data",
+                                                        self.get_message(1))["deviceType"])
+
+    def test_rebuilt_converters_reuse_process_instances(self):
+        converters_count = self.pool.get_converters_count()
+        for _ in range(3):
+            converter = TBModuleLoader.import_module("mqtt", "JsonMqttUplinkConverter")(self.MAPPING)
+            self.pool.add_converter(converter, self.MAPPING)
+            self.assertEqual("SN-1", self.pool.convert(converter, "/sensor/data", self.get_message(1))["deviceName"])
+        del converter
+        gc.collect()
+
+        self.assertEqual(converters_count, self.pool.get_converters_count())
+        self.assertEqual(self.pool.get_converter_key(self.converter, self.MAPPING),
+                         self.pool.get_converter_key(
+                             TBModuleLoader.import_module("mqtt", "JsonMqttUplinkConverter")(self.MAPPING),
+                             dict(self.MAPPING)))
+
+
+if __name__ == '__main__':
+    unittest.main()
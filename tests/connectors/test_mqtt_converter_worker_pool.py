@@ -0,0 +1,93 @@
+#      Copyright 2022. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+
+import unittest
+from threading import Event, Lock
+from time import monotonic
+
+from thingsboard_gateway.connectors.mqtt.converter_worker_pool import ConverterWorkerPool
+
+
+class TestConverterWorkerPool(unittest.TestCase):
+    def setUp(self):
+        self.lock = Lock()
+        self.results = []
+        self.all_saved = Event()
+        self.expected_results = 0
+        self.pool = ConverterWorkerPool("Test", self.save_result, workers_count=3)
+        self.pool.start()
+
+    def tearDown(self):
+        self.pool.stop()
+
+    def save_result(self, topic, data):
+        with self.lock:
+            self.results.append((topic, data["telemetry"][0]["index"]))
+            if len(self.results) == self.expected_results:
+                self.all_saved.set()
+
+    @staticmethod
+    def convert(topic, content):
+        if content is None:
+            raise ValueError("Nothing to convert")
+        return {"deviceName": topic, "telemetry": [{"index": content}], "attributes": []}
+
+    def test_order_is_kept_per_topic(self):
+        topics = ["sensor/%i" % index for index in range(5)]
+        self.expected_results = len(topics) * 100
+        for index in range(100):
+            for topic in topics:
+                self.assertTrue(self.pool.put(topic, self.convert, topic, index))
+
+        self.assertTrue(self.all_saved.wait(5))
+        for topic in topics:
+            self.assertListEqual(list(range(100)), [index for (result_topic, index) in self.results
+                                                    if result_topic == topic])
+
+    def test_failed_conversion_does_not_stop_worker(self):
+        self.expected_results = 1
+        self.pool.put("sensor", self.convert, "sensor", None)
+        self.pool.put("sensor", self.convert, "sensor", 1)
+
+        self.assertTrue(self.all_saved.wait(5))
+        statistics = self.pool.get_statistics("mqtt")
+        self.assertEqual(3, statistics["mqttWorkers"])
+        self.assertEqual(0, statistics["mqttQueueDepth"])
+        self.assertEqual(1, statistics["mqttConversionLatencyCount"])
+
+    def test_full_queue_rejects_message(self):
+        self.pool.stop()
+        self.pool = ConverterWorkerPool("Test", self.save_result, workers_count=1, max_queue_size=1)
+
+        self.assertTrue(self.pool.put("sensor", self.convert, "sensor", 1))
+        self.assertFalse(self.pool.put("sensor", self.convert, "sensor", 2))
+        self.assertEqual(1, self.pool.get_queue_depth())
+
+    def test_stop_does_not_block_on_full_queue(self):
+        self.pool.stop()
+        self.pool = ConverterWorkerPool("Test", self.save_result, workers_count=1, max_queue_size=1)
+        self.pool.start()
+        blocked = Event()
+        self.pool.put("sensor", lambda topic, content: blocked.wait(5), "sensor", 1)
+        self.pool.put("sensor", self.convert, "sensor", 2)
+
+        started = monotonic()
+        self.pool.stop(timeout=1)
+        blocked.set()
+
+        self.assertLess(monotonic() - started, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+#      Copyright 2022. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+
+import unittest
+
+from thingsboard_gateway.connectors.mqtt.topic_router import CONNECT_REQUEST_HANDLERS, MAPPING_HANDLERS, \
+    TopicRouter
+from thingsboard_gateway.tb_utility.tb_utility import TBUtility
+
+
+class TestTopicRouter(unittest.TestCase):
+    def setUp(self):
+        self.router = TopicRouter()
+        for topic_filter in ("sensor/+/data", "sensor/#", "sensor/raw"):
+            self.router.add(MAPPING_HANDLERS, TBUtility.topic_to_regex(topic_filter))
+        self.router.add(CONNECT_REQUEST_HANDLERS, TBUtility.topic_to_regex("sensor/connect"))
+
+    def test_all_handler_classes_resolved_in_one_lookup(self):
+        self.assertDictEqual({MAPPING_HANDLERS: ("sensor/[^/]+/data", "sensor/.+")},
+                             self.router.get_matching_topics("sensor/SN-1/data"))
+        self.assertDictEqual({MAPPING_HANDLERS: ("sensor/.+",), CONNECT_REQUEST_HANDLERS: ("sensor/connect",)},
+                             self.router.get_matching_topics("sensor/connect"))
+        self.assertDictEqual({}, self.router.get_matching_topics("other/topic"))
+
+    def test_cache_is_cleared_on_change(self):
+        self.assertDictEqual({}, self.router.get_matching_topics("other/topic"))
+
+        self.router.add(MAPPING_HANDLERS, TBUtility.topic_to_regex("other/+"))
+        self.assertDictEqual({MAPPING_HANDLERS: ("other/[^/]+",)}, self.router.get_matching_topics("other/topic"))
+
+        self.router.clear(MAPPING_HANDLERS)
+        self.assertDictEqual({CONNECT_REQUEST_HANDLERS: ("sensor/connect",)},
+                             self.router.get_matching_topics("sensor/connect"))
+
+    def test_same_topic_is_added_once(self):
+        self.router.add(MAPPING_HANDLERS, TBUtility.topic_to_regex("sensor/raw"))
+
+        self.assertDictEqual({MAPPING_HANDLERS: ("sensor/.+", "sensor/raw")},
+                             self.router.get_matching_topics("sensor/raw"))
+
+
+if __name__ == '__main__':
+    unittest.main()
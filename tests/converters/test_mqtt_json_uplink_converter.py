@@ -17,6 +17,8 @@ from random import randint
 
 from thingsboard_gateway.gateway.constants import *
 from thingsboard_gateway.connectors.mqtt.json_mqtt_uplink_converter import JsonMqttUplinkConverter
+from thingsboard_gateway.tb_utility.tb_expression_plan import ExpressionPlan
+from thingsboard_gateway.tb_utility.tb_utility import TBUtility
 
 
 class JsonMqttUplinkConverterTests(unittest.TestCase):
@@ -77,6 +79,33 @@ class JsonMqttUplinkConverterTests(unittest.TestCase):
         converted_array_data = converter.convert(topic, data)
         self.assertTrue(converted_array_data.get(SEND_ON_CHANGE_PARAMETER))
 
+    def test_key_and_value_expressions(self):
+        topic, config, data = self._get_device_3_test_data()
+        converter = JsonMqttUplinkConverter(config)
+        converted_data = converter.convert(topic, data)
+
+        self.assertEqual(self.DEVICE_NAME, converted_data["deviceName"])
+        self.assertEqual("${sensorType}", converted_data["deviceType"])
+        self.assertListEqual([{"model": "T1000"}, {"location": "Hall None"}], converted_data["attributes"])
+        self.assertDictEqual({"ts": 1650000000000, "temperature": str(data["values"]["temperature"]),
+                              "humidity_percent": str(data["values"]["humidity"]), "state": "ON",
+                              "firmware": "1.2"},
+                             self._convert_to_dict(converted_data["telemetry"]))
+
+    def test_expression_plan_matches_get_values(self):
+        data = {"a": 1, "b": {"c": [10, 20]}, "d": None, "e e": 5, "name": "N"}
+        for expression in ("${a}", "${b.c[1]}", "x_${a}_${name}", "${missing}", "${d}", "constant", "${}",
+                           "${a", "${b.c[*]}", "${$.name}", "${a}${a}"):
+            for expression_instead_none in (False, True):
+                values = TBUtility.get_values(expression, data, expression_instead_none=expression_instead_none)
+                tags = TBUtility.get_values(expression, data, get_tag=True)
+                expected = expression
+                for value, tag in zip(values, tags):
+                    expected = expected.replace('${' + str(tag) + '}', str(value)) \
+                        if "${" in expression and "}" in expression else value
+                self.assertEqual(expected, ExpressionPlan(expression).execute(data, expression_instead_none),
+                                 expression)
+
     @staticmethod
     def _convert_to_dict(data_array):
         data_dict = {}
@@ -127,6 +156,40 @@ class JsonMqttUplinkConverterTests(unittest.TestCase):
         }
         return topic, config, data
 
+    def _get_device_3_test_data(self):
+        topic = f"sensors/{self.DEVICE_NAME}"
+        config = {
+          "topicFilter": "sensors/+",
+          "converter": {
+            "type": "json",
+            "deviceNameJsonExpression": "${serialNumber}",
+            "deviceTypeJsonExpression": "${sensorType}",
+            "timeout": 60000,
+            "attributes": [
+              {"type": "string", "key": "model", "value": "${sensorModel}"},
+              {"type": "string", "key": "location", "value": "Hall ${building}"},
+              {"type": "string", "key": "${missingKey}", "value": "${sensorModel}"}
+            ],
+            "timeseries": [
+              {"type": "double", "key": "temperature", "value": "${values.temperature}"},
+              {"type": "double", "key": "${humidityKey}_percent", "value": "${values.humidity}"},
+              {"type": "string", "key": "state", "value": "${state}"},
+              {"type": "string", "key": "firmware", "value": "${firmware.major}.${firmware.minor}"},
+              {"type": "string", "key": "missing", "value": "${missingValue}"}
+            ]
+          }
+        }
+        data = {
+            "serialNumber": self.DEVICE_NAME,
+            "sensorModel": "T1000",
+            "humidityKey": "humidity",
+            "ts": 1650000000000,
+            "values": {"temperature": randint(0, 256), "humidity": randint(0, 100)},
+            "state": "ON",
+            "firmware": {"major": 1, "minor": 2}
+        }
+        return topic, config, data
+
 
 if __name__ == '__main__':
     unittest.main()
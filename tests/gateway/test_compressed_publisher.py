@@ -0,0 +1,128 @@
+#      Copyright 2022. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+
+import unittest
+from gzip import decompress
+
+from simplejson import dumps, loads
+
+from thingsboard_gateway.gateway.compressed_publisher import CompressedPublisher
+from thingsboard_gateway.gateway.data_size_accountant import DataSizeAccountant
+
+
+class StandInBroker:
+    """
+    Records the messages published by the gateway instead of a ThingsBoard MQTT broker
+    """
+
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, topic, payload, qos=0):
+        self.messages.append((topic, payload if isinstance(payload, bytes) else payload.encode('utf-8')))
+
+    def get_bytes_on_wire(self):
+        return sum(len(topic) + len(payload) for topic, payload in self.messages)
+
+    def get_received_data(self):
+        data = {}
+        for topic, payload in self.messages:
+            if topic.endswith('/compressed'):
+                payload = decompress(payload)
+            for device, telemetry in loads(payload).items():
+                data.setdefault(device, []).extend(telemetry)
+        return data
+
+
+class TestCompressedPublisher(unittest.TestCase):
+    MAX_PAYLOAD_SIZE_BYTES = 400
+    TOPICS = {"telemetryTopic": "v1/gateway/telemetry/compressed",
+              "attributesTopic": "v1/gateway/attributes/compressed"}
+
+    @staticmethod
+    def _get_devices_telemetry():
+        return {"Device %i" % device: [{"ts": 1650000000000 + index * 1000,
+                                        "values": {"temperature": 20 + index % 5, "humidity": 60,
+                                                   "status": "ok"}}
+                                       for index in range(20)]
+                for device in range(10)}
+
+    def _publish_split_json(self, broker, devices_telemetry):
+        # Same splitting as the gateway does without compression, one device message for every piece
+        pack = {}
+        accountant = DataSizeAccountant()
+        for device, telemetry in devices_telemetry.items():
+            for item in telemetry:
+                if accountant.get_size() >= self.MAX_PAYLOAD_SIZE_BYTES:
+                    for pack_device, pack_telemetry in pack.items():
+                        broker.publish('v1/gateway/telemetry', dumps({pack_device: pack_telemetry}))
+                    pack = {}
+                    accountant.clear()
+                pack.setdefault(device, []).append(item)
+                accountant.add_telemetry(device, item)
+        for pack_device, pack_telemetry in pack.items():
+            broker.publish('v1/gateway/telemetry', dumps({pack_device: pack_telemetry}))
+
+    def test_small_payload_is_sent_uncompressed(self):
+        publisher = CompressedPublisher({**self.TOPICS, "thresholdBytes": 1024})
+        broker = StandInBroker()
+        publisher.publish_telemetry(broker, {"Device A": [{"ts": 1, "values": {"temperature": 22}}]}, 1)
+
+        topic, payload = broker.messages[0]
+        self.assertEqual('v1/gateway/telemetry', topic)
+        self.assertDictEqual({"Device A": [{"ts": 1, "values": {"temperature": 22}}]}, loads(payload))
+
+    def test_large_payload_is_compressed(self):
+        publisher = CompressedPublisher({**self.TOPICS, "thresholdBytes": 100, "level": 9})
+        broker = StandInBroker()
+        devices_telemetry = self._get_devices_telemetry()
+        publisher.publish_telemetry(broker, devices_telemetry, 1)
+
+        topic, payload = broker.messages[0]
+        self.assertEqual('v1/gateway/telemetry/compressed', topic)
+        self.assertDictEqual(devices_telemetry, loads(decompress(payload)))
+        statistics = publisher.get_statistics('compression')
+        self.assertEqual(1, statistics['compressionCompressedMessages'])
+        self.assertLess(statistics['compressionSentBytes'], statistics['compressionRawBytes'])
+
+    def test_bytes_on_wire_against_split_json(self):
+        devices_telemetry = self._get_devices_telemetry()
+        split_broker = StandInBroker()
+        self._publish_split_json(split_broker, devices_telemetry)
+        compressed_broker = StandInBroker()
+        CompressedPublisher({**self.TOPICS, "thresholdBytes": 1024}).publish_telemetry(compressed_broker,
+                                                                                       devices_telemetry, 1)
+
+        self.assertDictEqual(split_broker.get_received_data(), compressed_broker.get_received_data())
+        self.assertGreater(len(split_broker.messages), len(compressed_broker.messages))
+        self.assertLess(compressed_broker.get_bytes_on_wire() * 5, split_broker.get_bytes_on_wire())
+
+    def test_plain_topics_used_without_compressed_topics(self):
+        publisher = CompressedPublisher({"thresholdBytes": 100})
+        broker = StandInBroker()
+        devices_telemetry = self._get_devices_telemetry()
+        publisher.publish_telemetry(broker, devices_telemetry, 1)
+        publisher.publish_attributes(broker, {"Device A": {"model": "T1000"}}, 1)
+
+        self.assertFalse(publisher.is_compression_enabled())
+        self.assertListEqual(['v1/gateway/telemetry', 'v1/gateway/attributes'],
+                             [topic for topic, _ in broker.messages])
+        self.assertDictEqual(devices_telemetry, loads(broker.messages[0][1]))
+
+    def test_unknown_algorithm_falls_back_to_gzip(self):
+        self.assertEqual('gzip', CompressedPublisher({"algorithm": "lz4"}).get_algorithm())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#      Copyright 2022. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+
+import unittest
+
+from simplejson import dumps
+
+from thingsboard_gateway.gateway.data_size_accountant import DataSizeAccountant
+
+
+class TestDataSizeAccountant(unittest.TestCase):
+    def setUp(self):
+        self.accountant = DataSizeAccountant()
+        self.pack = {}
+
+    def _add_device(self, device_name):
+        self.pack.setdefault(device_name, {"telemetry": [], "attributes": {}})
+        self.accountant.add_device(device_name)
+
+    def _add_telemetry(self, device_name, telemetry):
+        self._add_device(device_name)
+        self.pack[device_name]["telemetry"].append(telemetry)
+        self.accountant.add_telemetry(device_name, telemetry)
+
+    def _add_attributes(self, device_name, attributes):
+        self._add_device(device_name)
+        self.pack[device_name]["attributes"].update(attributes)
+        self.accountant.add_attributes(device_name, attributes)
+
+    def _assert_size(self):
+        self.assertEqual(len(dumps(self.pack)), self.accountant.get_size())
+
+    def test_empty_pack(self):
+        self._assert_size()
+        self._add_device("Device A")
+        self._assert_size()
+
+    def test_size_matches_serialized_pack(self):
+        self._add_telemetry("Device A", {"ts": 1, "values": {"temperature": 22.5}})
+        self._assert_size()
+        self._add_telemetry("Device A", {"ts": 2, "values": {"temperature": 23, "humidity": 40}})
+        self._add_attributes("Device A", {"model": "T-1000", "enabled": True})
+        self._assert_size()
+        self._add_attributes("Device B", {"name": "Gerät ☃"})
+        self._add_telemetry("Device B", {"values": {"status": None}})
+        self._assert_size()
+
+    def test_attribute_update_replaces_size(self):
+        self._add_attributes("Device A", {"firmware": "1.0", "serial": "A1"})
+        self._add_attributes("Device A", {"firmware": "1.0.12-beta"})
+        self._assert_size()
+
+    def test_clear_data_keeps_devices(self):
+        self._add_telemetry("Device A", {"ts": 1, "values": {"temperature": 22.5}})
+        self._add_attributes("Device B", {"model": "T-1000"})
+        for device_data in self.pack.values():
+            device_data["telemetry"] = []
+            device_data["attributes"] = {}
+        self.accountant.clear_data()
+        self._assert_size()
+
+        self.pack = {}
+        self.accountant.clear()
+        self._assert_size()
+
+
+if __name__ == '__main__':
+    unittest.main()
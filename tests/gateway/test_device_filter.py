@@ -0,0 +1,96 @@
+#      Copyright 2022. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+
+import unittest
+from os import path, remove, stat, utime
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from simplejson import dump
+
+from thingsboard_gateway.gateway.device_filter import DeviceFilter, DeviceNameMatcher
+
+
+class TestDeviceFilter(unittest.TestCase):
+    def test_matcher(self):
+        matcher = DeviceNameMatcher(["Device A", "Sensor .*", r"(\w)\1-pump", "Meter [0-9]+"])
+
+        self.assertSetEqual({"Device A"}, matcher.names)
+        self.assertEqual(2, len(matcher.regexes))
+        for device_name in ("Device A", "Sensor 1", "aa-pump", "Meter 42"):
+            self.assertTrue(matcher.match(device_name), device_name)
+        for device_name in ("Device AB", "ab-pump", "Meter 4x", "My Sensor 1"):
+            self.assertFalse(matcher.match(device_name), device_name)
+
+    def test_invalid_pattern_is_skipped(self):
+        matcher = DeviceNameMatcher(["Sensor (", "Meter .*"])
+
+        self.assertTrue(matcher.match("Meter 1"))
+        self.assertFalse(matcher.match("Sensor ("))
+
+    def test_verdict_cache_is_invalidated_on_reload(self):
+        with TemporaryDirectory() as config_dir:
+            config_path = path.join(config_dir, 'list.json')
+            with open(config_path, 'w') as file:
+                dump({"deny": {"MQTT": ["Sensor .*"]}, "allow": {}}, file)
+            device_filter = DeviceFilter(config_path)
+
+            self.assertFalse(device_filter.validate_device("MQTT", {"deviceName": "Sensor 1"}))
+            self.assertTrue(device_filter.validate_device("Modbus", {"deviceName": "Sensor 1"}))
+
+            with open(config_path, 'w') as file:
+                dump({"deny": {"MQTT": ["Meter .*"]}, "allow": {}}, file)
+            utime(config_path, (0, 0))
+            device_filter.reload_config_if_changed()
+
+            self.assertTrue(device_filter.validate_device("MQTT", {"deviceName": "Sensor 1"}))
+            self.assertFalse(device_filter.validate_device("MQTT", {"deviceName": "Meter 1"}))
+
+    def test_current_config_kept_when_reload_fails(self):
+        with TemporaryDirectory() as config_dir:
+            config_path = path.join(config_dir, 'list.json')
+            with open(config_path, 'w') as file:
+                dump({"deny": {"MQTT": ["Sensor .*"]}, "allow": {}}, file)
+            device_filter = DeviceFilter(config_path)
+
+            with open(config_path, 'w') as file:
+                file.write('{"deny": {"MQTT": ["Meter')
+            device_filter.reload_config_if_changed()
+            self.assertFalse(device_filter.validate_device("MQTT", {"deviceName": "Sensor 1"}))
+
+            remove(config_path)
+            device_filter.reload_config_if_changed()
+            self.assertFalse(device_filter.validate_device("MQTT", {"deviceName": "Sensor 1"}))
+
+            with open(config_path, 'w') as file:
+                dump({"deny": {"MQTT": ["Meter .*"]}, "allow": {}}, file)
+            device_filter.reload_config_if_changed()
+            self.assertTrue(device_filter.validate_device("MQTT", {"deviceName": "Sensor 1"}))
+
+    def test_config_not_reloaded_when_only_accessed(self):
+        with TemporaryDirectory() as config_dir:
+            config_path = path.join(config_dir, 'list.json')
+            with open(config_path, 'w') as file:
+                dump({"deny": {"MQTT": ["Sensor .*"]}, "allow": {}}, file)
+            device_filter = DeviceFilter(config_path)
+            config_stat = stat(config_path)
+
+            utime(config_path, (config_stat.st_atime + 100, config_stat.st_mtime))
+            with patch.object(device_filter, 'reload_config') as reload_config_mock:
+                device_filter.reload_config_if_changed()
+            reload_config_mock.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
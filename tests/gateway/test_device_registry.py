@@ -0,0 +1,69 @@
+#      Copyright 2022. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+
+import unittest
+from os import path
+from tempfile import TemporaryDirectory
+
+from simplejson import dump, load
+
+from thingsboard_gateway.gateway.device_registry import DeviceRegistry
+
+
+class TestDeviceRegistry(unittest.TestCase):
+    def test_changes_are_journaled(self):
+        with TemporaryDirectory() as config_dir:
+            file_path = path.join(config_dir, 'connected_devices.json')
+            with open(file_path, 'w') as devices_file:
+                dump({"Device A": ["MQTT", "default"]}, devices_file)
+            registry = DeviceRegistry(file_path)
+            self.assertDictEqual({"Device A": ["MQTT", "default"]}, registry.load())
+
+            registry.save("Device B", ["MQTT", "thermometer"])
+            registry.save_many({"Device A": None, "Device C": ["Modbus", "default", "Device D"]})
+            registry.save("Device B", ["MQTT", "thermometer"])
+
+            self.assertEqual(3, registry.get_journal_records_count())
+            with open(file_path) as devices_file:
+                self.assertDictEqual({"Device A": ["MQTT", "default"]}, load(devices_file))
+            self.assertDictEqual({"Device B": ["MQTT", "thermometer"], "Device C": ["Modbus", "default", "Device D"]},
+                                 DeviceRegistry(file_path).load())
+
+    def test_compaction(self):
+        with TemporaryDirectory() as config_dir:
+            file_path = path.join(config_dir, 'connected_devices.json')
+            registry = DeviceRegistry(file_path, max_journal_records=3)
+            registry.load()
+            for index in range(4):
+                registry.save("Device %i" % index, ["MQTT", "default"])
+
+            self.assertEqual(1, registry.get_journal_records_count())
+            with open(file_path) as devices_file:
+                self.assertEqual(3, len(load(devices_file)))
+            self.assertEqual(4, len(DeviceRegistry(file_path).load()))
+
+    def test_damaged_journal_line_is_skipped(self):
+        with TemporaryDirectory() as config_dir:
+            file_path = path.join(config_dir, 'connected_devices.json')
+            registry = DeviceRegistry(file_path)
+            registry.load()
+            registry.save("Device A", ["MQTT", "default"])
+            with open(file_path + '.journal', 'a') as journal_file:
+                journal_file.write('["Device B", ["MQ')
+
+            self.assertDictEqual({"Device A": ["MQTT", "default"]}, DeviceRegistry(file_path).load())
+
+
+if __name__ == '__main__':
+    unittest.main()
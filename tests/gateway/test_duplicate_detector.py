@@ -13,7 +13,10 @@
 #      limitations under the License.
 
 import unittest
+from os import path
+from tempfile import TemporaryDirectory
 from time import time
+from unittest.mock import patch
 
 from thingsboard_gateway.gateway.constants import *
 from thingsboard_gateway.gateway.duplicate_detector import DuplicateDetector
@@ -278,6 +281,64 @@ class TestDuplicateDetector(unittest.TestCase):
         actual_data3 = self._duplicate_detector.filter_data(self.CONNECTOR_NAME, expected_data)
         self.assertIsNone(actual_data3)
 
+    def test_least_recently_used_device_eviction(self):
+        duplicate_detector = DuplicateDetector(self.connectors, {"maxDevices": 2})
+
+        for device_name in ("Device A", "Device B", "Device A", "Device C"):
+            data = self._create_data_packet()
+            data[SEND_ON_CHANGE_PARAMETER] = True
+            data[DEVICE_NAME_PARAMETER] = device_name
+            duplicate_detector.filter_data(self.CONNECTOR_NAME, data)
+
+        self.assertEqual(2, duplicate_detector.get_devices_count())
+        data = self._create_data_packet()
+        data[SEND_ON_CHANGE_PARAMETER] = True
+        data[DEVICE_NAME_PARAMETER] = "Device A"
+        self.assertIsNone(duplicate_detector.filter_data(self.CONNECTOR_NAME, data))
+        data[DEVICE_NAME_PARAMETER] = "Device B"
+        self._is_data_packets_equal(duplicate_detector.filter_data(self.CONNECTOR_NAME, data), data)
+
+    def test_idle_devices_evicted_without_new_devices(self):
+        duplicate_detector = DuplicateDetector(self.connectors, {"deviceIdleTtlSec": 60})
+        data = self._create_data_packet()
+        data[SEND_ON_CHANGE_PARAMETER] = True
+        started = time()
+        duplicate_detector.filter_data(self.CONNECTOR_NAME, data)
+
+        with patch('thingsboard_gateway.gateway.duplicate_detector.time', return_value=started + 30):
+            duplicate_detector.evict_idle_devices()
+        self.assertEqual(1, duplicate_detector.get_devices_count())
+        with patch('thingsboard_gateway.gateway.duplicate_detector.time', return_value=started + 61):
+            duplicate_detector.evict_idle_devices()
+        self.assertEqual(0, duplicate_detector.get_devices_count())
+        self._is_data_packets_equal(duplicate_detector.filter_data(self.CONNECTOR_NAME, data), data)
+
+    def test_large_values_are_hashed(self):
+        duplicate_detector = DuplicateDetector(self.connectors, {"hashValuesLongerThan": 16})
+        large_value = "x" * 1000
+
+        data = self._create_data_packet(attributes=[{"largeAttribute": large_value}])
+        data[SEND_ON_CHANGE_PARAMETER] = True
+        self._is_data_packets_equal(duplicate_detector.filter_data(self.CONNECTOR_NAME, data), data)
+        self.assertIsNone(duplicate_detector.filter_data(self.CONNECTOR_NAME, data))
+
+        data = self._create_data_packet(attributes=[{"largeAttribute": large_value + "y"}], telemetry=[])
+        data[SEND_ON_CHANGE_PARAMETER] = True
+        self._is_data_packets_equal(duplicate_detector.filter_data(self.CONNECTOR_NAME, data), data)
+
+    def test_latest_values_survive_restart(self):
+        with TemporaryDirectory() as config_dir:
+            snapshot_path = path.join(config_dir, 'latest_values.json')
+            config = {"hashValuesLongerThan": 16}
+            duplicate_detector = DuplicateDetector(self.connectors, config, snapshot_path=snapshot_path)
+            data = self._create_data_packet(attributes=[{"largeAttribute": "x" * 1000}])
+            data[SEND_ON_CHANGE_PARAMETER] = True
+            duplicate_detector.filter_data(self.CONNECTOR_NAME, data)
+            duplicate_detector.persist_latest_values()
+
+            duplicate_detector = DuplicateDetector(self.connectors, config, snapshot_path=snapshot_path)
+            self.assertIsNone(duplicate_detector.filter_data(self.CONNECTOR_NAME, data))
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,48 @@
+#      Copyright 2022. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+
+import unittest
+
+from thingsboard_gateway.gateway.latency_histogram import LatencyHistogram
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    def test_empty_histogram(self):
+        histogram = LatencyHistogram()
+        self.assertIsNone(histogram.get_percentile(50))
+        self.assertEqual(0, histogram.get_statistics('latency')['latencyCount'])
+
+    def test_buckets_and_percentiles(self):
+        histogram = LatencyHistogram((10, 100))
+        for latency in (1, 2, 3, 4, 5, 6, 7, 8, 50, 700):
+            histogram.observe(latency)
+
+        statistics = histogram.get_statistics('latency')
+        self.assertEqual(8, statistics['latencyBucket10Ms'])
+        self.assertEqual(1, statistics['latencyBucket100Ms'])
+        self.assertEqual(1, statistics['latencyBucketInf'])
+        self.assertEqual(10, statistics['latencyCount'])
+        self.assertEqual(700, statistics['latencyMaxMs'])
+        self.assertEqual(10, statistics['latencyP50Ms'])
+        self.assertEqual(700, statistics['latencyP99Ms'])
+
+    def test_clear(self):
+        histogram = LatencyHistogram()
+        histogram.observe(3)
+        histogram.clear()
+        self.assertEqual(0, histogram.get_count())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#      Copyright 2022. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+
+import unittest
+
+from thingsboard_gateway.gateway.pack_size_controller import PackSizeController
+
+
+class TestPackSizeController(unittest.TestCase):
+    @staticmethod
+    def _create_controller(**config):
+        return PackSizeController({"enable": True, "maxPacksInFlight": 8, "maxPayloadSizeBytes": 1600,
+                                   "targetLatencyMs": 1000, "maxSendDelayMs": 1000, **config}, 1, 400, .2)
+
+    def test_disabled_controller_keeps_configured_values(self):
+        controller = PackSizeController({}, 2, 400, .2)
+        for _ in range(10):
+            controller.on_pack_acknowledged(.01, backlog=True)
+        controller.on_pack_failed(throttled=True)
+
+        self.assertEqual(2, controller.get_window())
+        self.assertEqual(400, controller.get_payload_size_bytes())
+        self.assertEqual(.2, controller.get_send_delay())
+
+    def test_grows_only_under_backlog(self):
+        controller = self._create_controller()
+        controller.on_pack_acknowledged(.01, backlog=False)
+        self.assertEqual(1, controller.get_window())
+
+        for _ in range(3):
+            controller.on_pack_acknowledged(.01, backlog=True)
+        self.assertEqual(4, controller.get_window())
+        self.assertEqual(1600, controller.get_payload_size_bytes())
+
+        for _ in range(20):
+            controller.on_pack_acknowledged(.01, backlog=True)
+        self.assertEqual(8, controller.get_window())
+
+    def test_slow_acknowledgement_halves_window(self):
+        controller = self._create_controller()
+        for _ in range(5):
+            controller.on_pack_acknowledged(.01, backlog=True)
+        self.assertEqual(6, controller.get_window())
+
+        controller.on_pack_acknowledged(2, backlog=True)
+        self.assertEqual(3, controller.get_window())
+        self.assertEqual(800, controller.get_payload_size_bytes())
+
+        # Above the slow start threshold the window grows by one per window of acknowledgements
+        for _ in range(3):
+            controller.on_pack_acknowledged(.01, backlog=True)
+        self.assertEqual(4, controller.get_window())
+
+    def test_failure_resets_window(self):
+        controller = self._create_controller()
+        for _ in range(5):
+            controller.on_pack_acknowledged(.01, backlog=True)
+        controller.on_pack_failed()
+
+        self.assertEqual(1, controller.get_window())
+        self.assertEqual(400, controller.get_payload_size_bytes())
+        self.assertEqual(.2, controller.get_send_delay())
+        self.assertEqual(3, controller.get_statistics('uplink')['uplinkSlowStartThreshold'])
+
+    def test_throttling_backs_off(self):
+        controller = self._create_controller()
+        for _ in range(5):
+            controller.on_pack_failed(throttled=True)
+        self.assertEqual(1, controller.get_send_delay())
+
+        controller.on_pack_acknowledged(.01, backlog=False)
+        self.assertEqual(.5, controller.get_send_delay())
+        statistics = controller.get_statistics('uplink')
+        self.assertEqual(5, statistics['uplinkThrottledPacks'])
+        self.assertEqual(500, statistics['uplinkSendDelayMs'])
+
+
+if __name__ == '__main__':
+    unittest.main()
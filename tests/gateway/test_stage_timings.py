@@ -0,0 +1,33 @@
+#      Copyright 2022. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+
+import unittest
+
+from thingsboard_gateway.gateway.stage_timings import StageTimings
+
+
+class TestStageTimings(unittest.TestCase):
+    def test_statistics(self):
+        timings = StageTimings()
+        timings.add('prepare', .001)
+        timings.add('prepare', .003)
+        timings.add('storagePut', .01)
+
+        self.assertDictEqual({'savePrepareCount': 2, 'savePrepareTotalMs': 4.0, 'savePrepareAvgMs': 2.0,
+                              'saveStoragePutCount': 1, 'saveStoragePutTotalMs': 10.0, 'saveStoragePutAvgMs': 10.0},
+                             timings.get_statistics('save'))
+
+
+if __name__ == '__main__':
+    unittest.main()
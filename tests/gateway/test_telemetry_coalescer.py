@@ -0,0 +1,66 @@
+#      Copyright 2022. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+
+import unittest
+
+from thingsboard_gateway.gateway.telemetry_coalescer import TelemetryCoalescer
+
+
+class TestTelemetryCoalescer(unittest.TestCase):
+    EVENTS = [
+        {"deviceName": "Device A", "telemetry": [{"ts": 100, "values": {"temperature": 20}}],
+         "attributes": [{"model": "T-1000"}]},
+        {"deviceName": "Device B", "telemetry": {"ts": 100, "values": {"humidity": 40}}, "attributes": []},
+        {"deviceName": "Device A", "telemetry": [{"ts": 100, "values": {"pressure": 1}}], "attributes": []},
+        {"deviceName": "Device A", "telemetry": [{"ts": 200, "values": {"temperature": 20, "pressure": 2}}],
+         "attributes": [{"firmware": "1.0"}]},
+        {"deviceName": "Device A", "telemetry": [{"ts": 300, "values": {"temperature": 20}}], "attributes": []},
+    ]
+
+    def test_coalesce_by_device_and_ts(self):
+        events = TelemetryCoalescer({}).coalesce(self.EVENTS)
+
+        self.assertListEqual([
+            {"deviceName": "Device A",
+             "telemetry": [{"ts": 100, "values": {"temperature": 20, "pressure": 1}},
+                           {"ts": 200, "values": {"temperature": 20, "pressure": 2}},
+                           {"ts": 300, "values": {"temperature": 20}}],
+             "attributes": {"model": "T-1000", "firmware": "1.0"}},
+            {"deviceName": "Device B", "telemetry": [{"ts": 100, "values": {"humidity": 40}}], "attributes": {}}
+        ], events)
+
+    def test_drop_unchanged_values(self):
+        events = TelemetryCoalescer({"sendDataOnlyOnChange": True}).coalesce(self.EVENTS)
+
+        self.assertListEqual([{"ts": 100, "values": {"temperature": 20, "pressure": 1}},
+                              {"ts": 200, "values": {"pressure": 2}}], events[0]["telemetry"])
+
+    def test_unchanged_value_sent_after_ttl(self):
+        events = TelemetryCoalescer({"sendDataOnlyOnChange": True, "sendDataOnlyOnChangeTtl": 150}).coalesce(
+            self.EVENTS)
+
+        self.assertListEqual([{"ts": 100, "values": {"temperature": 20, "pressure": 1}},
+                              {"ts": 200, "values": {"pressure": 2}},
+                              {"ts": 300, "values": {"temperature": 20}}], events[0]["telemetry"])
+
+    def test_events_are_not_changed(self):
+        event = {"deviceName": "Device A", "telemetry": [{"ts": 100, "values": {"temperature": 20}}],
+                 "attributes": []}
+        TelemetryCoalescer({}).coalesce([event, {**event, "telemetry": [{"ts": 100, "values": {"humidity": 1}}]}])
+
+        self.assertDictEqual({"temperature": 20}, event["telemetry"][0]["values"])
+
+
+if __name__ == '__main__':
+    unittest.main()
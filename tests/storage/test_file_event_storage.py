@@ -0,0 +1,278 @@
+#      Copyright 2022. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+
+import unittest
+from os import listdir
+from tempfile import TemporaryDirectory
+from time import sleep
+from unittest.mock import patch
+
+from simplejson import dump, load
+
+from thingsboard_gateway.storage.file.file_event_storage import FileEventStorage
+
+
+class TestFileEventStorage(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = TemporaryDirectory()
+        self.config = {
+            "data_folder_path": self.data_dir.name + "/",
+            "max_file_count": 100,
+            "max_records_per_file": 10,
+            "max_read_records_count": 10,
+            "max_records_between_fsync": 5,
+            "max_time_between_fsync_ms": 60000
+        }
+
+    def tearDown(self):
+        self.data_dir.cleanup()
+
+    def _read_all(self, storage, expected_count):
+        result = []
+        for _ in range(expected_count):
+            pack = storage.get_event_pack()
+            if not pack:
+                break
+            result.extend(pack)
+            storage.event_pack_processing_done()
+        return result
+
+    def test_write_and_read_across_files(self):
+        storage = FileEventStorage(self.config)
+        messages = [str(index) for index in range(35)]
+        for message in messages:
+            self.assertTrue(storage.put(message))
+
+        self.assertListEqual(messages, self._read_all(storage, len(messages)))
+        storage.stop()
+
+    def test_data_file_kept_open(self):
+        storage = FileEventStorage(self.config)
+        writer = storage._FileEventStorage__writer
+        storage.put("first")
+        opened_writer = writer.buffered_writer
+        for index in range(8):
+            storage.put(str(index))
+
+        self.assertIs(opened_writer, writer.buffered_writer)
+        self.assertFalse(opened_writer.closed)
+        storage.stop()
+        self.assertTrue(opened_writer.closed)
+
+    def test_fsync_by_records_count(self):
+        storage = FileEventStorage(self.config)
+        with patch('thingsboard_gateway.storage.file.event_storage_writer.fsync') as fsync_mock:
+            for index in range(9):
+                storage.put(str(index))
+            self.assertEqual(1, fsync_mock.call_count)
+
+            storage.stop()
+            self.assertEqual(2, fsync_mock.call_count)
+
+    def test_fsync_by_time_without_next_write(self):
+        storage = FileEventStorage({**self.config, "max_time_between_fsync_ms": 100})
+        with patch('thingsboard_gateway.storage.file.event_storage_writer.fsync') as fsync_mock:
+            for index in range(3):
+                storage.put(str(index))
+            self.assertEqual(0, fsync_mock.call_count)
+
+            sleep(.3)
+            self.assertEqual(1, fsync_mock.call_count)
+
+            storage.put("3")
+            sleep(.3)
+            self.assertEqual(2, fsync_mock.call_count)
+            storage.stop()
+            self.assertFalse(storage._FileEventStorage__writer.fsync_thread.is_alive())
+
+    def test_failed_write_is_reported(self):
+        storage = FileEventStorage(self.config)
+        writer = storage._FileEventStorage__writer
+        with patch.object(writer, 'write_records', side_effect=IOError("No space left on device")):
+            self.assertFalse(storage.put_many(["0", "1"]))
+
+        self.assertTrue(storage.put("2"))
+        self.assertListEqual(["2"], self._read_all(storage, 1))
+        storage.stop()
+
+    def test_binary_format(self):
+        storage = FileEventStorage({**self.config, "data_file_format": "binary"})
+        messages = ['{"deviceName": "Device %i", "telemetry": [{"temperature": %i}]}' % (index, index)
+                    for index in range(35)]
+        for message in messages:
+            storage.put(message)
+
+        self.assertListEqual(messages, self._read_all(storage, len(messages)))
+        storage.stop()
+
+    def test_binary_format_with_compression(self):
+        config = {**self.config, "data_file_format": "binary", "compression": "zlib", "compression_min_size_bytes": 0}
+        storage = FileEventStorage(config)
+        messages = ['{"deviceName": "Device", "telemetry": [{"value": "%s"}]}' % ("x" * 500) for _ in range(15)]
+        for message in messages:
+            storage.put(message)
+        storage.stop()
+
+        data_size = sum(len(open(self.data_dir.name + "/" + file, 'rb').read())
+                        for file in listdir(self.data_dir.name) if file.startswith('data_'))
+        self.assertLess(data_size, sum(len(message) for message in messages))
+
+        storage = FileEventStorage(config)
+        self.assertListEqual(messages, self._read_all(storage, len(messages)))
+        storage.stop()
+
+    def test_resume_from_state_file(self):
+        config = {**self.config, "data_file_format": "binary", "max_read_records_count": 4}
+        storage = FileEventStorage(config)
+        messages = [str(index) for index in range(8)]
+        for message in messages:
+            storage.put(message)
+        self.assertListEqual(messages[:4], storage.get_event_pack())
+        storage.event_pack_processing_done()
+        storage.stop()
+
+        storage = FileEventStorage(config)
+        self.assertListEqual(messages[4:], storage.get_event_pack())
+        storage.stop()
+
+    def test_legacy_files_drained_after_format_change(self):
+        storage = FileEventStorage(self.config)
+        legacy_messages = [str(index) for index in range(5)]
+        for message in legacy_messages:
+            storage.put(message)
+        storage.stop()
+
+        storage = FileEventStorage({**self.config, "data_file_format": "binary"})
+        binary_messages = [str(index) for index in range(5, 12)]
+        for message in binary_messages:
+            storage.put(message)
+
+        self.assertListEqual(legacy_messages + binary_messages, self._read_all(storage, 12))
+        storage.stop()
+
+    def test_corrupted_block_skipped(self):
+        storage = FileEventStorage({**self.config, "data_file_format": "binary"})
+        for index in range(10):
+            storage.put(str(index))
+        storage.put("next file")
+        storage.stop()
+
+        first_file = self.data_dir.name + "/" + sorted(file for file in listdir(self.data_dir.name)
+                                                       if file.startswith('data_'))[0]
+        with open(first_file, 'r+b') as data_file:
+            data_file.seek(-1, 2)
+            data_file.write(b'!')
+
+        storage = FileEventStorage({**self.config, "data_file_format": "binary"})
+        self.assertListEqual([str(index) for index in range(9)] + ["next file"], self._read_all(storage, 11))
+        storage.stop()
+
+    def _get_state_file_path(self):
+        return self.data_dir.name + "/" + [file for file in listdir(self.data_dir.name) if file.startswith('state_')][0]
+
+    def test_state_file_keeps_offset(self):
+        config = {**self.config, "max_records_per_file": 100, "max_read_records_count": 4}
+        storage = FileEventStorage(config)
+        for index in range(10):
+            storage.put(str(index))
+        storage.get_event_pack()
+        storage.event_pack_processing_done()
+        storage.stop()
+
+        with open(self._get_state_file_path()) as state_file:
+            state = load(state_file)
+        self.assertEqual(4, state['position'])
+        self.assertGreater(state['offset'], 0)
+
+        storage = FileEventStorage(config)
+        self.assertListEqual([str(index) for index in range(4, 8)], storage.get_event_pack())
+        storage.stop()
+
+    def test_position_recovered_with_index(self):
+        for data_file_format in ("base64", "binary"):
+            with self.subTest(data_file_format=data_file_format):
+                self.tearDown()
+                self.setUp()
+                config = {**self.config, "data_file_format": data_file_format, "max_records_per_file": 100,
+                          "max_read_records_count": 3, "index_interval_records": 4}
+                storage = FileEventStorage(config)
+                for index in range(20):
+                    storage.put(str(index))
+                storage.stop()
+                self.assertTrue([file for file in listdir(self.data_dir.name) if file.startswith('index_data_')])
+
+                # State file without an offset, as written by previous versions
+                with open(self._get_state_file_path()) as state_file:
+                    state = load(state_file)
+                with open(self._get_state_file_path(), 'w') as state_file:
+                    dump({"file": state["file"], "position": 9}, state_file)
+
+                storage = FileEventStorage(config)
+                self.assertListEqual(["9", "10", "11"], storage.get_event_pack())
+                storage.stop()
+
+    def test_mmap_reader(self):
+        for data_file_format in ("base64", "binary"):
+            with self.subTest(data_file_format=data_file_format):
+                self.tearDown()
+                self.setUp()
+                config = {**self.config, "data_file_format": data_file_format, "reader_mode": "mmap",
+                          "max_read_records_count": 7}
+                storage = FileEventStorage(config)
+                messages = ['{"deviceName": "Device %i"}' % index for index in range(45)]
+                for message in messages:
+                    storage.put(message)
+
+                self.assertListEqual(messages, self._read_all(storage, len(messages)))
+                self.assertEqual(1, len([file for file in listdir(self.data_dir.name) if file.startswith('data_')]))
+                storage.stop()
+
+
+    def test_put_many(self):
+        for data_file_format in ("base64", "binary"):
+            with self.subTest(data_file_format=data_file_format):
+                self.tearDown()
+                self.setUp()
+                config = {**self.config, "data_file_format": data_file_format, "max_read_records_count": 4}
+                storage = FileEventStorage(config)
+                messages = [str(index) for index in range(25)]
+                self.assertTrue(storage.put_many(messages[:23]))
+                self.assertTrue(storage.put_many(messages[23:]))
+
+                self.assertEqual(3, len([file for file in listdir(self.data_dir.name) if file.startswith('data_')]))
+                self.assertListEqual(messages[:4], storage.get_event_pack())
+                storage.event_pack_processing_done()
+                self.assertListEqual(messages[4:], self._read_all(storage, len(messages)))
+                storage.stop()
+
+    def test_read_ahead(self):
+        storage = FileEventStorage({**self.config, "max_read_records_count": 4})
+        messages = [str(index) for index in range(12)]
+        storage.put_many(messages)
+
+        self.assertListEqual(messages[:4], storage.get_event_pack())
+        self.assertListEqual(messages[4:8], storage.get_next_event_pack())
+        storage.event_pack_processing_done()
+        self.assertListEqual(messages[4:8], storage.get_event_pack())
+        self.assertListEqual(messages[8:], storage.get_next_event_pack())
+        storage.event_pack_processing_done()
+        storage.stop()
+
+        # Only confirmed packs are skipped after restart
+        storage = FileEventStorage({**self.config, "max_read_records_count": 4})
+        self.assertListEqual(messages[8:], storage.get_event_pack())
+        storage.stop()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+#      Copyright 2022. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+
+import unittest
+from tempfile import TemporaryDirectory
+from time import monotonic
+from unittest.mock import patch
+
+from thingsboard_gateway.storage.hybrid.hybrid_event_storage import HybridEventStorage
+
+
+class TestHybridEventStorage(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = TemporaryDirectory()
+        self.config = {"max_records_count": 100, "read_records_count": 4,
+                       "spill": {"type": "file", "data_folder_path": self.data_dir.name + "/",
+                                 "max_read_records_count": 4}}
+
+    def tearDown(self):
+        self.data_dir.cleanup()
+
+    @staticmethod
+    def _read_all(storage):
+        result = []
+        pack = storage.get_event_pack()
+        while pack:
+            result.extend(pack)
+            storage.event_pack_processing_done()
+            pack = storage.get_event_pack()
+        return result
+
+    def test_events_kept_in_memory_while_connected(self):
+        storage = HybridEventStorage(self.config)
+        for index in range(10):
+            storage.put(str(index))
+
+        self.assertEqual(0, storage.get_statistics()["spilledEvents"])
+        self.assertListEqual([str(index) for index in range(10)], self._read_all(storage))
+        storage.stop()
+
+    def test_events_spilled_while_disconnected(self):
+        storage = HybridEventStorage(self.config)
+        for index in range(6):
+            storage.put(str(index))
+        self.assertListEqual(["0", "1", "2", "3"], storage.get_event_pack())
+
+        storage.on_connection_state_changed(False)
+        for index in range(6, 10):
+            storage.put(str(index))
+        statistics = storage.get_statistics()
+        self.assertEqual(0, statistics["eventsInMemory"])
+        self.assertEqual(6, statistics["spilledEvents"])
+
+        storage.on_connection_state_changed(True)
+        storage.put("10")
+        self.assertListEqual([str(index) for index in range(11)], self._read_all(storage))
+        storage.stop()
+
+    def test_pack_confirmed_after_disconnect_is_not_lost(self):
+        storage = HybridEventStorage(self.config)
+        for index in range(6):
+            storage.put(str(index))
+        self.assertListEqual(["0", "1", "2", "3"], storage.get_event_pack())
+
+        storage.on_connection_state_changed(False)
+        for index in range(6, 10):
+            storage.put(str(index))
+        # The acknowledgement of the pack sent before the disconnection arrives late
+        storage.event_pack_processing_done()
+
+        storage.on_connection_state_changed(True)
+        self.assertListEqual([str(index) for index in range(4, 10)], self._read_all(storage))
+        storage.stop()
+
+    def test_pack_in_flight_drained_to_disk_on_stop(self):
+        storage = HybridEventStorage(self.config)
+        for index in range(6):
+            storage.put(str(index))
+        self.assertListEqual(["0", "1", "2", "3"], storage.get_event_pack())
+        storage.stop()
+        storage.event_pack_processing_done()
+
+        storage = HybridEventStorage(self.config)
+        self.assertListEqual([str(index) for index in range(6)], self._read_all(storage))
+        storage.stop()
+
+    def test_spill_mode_left_when_spill_storage_lost_events(self):
+        storage = HybridEventStorage(self.config)
+        spill_storage = storage._MemoryEventStorage__spill_storage
+        storage.on_connection_state_changed(False)
+        # E.g. removed by the TTL of the SQLite storage
+        with patch.object(spill_storage, 'put', return_value=True):
+            for index in range(3):
+                self.assertTrue(storage.put(str(index)))
+        storage.on_connection_state_changed(True)
+
+        self.assertListEqual([], storage.get_event_pack())
+        storage.put("3")
+        self.assertEqual(1, storage.get_statistics()["eventsInMemory"])
+        self.assertListEqual(["3"], self._read_all(storage))
+        storage.stop()
+
+    def test_wait_for_data_blocks_while_spill_storage_has_nothing_new(self):
+        storage = HybridEventStorage(self.config)
+        storage.on_connection_state_changed(False)
+        storage.put("0")
+        self.assertListEqual(["0"], storage.get_event_pack())
+        storage.event_pack_processing_done()
+        storage.wait_for_data(.1)
+
+        started = monotonic()
+        storage.wait_for_data(.2)
+        self.assertGreaterEqual(monotonic() - started, .15)
+        storage.stop()
+
+    def test_memory_drained_to_disk_on_stop(self):
+        storage = HybridEventStorage(self.config)
+        for index in range(5):
+            storage.put(str(index))
+        storage.stop()
+
+        storage = HybridEventStorage(self.config)
+        storage.put("5")
+        self.assertListEqual([str(index) for index in range(6)], self._read_all(storage))
+        storage.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
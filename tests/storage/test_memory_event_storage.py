@@ -0,0 +1,146 @@
+#      Copyright 2022. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+
+import unittest
+from tempfile import TemporaryDirectory
+from threading import Timer
+from time import monotonic
+
+from thingsboard_gateway.storage.memory.memory_event_storage import MemoryEventStorage
+
+
+class TestMemoryEventStorage(unittest.TestCase):
+    @staticmethod
+    def _read_all(storage):
+        result = []
+        pack = storage.get_event_pack()
+        while pack:
+            result.extend(pack)
+            storage.event_pack_processing_done()
+            pack = storage.get_event_pack()
+        return result
+
+    def test_full_storage_does_not_block(self):
+        storage = MemoryEventStorage({"max_records_count": 3, "read_records_count": 10})
+        results = [storage.put(str(index)) for index in range(5)]
+
+        self.assertListEqual([True, True, True, False, False], results)
+        self.assertListEqual(["0", "1", "2"], self._read_all(storage))
+        self.assertEqual(2, storage.get_statistics()["droppedNewestEvents"])
+
+    def test_bytes_budget_drop_newest(self):
+        storage = MemoryEventStorage({"max_size_bytes": 10, "read_records_count": 10})
+        self.assertTrue(storage.put("12345"))
+        self.assertTrue(storage.put("12345"))
+        self.assertFalse(storage.put("1"))
+
+        statistics = storage.get_statistics()
+        self.assertEqual(10, statistics["highWaterBytes"])
+        self.assertEqual(2, statistics["highWaterRecords"])
+
+    def test_bytes_budget_drop_oldest(self):
+        storage = MemoryEventStorage({"max_size_bytes": 10, "read_records_count": 10,
+                                      "overflow_policy": "drop_oldest"})
+        for event in ("aaaa", "bbbb", "cccc", "dddddddd"):
+            self.assertTrue(storage.put(event))
+
+        self.assertListEqual(["dddddddd"], self._read_all(storage))
+        self.assertEqual(3, storage.get_statistics()["droppedOldestEvents"])
+
+    def test_spill_keeps_order(self):
+        with TemporaryDirectory() as data_dir:
+            storage = MemoryEventStorage({"max_records_count": 5, "read_records_count": 3,
+                                          "overflow_policy": "spill",
+                                          "spill": {"type": "file", "data_folder_path": data_dir + "/",
+                                                    "max_records_per_file": 4, "max_read_records_count": 3}})
+            events = [str(index) for index in range(12)]
+            for event in events[:8]:
+                self.assertTrue(storage.put(event))
+
+            self.assertListEqual(["0", "1", "2"], storage.get_event_pack())
+            storage.event_pack_processing_done()
+            for event in events[8:]:
+                self.assertTrue(storage.put(event))
+
+            self.assertEqual(9, storage.len())
+            self.assertListEqual(events[3:], self._read_all(storage))
+            self.assertEqual(12, storage.get_statistics()["spilledEvents"])
+            storage.stop()
+
+    def test_spilled_events_read_after_restart(self):
+        with TemporaryDirectory() as data_dir:
+            config = {"max_records_count": 2, "read_records_count": 10, "overflow_policy": "spill",
+                      "spill": {"type": "file", "data_folder_path": data_dir + "/"}}
+            storage = MemoryEventStorage(config)
+            for event in ("0", "1", "2", "3"):
+                storage.put(event)
+            storage.stop()
+
+            storage = MemoryEventStorage(config)
+            storage.put("4")
+            self.assertListEqual(["0", "1", "2", "3", "4"], self._read_all(storage))
+            storage.stop()
+
+    def test_structured_events(self):
+        storage = MemoryEventStorage({"max_size_bytes": 200, "read_records_count": 10})
+        event = {"deviceName": "Device A", "telemetry": [{"ts": 1, "values": {"temperature": 22.5}}]}
+
+        self.assertTrue(storage.is_structured_events_supported())
+        self.assertTrue(storage.put(event))
+        self.assertGreater(storage.get_statistics()["bytesInMemory"], len("Device A"))
+        self.assertIs(event, storage.get_event_pack()[0])
+
+    def test_structured_events_spilled_as_json(self):
+        with TemporaryDirectory() as data_dir:
+            storage = MemoryEventStorage({"max_records_count": 1, "read_records_count": 10, "overflow_policy": "spill",
+                                          "spill": {"type": "file", "data_folder_path": data_dir + "/"}})
+            storage.put({"deviceName": "Device A"})
+            storage.put({"deviceName": "Device B"})
+
+            self.assertListEqual(['{"deviceName": "Device A"}', '{"deviceName": "Device B"}'], self._read_all(storage))
+            storage.stop()
+
+    def test_wait_for_data_wakes_up_on_put(self):
+        storage = MemoryEventStorage({"read_records_count": 10})
+        Timer(.05, storage.put, ("event",)).start()
+
+        started = monotonic()
+        storage.wait_for_data(5)
+        self.assertLess(monotonic() - started, 2)
+        self.assertListEqual(["event"], storage.get_event_pack())
+
+
+    def test_put_many(self):
+        storage = MemoryEventStorage({"max_records_count": 3, "read_records_count": 10})
+
+        self.assertTrue(storage.put_many(["0", "1"]))
+        self.assertFalse(storage.put_many(["2", "3"]))
+        self.assertListEqual(["0", "1", "2"], self._read_all(storage))
+
+    def test_read_ahead(self):
+        storage = MemoryEventStorage({"read_records_count": 2})
+        storage.put_many([str(index) for index in range(6)])
+
+        self.assertListEqual(["0", "1"], storage.get_event_pack())
+        self.assertListEqual(["2", "3"], storage.get_next_event_pack())
+        storage.event_pack_processing_done()
+        # Not confirmed packs are returned again in the same order
+        self.assertListEqual(["2", "3"], storage.get_event_pack())
+        self.assertListEqual(["4", "5"], storage.get_next_event_pack())
+        storage.event_pack_processing_done()
+        storage.event_pack_processing_done()
+        self.assertListEqual([], storage.get_event_pack())
+
+if __name__ == '__main__':
+    unittest.main()
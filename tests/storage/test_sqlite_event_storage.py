@@ -0,0 +1,115 @@
+#      Copyright 2022. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+
+import unittest
+from os import path
+from sqlite3 import connect
+from tempfile import TemporaryDirectory
+from time import sleep, time
+
+from thingsboard_gateway.storage.sqlite.sqlite_event_storage import SQLiteEventStorage
+
+
+class TestSQLiteEventStorage(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = TemporaryDirectory()
+        self.config = {
+            "data_file_path": path.join(self.data_dir.name, "data.db"),
+            "max_records_per_commit": 100,
+            "max_commit_delay_ms": 10
+        }
+        self.storage = SQLiteEventStorage(self.config)
+
+    def tearDown(self):
+        self.storage.stop()
+        self.data_dir.cleanup()
+
+    def _wait_for_pack(self, timeout=5):
+        deadline = time() + timeout
+        while time() < deadline:
+            pack = self.storage.get_event_pack()
+            if pack:
+                return pack
+            sleep(.05)
+        return []
+
+    def test_batched_write(self):
+        messages = [str(index) for index in range(250)]
+        for message in messages:
+            self.storage.put(message)
+
+        result = []
+        while len(result) < len(messages):
+            pack = self._wait_for_pack()
+            self.assertTrue(pack)
+            result.extend(pack)
+            self.storage.event_pack_processing_done()
+
+        self.assertListEqual(messages, result)
+
+    def test_read_pack_size(self):
+        self.storage.stop()
+        self.storage = SQLiteEventStorage({**self.config, "max_read_records_count": 7})
+        for index in range(20):
+            self.storage.put(str(index))
+
+        pack = self._wait_for_pack()
+        self.assertListEqual([str(index) for index in range(7)], list(pack))
+
+        # Pack must be returned again until it is acknowledged
+        self.assertListEqual(list(pack), list(self.storage.get_event_pack()))
+        self.storage.event_pack_processing_done()
+        self.assertListEqual([str(index) for index in range(7, 14)], list(self._wait_for_pack()))
+
+    def test_legacy_table_migration(self):
+        self.storage.stop()
+        legacy_path = path.join(self.data_dir.name, "legacy.db")
+        connection = connect(legacy_path)
+        connection.execute('''CREATE TABLE messages (timestamp INTEGER, message TEXT);''')
+        connection.executemany('''INSERT INTO messages (timestamp, message) VALUES (?, ?);''',
+                               [[3, "third"], [1, "first"], [2, "second"]])
+        connection.commit()
+        connection.close()
+
+        self.storage = SQLiteEventStorage({**self.config, "data_file_path": legacy_path})
+        self.assertListEqual(["first", "second", "third"], list(self.storage.get_event_pack()))
+
+    def test_wal_mode_enabled(self):
+        journal_mode = self.storage.db.db.execute('PRAGMA journal_mode;').fetchone()[0]
+        self.assertEqual('wal', journal_mode.lower())
+
+
+    def test_put_many(self):
+        self.assertTrue(self.storage.put_many(["0", "1", "2"]))
+        self.storage.put("3")
+
+        self.storage.wait_for_data(5)
+        self.assertListEqual(["0", "1", "2", "3"], list(self._wait_for_pack()))
+
+    def test_read_ahead(self):
+        self.storage.stop()
+        self.storage = SQLiteEventStorage({**self.config, "max_read_records_count": 2})
+        self.storage.put_many([str(index) for index in range(6)])
+        self.assertListEqual(["0", "1"], list(self._wait_for_pack()))
+
+        self.assertListEqual(["2", "3"], list(self.storage.get_next_event_pack()))
+        self.storage.event_pack_processing_done()
+        self.assertListEqual(["2", "3"], list(self.storage.get_event_pack()))
+        self.assertListEqual(["4", "5"], list(self.storage.get_next_event_pack()))
+        self.storage.event_pack_processing_done()
+        self.storage.event_pack_processing_done()
+        self.assertListEqual([], list(self.storage.get_event_pack()))
+
+if __name__ == '__main__':
+    unittest.main()
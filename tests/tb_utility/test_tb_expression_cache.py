@@ -0,0 +1,72 @@
+#      Copyright 2022. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+
+import unittest
+
+from thingsboard_gateway.tb_utility.tb_expression_cache import ExpressionCache
+from thingsboard_gateway.tb_utility.tb_utility import TBUtility
+
+
+class TestExpressionCache(unittest.TestCase):
+    def setUp(self):
+        self.compiled_expressions = []
+
+        def compile_expression(expression):
+            self.compiled_expressions.append(expression)
+            if not expression:
+                raise ValueError("Empty expression")
+            return expression.upper()
+
+        self.cache = ExpressionCache(compile_expression, max_size=2)
+
+    def test_least_recently_used_expression_is_evicted(self):
+        self.assertEqual("A", self.cache.get("a"))
+        self.assertEqual("B", self.cache.get("b"))
+        self.assertEqual("A", self.cache.get("a"))
+        self.assertEqual("C", self.cache.get("c"))
+        self.assertEqual("A", self.cache.get("a"))
+        self.assertEqual("B", self.cache.get("b"))
+
+        self.assertListEqual(["a", "b", "c", "b"], self.compiled_expressions)
+        self.assertDictEqual({"testHits": 2, "testMisses": 4, "testSize": 2}, self.cache.get_statistics("test"))
+
+    def test_compilation_error_is_cached(self):
+        for _ in range(3):
+            with self.assertRaises(ValueError):
+                self.cache.get("")
+
+        self.assertListEqual([""], self.compiled_expressions)
+
+    def test_utility_results_are_not_changed(self):
+        body = {"sensor": "SN-1", "data": {"values": [21.5, 22]}}
+        statistics = TBUtility.get_expression_cache_statistics("expressionCache")
+
+        for _ in range(2):
+            self.assertEqual("SN-1", TBUtility.get_value("${sensor}", body))
+            self.assertEqual(21.5, TBUtility.get_value("${data.values[0]}", body))
+            self.assertIsNone(TBUtility.get_value("${data.missing}", body))
+            self.assertEqual("${data.missing}", TBUtility.get_value("${data.missing}", body,
+                                                                    expression_instead_none=True))
+            self.assertListEqual(["SN-1", 22], TBUtility.get_values("${sensor} ${data.values[1]}", body))
+            self.assertEqual("devices/SN-1/temperature",
+                             TBUtility.replace_params_tags("devices/${sensor}/temperature", {"data": body}))
+
+        cached_statistics = TBUtility.get_expression_cache_statistics("expressionCache")
+        self.assertGreater(cached_statistics["expressionCacheJsonPathHits"], statistics["expressionCacheJsonPathHits"])
+        self.assertGreater(cached_statistics["expressionCacheTagPositionsHits"],
+                           statistics["expressionCacheTagPositionsHits"])
+
+
+if __name__ == '__main__':
+    unittest.main()
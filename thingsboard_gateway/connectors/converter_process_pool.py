@@ -0,0 +1,114 @@
+#      Copyright 2022. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+
+from hashlib import blake2b
+from multiprocessing import cpu_count, get_context
+from threading import Lock
+from weakref import WeakKeyDictionary
+
+from simplejson import dumps
+
+from thingsboard_gateway.tb_utility.tb_loader import TBModuleLoader
+
+# Converter instances of a pool process by the converter key, every item is [converter, config version]
+PROCESS_CONVERTERS = {}
+# (init config, config, config version) by the converter key, shared by the pool and its processes
+SHARED_CONVERTER_CONFIGS = None
+
+
+def init_process(shared_converter_configs):
+    global SHARED_CONVERTER_CONFIGS
+    SHARED_CONVERTER_CONFIGS = shared_converter_configs
+
+
+def convert_in_process(converter_key, extension_type, class_name, config_version, args):
+    process_converter = PROCESS_CONVERTERS.get(converter_key)
+    if process_converter is None or process_converter[1] != config_version:
+        # The configs are read from the shared dict only when the converter is created or its config is changed
+        init_config, config, config_version = SHARED_CONVERTER_CONFIGS[converter_key]
+        if process_converter is None:
+            converter_class = TBModuleLoader.import_module(extension_type, class_name)
+            if converter_class is None:
+                raise ImportError("Cannot find converter %s for %s connector" % (class_name, extension_type))
+            process_converter = PROCESS_CONVERTERS[converter_key] = [converter_class(init_config), config_version]
+        if config is not None:
+            process_converter[0].config = config
+        process_converter[1] = config_version
+    return process_converter[0].convert(*args)
+
+
+class ConverterProcessPool:
+    """
+    Runs the converters of a connector in worker processes, so CPU heavy conversions use more than one core.
+    Every process creates its own instance of a converter from its class name and constructor config, the state
+    of a converter is not shared between the processes and the connector. Converters are identified by the class
+    name and a hash of the constructor config, so converters rebuilt on reconnect reuse the process instances.
+    Converter config updates are passed to the processes only once. convert() blocks until the result is ready,
+    so the converted dicts come in call order.
+    """
+
+    def __init__(self, extension_type, processes_count=None):
+        self.__extension_type = extension_type
+        # Entries of the rebuilt converters are dropped together with the converters
+        self.__converters = WeakKeyDictionary()
+        self.__lock = Lock()
+        context = get_context('spawn')
+        self.__manager = context.Manager()
+        self.__shared_configs = self.__manager.dict()
+        # Spawned processes do not inherit the locks held by gateway threads, as forked ones would
+        self.__pool = context.Pool(processes_count or cpu_count(), initializer=init_process,
+                                   initargs=(self.__shared_configs,))
+
+    @staticmethod
+    def get_converter_key(converter, init_config):
+        config_hash = blake2b(dumps(init_config, sort_keys=True).encode('utf-8'), digest_size=16).hexdigest()
+        return converter.__class__.__name__, config_hash
+
+    def add_converter(self, converter, init_config):
+        converter_key = self.get_converter_key(converter, init_config)
+        config = getattr(converter, 'config', None)
+        with self.__lock:
+            if converter in self.__converters:
+                return
+            previous_configs = self.__shared_configs.get(converter_key)
+            if previous_configs is None:
+                config_version = 0
+                self.__shared_configs[converter_key] = (init_config, config, config_version)
+            elif previous_configs[1] == config:
+                config_version = previous_configs[2]
+            else:
+                # The process instances may have a config updated before the converter was rebuilt
+                config_version = previous_configs[2] + 1
+                self.__shared_configs[converter_key] = (init_config, config, config_version)
+            self.__converters[converter] = [converter_key, init_config, config, config_version]
+
+    def convert(self, converter, *args):
+        with self.__lock:
+            converter_entry = self.__converters[converter]
+            config = getattr(converter, 'config', None)
+            if config is not converter_entry[2]:
+                converter_entry[2] = config
+                converter_entry[3] += 1
+                self.__shared_configs[converter_entry[0]] = (converter_entry[1], config, converter_entry[3])
+            converter_key, config_version = converter_entry[0], converter_entry[3]
+        return self.__pool.apply_async(convert_in_process, (converter_key, self.__extension_type, converter_key[0],
+                                                            config_version, args)).get()
+
+    def get_converters_count(self):
+        return len(self.__converters)
+
+    def stop(self):
+        self.__pool.terminate()
+        self.__pool.join()
+        self.__manager.shutdown()
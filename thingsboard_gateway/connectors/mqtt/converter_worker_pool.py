@@ -0,0 +1,107 @@
+#      Copyright 2022. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+
+from queue import Full, Queue
+from threading import Event, Lock, Thread
+from time import perf_counter
+
+from thingsboard_gateway.connectors.connector import log
+from thingsboard_gateway.gateway.constants import ATTRIBUTES_PARAMETER, TELEMETRY_PARAMETER
+from thingsboard_gateway.gateway.latency_histogram import LatencyHistogram
+
+DEFAULT_WORKERS_COUNT = 4
+WORKER_JOIN_TIMEOUT_SEC = 5
+
+
+class ConverterWorkerPool:
+    """
+    Fixed set of converter threads, each with its own queue. Messages with the same shard key
+    (the topic) always go to the same worker, so they are converted and saved in the arrival order.
+    Workers block on their queues and are woken up by a message or by stop().
+    """
+
+    def __init__(self, name, send_result, workers_count=DEFAULT_WORKERS_COUNT, max_queue_size=0):
+        self.__name = name
+        self.__send_result = send_result
+        self.__queues = [Queue(max_queue_size) for _ in range(max(1, workers_count))]
+        self.__workers = []
+        self.__stopped = Event()
+        self.__lock = Lock()
+        self.__busy_workers = 0
+        self.__conversion_latency = LatencyHistogram()
+
+    def start(self):
+        for (index, queue) in enumerate(self.__queues):
+            worker = Thread(target=self.__process_queue, args=(queue,), daemon=True,
+                            name="%s converter worker %i" % (self.__name, index))
+            self.__workers.append(worker)
+            worker.start()
+
+    def stop(self, timeout=WORKER_JOIN_TIMEOUT_SEC):
+        """
+        Stops the workers without blocking on full queues, messages that are still queued are discarded
+        """
+        self.__stopped.set()
+        for queue in self.__queues:
+            try:
+                queue.put_nowait(None)
+            except Full:
+                # The worker sees the stop flag after its current message
+                pass
+        deadline = perf_counter() + timeout
+        for worker in self.__workers:
+            worker.join(max(0, deadline - perf_counter()))
+        self.__workers = []
+
+    def put(self, shard_key, convert_function, topic, content):
+        try:
+            self.__queues[hash(shard_key) % len(self.__queues)].put_nowait((convert_function, topic, content))
+            return True
+        except Full:
+            return False
+
+    def get_queue_depth(self):
+        return sum(queue.qsize() for queue in self.__queues)
+
+    def get_busy_workers(self):
+        return self.__busy_workers
+
+    def get_statistics(self, prefix):
+        statistics = {prefix + 'QueueDepth': self.get_queue_depth(),
+                      prefix + 'BusyWorkers': self.__busy_workers,
+                      prefix + 'Workers': len(self.__workers)}
+        statistics.update(self.__conversion_latency.get_statistics(prefix + 'ConversionLatency'))
+        return statistics
+
+    def __process_queue(self, queue):
+        while not self.__stopped.is_set():
+            item = queue.get()
+            if item is None:
+                break
+            with self.__lock:
+                self.__busy_workers += 1
+            try:
+                convert_function, topic, content = item
+                started = perf_counter()
+                converted_data = convert_function(topic, content)
+                self.__conversion_latency.observe((perf_counter() - started) * 1000)
+                log.debug(converted_data)
+                if converted_data and (converted_data.get(ATTRIBUTES_PARAMETER) or
+                                       converted_data.get(TELEMETRY_PARAMETER)):
+                    self.__send_result(topic, converted_data)
+            except Exception as e:
+                log.exception(e)
+            finally:
+                with self.__lock:
+                    self.__busy_workers -= 1
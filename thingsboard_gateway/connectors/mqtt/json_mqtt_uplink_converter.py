@@ -18,14 +18,20 @@ from simplejson import dumps
 
 from thingsboard_gateway.gateway.constants import SEND_ON_CHANGE_PARAMETER
 from thingsboard_gateway.connectors.mqtt.mqtt_uplink_converter import MqttUplinkConverter, log
+from thingsboard_gateway.tb_utility.tb_expression_plan import ExpressionPlan
 from thingsboard_gateway.tb_utility.tb_utility import TBUtility
 from thingsboard_gateway.gateway.statistics_service import StatisticsService
 
 
+# Marks the "*" entry of attributes or timeseries configuration, all keys of the message are sent
+ALL_KEYS_PLAN = '*'
+
+
 class JsonMqttUplinkConverter(MqttUplinkConverter):
     def __init__(self, config):
         self.__config = config.get('converter')
         self.__send_data_on_change = self.__config.get(SEND_ON_CHANGE_PARAMETER)
+        self.__compile_plans()
 
     @property
     def config(self):
@@ -34,6 +40,27 @@ class JsonMqttUplinkConverter(MqttUplinkConverter):
     @config.setter
     def config(self, value):
         self.__config = value
+        self.__compile_plans()
+
+    def __compile_plans(self):
+        # Expressions are parsed once here, messages are converted by executing the plans
+        self.__datatype_plans = {}
+        for datatype in ("attributes", "timeseries"):
+            plans = []
+            for datatype_config in self.__config.get(datatype, []):
+                if isinstance(datatype_config, str) and datatype_config == "*":
+                    plans.append(ALL_KEYS_PLAN)
+                elif isinstance(datatype_config, dict) and "key" in datatype_config and "value" in datatype_config:
+                    plans.append((ExpressionPlan(datatype_config["key"]), ExpressionPlan(datatype_config["value"])))
+                else:
+                    log.error("Invalid %s configuration %s, it will be skipped", datatype, datatype_config)
+            self.__datatype_plans[datatype] = plans
+        self.__device_name_plan = self.__compile_device_info_plan("deviceNameJsonExpression")
+        self.__device_type_plan = self.__compile_device_info_plan("deviceTypeJsonExpression")
+
+    def __compile_device_info_plan(self, json_expression_config_name):
+        expression = self.__config.get(json_expression_config_name)
+        return ExpressionPlan(expression) if expression is not None else None
 
     @StatisticsService.CollectStatistics(start_stat_type='receivedBytesFromDevices',
                                          end_stat_type='convertedBytesFromDevice')
@@ -50,8 +77,10 @@ class JsonMqttUplinkConverter(MqttUplinkConverter):
         datatypes = {"attributes": "attributes",
                      "timeseries": "telemetry"}
         dict_result = {
-            "deviceName": self.parse_device_name(topic, data, self.__config),
-            "deviceType": self.parse_device_type(topic, data, self.__config),
+            "deviceName": self.__parse_device_info(topic, data, self.__device_name_plan,
+                                                   "deviceNameJsonExpression", "deviceNameTopicExpression"),
+            "deviceType": self.__parse_device_info(topic, data, self.__device_type_plan,
+                                                   "deviceTypeJsonExpression", "deviceTypeTopicExpression"),
             "attributes": [],
             "telemetry": []
         }
@@ -63,35 +92,15 @@ class JsonMqttUplinkConverter(MqttUplinkConverter):
             for datatype in datatypes:
                 timestamp = data.get("ts", data.get("timestamp")) if datatype == 'timeseries' else None
                 dict_result[datatypes[datatype]] = []
-                for datatype_config in self.__config.get(datatype, []):
-                    if isinstance(datatype_config, str) and datatype_config == "*":
+                for plan in self.__datatype_plans[datatype]:
+                    if plan is ALL_KEYS_PLAN:
                         for item in data:
                             dict_result[datatypes[datatype]].append(
                                 self.create_timeseries_record(item, data[item], timestamp))
                     else:
-                        values = TBUtility.get_values(datatype_config["value"], data, datatype_config["type"],
-                                                      expression_instead_none=False)
-                        values_tags = TBUtility.get_values(datatype_config["value"], data, datatype_config["type"],
-                                                           get_tag=True)
-
-                        keys = TBUtility.get_values(datatype_config["key"], data, datatype_config["type"],
-                                                    expression_instead_none=False)
-                        keys_tags = TBUtility.get_values(datatype_config["key"], data, get_tag=True)
-
-                        full_key = datatype_config["key"]
-                        for (key, key_tag) in zip(keys, keys_tags):
-                            is_valid_key = "${" in datatype_config["key"] and "}" in \
-                                           datatype_config["key"]
-                            full_key = full_key.replace('${' + str(key_tag) + '}',
-                                                        str(key)) if is_valid_key else key_tag
-
-                        full_value = datatype_config["value"]
-                        for (value, value_tag) in zip(values, values_tags):
-                            is_valid_value = "${" in datatype_config["value"] and "}" in \
-                                             datatype_config["value"]
-
-                            full_value = full_value.replace('${' + str(value_tag) + '}',
-                                                            str(value)) if is_valid_value else value
+                        key_plan, value_plan = plan
+                        full_key = key_plan.execute(data)
+                        full_value = value_plan.execute(data)
 
                         if full_key != 'None' and full_value != 'None':
                             dict_result[datatypes[datatype]].append(
@@ -101,6 +110,18 @@ class JsonMqttUplinkConverter(MqttUplinkConverter):
             log.exception(e)
         return dict_result
 
+    def __parse_device_info(self, topic, data, json_expression_plan, json_expression_config_name,
+                            topic_expression_config_name):
+        if json_expression_plan is None or not isinstance(data, dict):
+            return self.parse_device_info(topic, data, self.__config, json_expression_config_name,
+                                          topic_expression_config_name)
+        try:
+            return json_expression_plan.execute(data, expression_instead_none=True)
+        except Exception as e:
+            log.error('Error in converter, for config: \n%s\n and message: \n%s\n', dumps(self.__config), data)
+            log.exception(e)
+        return None
+
     @staticmethod
     def create_timeseries_record(key, value, timestamp):
         value_item = {key: value}
@@ -15,18 +15,24 @@
 import random
 import ssl
 import string
-from queue import Queue
-from re import fullmatch, match, search
+from functools import partial
+from multiprocessing import cpu_count
+from queue import Empty, Queue
+from re import match, search
 from threading import Thread
 from time import sleep, time
 
 import simplejson
 
 from thingsboard_gateway.gateway.constants import SEND_ON_CHANGE_PARAMETER, DEFAULT_SEND_ON_CHANGE_VALUE, \
-    ATTRIBUTES_PARAMETER, TELEMETRY_PARAMETER, SEND_ON_CHANGE_TTL_PARAMETER, DEFAULT_SEND_ON_CHANGE_INFINITE_TTL_VALUE
+    SEND_ON_CHANGE_TTL_PARAMETER, DEFAULT_SEND_ON_CHANGE_INFINITE_TTL_VALUE
 from thingsboard_gateway.gateway.constant_enums import Status
 from thingsboard_gateway.connectors.connector import Connector, log
+from thingsboard_gateway.connectors.converter_process_pool import ConverterProcessPool
+from thingsboard_gateway.connectors.mqtt.converter_worker_pool import ConverterWorkerPool, DEFAULT_WORKERS_COUNT
 from thingsboard_gateway.connectors.mqtt.mqtt_decorators import CustomCollectStatistics
+from thingsboard_gateway.connectors.mqtt.topic_router import ATTRIBUTE_REQUEST_HANDLERS, CONNECT_REQUEST_HANDLERS, \
+    DEFAULT_MATCH_CACHE_SIZE, DISCONNECT_REQUEST_HANDLERS, MAPPING_HANDLERS, TopicRouter
 from thingsboard_gateway.tb_utility.tb_loader import TBModuleLoader
 from thingsboard_gateway.tb_utility.tb_utility import TBUtility
 from thingsboard_gateway.gateway.statistics_service import StatisticsService
@@ -41,6 +47,9 @@ except ImportError:
 from paho.mqtt.client import MQTTv31, MQTTv311, MQTTv5
 
 
+# The on message thread wakes up at least this often to check whether the connector is stopped
+ON_MESSAGE_QUEUE_GET_TIMEOUT_SEC = 1
+
 MQTT_VERSIONS = {
     3: MQTTv31,
     4: MQTTv311,
@@ -161,6 +170,8 @@ class MqttConnector(Connector, Thread):
         self.__connect_requests_sub_topics = {}
         self.__disconnect_requests_sub_topics = {}
         self.__attribute_requests_sub_topics = {}
+        # Resolves the regexes of all handler classes matching a topic with one lookup
+        self.__topic_router = TopicRouter(self.config.get('topicMatchCacheSize', DEFAULT_MATCH_CACHE_SIZE))
 
         # Set up external MQTT broker connection -----------------------------------------------------------------------
         client_id = self.__broker.get("clientId", ''.join(random.choice(string.ascii_lowercase) for _ in range(23)))
@@ -219,15 +230,34 @@ class MqttConnector(Connector, Thread):
         self.__stopped = False
         self.daemon = True
 
-        self.__msg_queue = Queue()
-        self.__workers_thread_pool = []
-        self.__max_msg_number_for_worker = config['broker'].get('maxMessageNumberPerWorker', 10)
-        self.__max_number_of_workers = config['broker'].get('maxNumberOfWorkers', 100)
+        self.__converter_process_pool = None
+        if self.__broker.get('convertInProcessPool'):
+            self.__converter_process_pool = ConverterProcessPool(self._connector_type,
+                                                                 self.__broker.get('converterProcessesCount'))
+        self.__converter_worker_pool = ConverterWorkerPool(self.name, self._save_converted_msg,
+                                                           workers_count=self.__get_workers_count(),
+                                                           max_queue_size=self.__broker.get('maxQueueSizePerWorker', 0))
+        self.__converter_worker_pool.start()
 
         self._on_message_queue = Queue()
         self._on_message_thread = Thread(name='On Message', target=self._process_on_message, daemon=True)
         self._on_message_thread.start()
 
+    def __get_workers_count(self):
+        if self.__broker.get('maxMessageNumberPerWorker') is not None:
+            self.__log.warning("'maxMessageNumberPerWorker' is deprecated and ignored, converter workers are "
+                               "not scaled by the queue size anymore")
+        if self.__broker.get('workersCount') is not None:
+            return self.__broker['workersCount']
+        if self.__broker.get('convertInProcessPool'):
+            # Every worker waits for one conversion in a process, the processes must be kept busy
+            return self.__broker.get('converterProcessesCount') or cpu_count()
+        if self.__broker.get('maxNumberOfWorkers') is not None:
+            self.__log.warning("'maxNumberOfWorkers' is deprecated, use 'workersCount' instead. "
+                               "%i converter workers will be started", self.__broker['maxNumberOfWorkers'])
+            return self.__broker['maxNumberOfWorkers']
+        return DEFAULT_WORKERS_COUNT
+
     def is_filtering_enable(self, device_name):
         return self.__send_data_only_on_change
 
@@ -292,7 +322,6 @@ class MqttConnector(Connector, Thread):
                 break
             elif not self._connected:
                 self.__connect()
-            self.__threads_manager()
             sleep(.2)
 
     def __connect(self):
@@ -314,6 +343,9 @@ class MqttConnector(Connector, Thread):
         except Exception as e:
             log.exception(e)
         self._client.loop_stop()
+        self.__converter_worker_pool.stop()
+        if self.__converter_process_pool is not None:
+            self.__converter_process_pool.stop()
         self.__log.info('%s has been stopped.', self.get_name())
 
     def get_name(self):
@@ -341,6 +373,7 @@ class MqttConnector(Connector, Thread):
                              extra_params)
 
             self.__mapping_sub_topics = {}
+            self.__topic_router.clear(MAPPING_HANDLERS)
 
             # Setup data upload requests handling ----------------------------------------------------------------------
             for mapping in self.__mapping:
@@ -380,6 +413,8 @@ class MqttConnector(Connector, Thread):
                             self.__log.debug('Converter %s for topic %s - found!', converter_class_name,
                                              mapping["topicFilter"])
                             converter = module(mapping)
+                            if self.__converter_process_pool is not None:
+                                self.__converter_process_pool.add_converter(converter, mapping)
                             if sharing_id:
                                 self.__shared_custom_converters[sharing_id] = converter
                         else:
@@ -403,6 +438,7 @@ class MqttConnector(Connector, Thread):
                         self.__mapping_sub_topics[regex_topic] = []
 
                     self.__mapping_sub_topics[regex_topic].append(converter)
+                    self.__topic_router.add(MAPPING_HANDLERS, regex_topic)
 
                     # Subscribe to appropriate topic -------------------------------------------------------------------
                     self.__subscribe(mapping["topicFilter"], mapping.get("subscriptionQos", 1))
@@ -420,6 +456,7 @@ class MqttConnector(Connector, Thread):
                 self.__subscribe(request["topicFilter"], request.get("subscriptionQos", 1))
                 topic_filter = TBUtility.topic_to_regex(request.get("topicFilter"))
                 self.__connect_requests_sub_topics[topic_filter] = request
+                self.__topic_router.add(CONNECT_REQUEST_HANDLERS, topic_filter)
 
             # Setup disconnection requests handling --------------------------------------------------------------------
             for request in [entry for entry in self.__disconnect_requests if entry is not None]:
@@ -427,6 +464,7 @@ class MqttConnector(Connector, Thread):
                 self.__subscribe(request["topicFilter"], request.get("subscriptionQos", 1))
                 topic_filter = TBUtility.topic_to_regex(request.get("topicFilter"))
                 self.__disconnect_requests_sub_topics[topic_filter] = request
+                self.__topic_router.add(DISCONNECT_REQUEST_HANDLERS, topic_filter)
 
             # Setup attributes requests handling -----------------------------------------------------------------------
             for request in [entry for entry in self.__attribute_requests if entry is not None]:
@@ -434,6 +472,7 @@ class MqttConnector(Connector, Thread):
                 self.__subscribe(request["topicFilter"], request.get("subscriptionQos", 1))
                 topic_filter = TBUtility.topic_to_regex(request.get("topicFilter"))
                 self.__attribute_requests_sub_topics[topic_filter] = request
+                self.__topic_router.add(ATTRIBUTE_REQUEST_HANDLERS, topic_filter)
         else:
             result_codes = RESULT_CODES_V5 if self._mqtt_version == 5 else RESULT_CODES_V3
             rc = result_code.value if self._mqtt_version == 5 else result_code
@@ -470,49 +509,43 @@ class MqttConnector(Connector, Thread):
             del self.__subscribes_sent[mid]
 
     def put_data_to_convert(self, converter, message, content) -> bool:
-        if not self.__msg_queue.full():
-            self.__msg_queue.put((converter.convert, message.topic, content), True, 100)
-            return True
-        return False
+        convert_function = converter.convert
+        if self.__converter_process_pool is not None:
+            convert_function = partial(self.__converter_process_pool.convert, converter)
+        return self.__converter_worker_pool.put(message.topic, convert_function, message.topic, content)
 
     def _save_converted_msg(self, topic, data):
         if self.__gateway.send_to_storage(self.name, data) == Status.SUCCESS:
             self.statistics['MessagesSent'] += 1
             self.__log.debug("Successfully converted message from topic %s", topic)
 
-    def __threads_manager(self):
-        if len(self.__workers_thread_pool) == 0:
-            worker = MqttConnector.ConverterWorker("Main", self.__msg_queue, self._save_converted_msg)
-            self.__workers_thread_pool.append(worker)
-            worker.start()
-
-        number_of_needed_threads = round(self.__msg_queue.qsize() / self.__max_msg_number_for_worker, 0)
-        threads_count = len(self.__workers_thread_pool)
-        if number_of_needed_threads > threads_count < self.__max_number_of_workers:
-            thread = MqttConnector.ConverterWorker(
-                "Worker " + ''.join(random.choice(string.ascii_lowercase) for _ in range(5)), self.__msg_queue,
-                self._save_converted_msg)
-            self.__workers_thread_pool.append(thread)
-            thread.start()
-        elif number_of_needed_threads < threads_count and threads_count > 1:
-            worker: MqttConnector.ConverterWorker = self.__workers_thread_pool[-1]
-            if not worker.in_progress:
-                worker.stopped = True
-                self.__workers_thread_pool.remove(worker)
+    def get_statistics(self, prefix):
+        statistics = self.__converter_worker_pool.get_statistics(prefix)
+        statistics[prefix + 'OnMessageQueueDepth'] = self._on_message_queue.qsize()
+        return statistics
 
     def _on_message(self, client, userdata, message):
         self._on_message_queue.put((client, userdata, message))
 
+    def __get_on_message(self):
+        try:
+            return self._on_message_queue.get(timeout=ON_MESSAGE_QUEUE_GET_TIMEOUT_SEC)
+        except Empty:
+            return None
+
     def _process_on_message(self):
         while not self.__stopped:
-            if not self._on_message_queue.empty():
-                client, userdata, message = self._on_message_queue.get()
+            on_message = self.__get_on_message()
+            if on_message is not None:
+                client, userdata, message = on_message
 
                 self.statistics['MessagesReceived'] += 1
                 content = TBUtility.decode(message)
 
+                matching_topics = self.__topic_router.get_matching_topics(message.topic)
+
                 # Check if message topic exists in mappings "i.e., I'm posting telemetry/attributes" -------------------
-                topic_handlers = [regex for regex in self.__mapping_sub_topics if fullmatch(regex, message.topic)]
+                topic_handlers = matching_topics.get(MAPPING_HANDLERS)
 
                 if topic_handlers:
                     # Note: every topic may be associated to one or more converter.
@@ -549,8 +582,7 @@ class MqttConnector(Connector, Thread):
                     continue
 
                 # Check if message topic exists in connection handlers "i.e., I'm connecting a device" -----------------
-                topic_handlers = [regex for regex in self.__connect_requests_sub_topics if
-                                  fullmatch(regex, message.topic)]
+                topic_handlers = matching_topics.get(CONNECT_REQUEST_HANDLERS)
 
                 if topic_handlers:
                     for topic in topic_handlers:
@@ -590,8 +622,7 @@ class MqttConnector(Connector, Thread):
                     continue
 
                 # Check if message topic exists in disconnection handlers "i.e., I'm disconnecting a device" -----------
-                topic_handlers = [regex for regex in self.__disconnect_requests_sub_topics if
-                                  fullmatch(regex, message.topic)]
+                topic_handlers = matching_topics.get(DISCONNECT_REQUEST_HANDLERS)
                 if topic_handlers:
                     for topic in topic_handlers:
                         handler = self.__disconnect_requests_sub_topics[topic]
@@ -632,8 +663,7 @@ class MqttConnector(Connector, Thread):
                     continue
 
                 # Check if message topic exists in attribute request handlers "i.e., I'm asking for a shared attribute"
-                topic_handlers = [regex for regex in self.__attribute_requests_sub_topics if
-                                  fullmatch(regex, message.topic)]
+                topic_handlers = matching_topics.get(ATTRIBUTE_REQUEST_HANDLERS)
                 if topic_handlers:
                     try:
                         for topic in topic_handlers:
@@ -702,8 +732,6 @@ class MqttConnector(Connector, Thread):
                                  message.topic,
                                  content)
 
-            sleep(.2)
-
     def notify_attribute(self, incoming_data, attribute_name, topic_expression, value_expression, retain):
         if incoming_data.get("device") is None or incoming_data.get("value", incoming_data.get('values')) is None:
             return
@@ -909,27 +937,3 @@ class MqttConnector(Connector, Thread):
 
     def _send_current_converter_config(self, name, config):
         self.__gateway.tb_client.client.send_attributes({name: config})
-
-    class ConverterWorker(Thread):
-        def __init__(self, name, incoming_queue, send_result):
-            super().__init__()
-            self.stopped = False
-            self.setName(name)
-            self.setDaemon(True)
-            self.__msg_queue = incoming_queue
-            self.in_progress = False
-            self.__send_result = send_result
-
-        def run(self):
-            while not self.stopped:
-                if not self.__msg_queue.empty():
-                    self.in_progress = True
-                    convert_function, config, incoming_data = self.__msg_queue.get(True, 100)
-                    converted_data = convert_function(config, incoming_data)
-                    log.debug(converted_data)
-                    if converted_data and (converted_data.get(ATTRIBUTES_PARAMETER) or
-                                           converted_data.get(TELEMETRY_PARAMETER)):
-                        self.__send_result(config, converted_data)
-                    self.in_progress = False
-                else:
-                    sleep(.2)
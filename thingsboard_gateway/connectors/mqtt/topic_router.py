@@ -0,0 +1,62 @@
+#      Copyright 2022. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+
+from functools import lru_cache
+from re import compile as compile_regex
+from threading import Lock
+
+MAPPING_HANDLERS = 'mapping'
+CONNECT_REQUEST_HANDLERS = 'connectRequests'
+DISCONNECT_REQUEST_HANDLERS = 'disconnectRequests'
+ATTRIBUTE_REQUEST_HANDLERS = 'attributeRequests'
+
+DEFAULT_MATCH_CACHE_SIZE = 10000
+
+
+class TopicRouter:
+    """
+    Keeps compiled topic regexes of all handler classes and returns the regexes matching a topic,
+    grouped by the handler class. Results are cached per topic until the regexes are changed.
+    """
+
+    def __init__(self, match_cache_size=DEFAULT_MATCH_CACHE_SIZE):
+        self.__lock = Lock()
+        # Every route is (handler class, regex topic, compiled regex), in the order of adding
+        self.__routes = ()
+        self.__get_matching_topics = lru_cache(maxsize=match_cache_size)(self.__match)
+
+    def add(self, handler_class, regex_topic):
+        with self.__lock:
+            if any(route[0] == handler_class and route[1] == regex_topic for route in self.__routes):
+                return
+            self.__routes = self.__routes + ((handler_class, regex_topic, compile_regex(regex_topic)),)
+            self.__get_matching_topics.cache_clear()
+
+    def clear(self, handler_class):
+        with self.__lock:
+            self.__routes = tuple(route for route in self.__routes if route[0] != handler_class)
+            self.__get_matching_topics.cache_clear()
+
+    def get_matching_topics(self, topic):
+        """
+        Returns {handler class: (regex topic, ...)} with the regexes that fully match the topic
+        """
+        return self.__get_matching_topics(topic)
+
+    def __match(self, topic):
+        matching_topics = {}
+        for handler_class, regex_topic, regex in self.__routes:
+            if regex.fullmatch(topic):
+                matching_topics[handler_class] = matching_topics.get(handler_class, ()) + (regex_topic,)
+        return matching_topics
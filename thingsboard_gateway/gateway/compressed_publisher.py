@@ -0,0 +1,111 @@
+#      Copyright 2022. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+
+from logging import getLogger
+from threading import Lock
+from zlib import DEFLATED, compressobj
+
+from simplejson import dumps
+
+log = getLogger("service")
+
+GZIP_ALGORITHM = 'gzip'
+ZSTD_ALGORITHM = 'zstd'
+
+GATEWAY_TELEMETRY_TOPIC = 'v1/gateway/telemetry'
+GATEWAY_ATTRIBUTES_TOPIC = 'v1/gateway/attributes'
+
+# zlib window bits value that makes zlib write the gzip header and trailer
+GZIP_WBITS = 31
+
+
+class CompressedPublisher:
+    """
+    Publishes multi-device gateway messages, payloads of at least "thresholdBytes" bytes are compressed
+    and sent to the compressed topics, smaller ones are sent as plain JSON to the standard gateway topics.
+    ThingsBoard does not subscribe to compressed topics, so they have to be set explicitly and the receiver
+    has to decompress the payload before passing it to ThingsBoard. Without a compressed topic the data
+    is sent uncompressed to the standard gateway topic.
+    """
+
+    def __init__(self, config):
+        self.__algorithm = config.get('algorithm', GZIP_ALGORITHM)
+        self.__level = config.get('level', 6)
+        self.__threshold_bytes = config.get('thresholdBytes', 1024)
+        self.__telemetry_topic = config.get('telemetryTopic')
+        self.__attributes_topic = config.get('attributesTopic')
+        if not self.is_compression_enabled():
+            log.warning("Compressed topics are not configured, data will be sent uncompressed to the standard "
+                        "gateway topics")
+        self.__zstd_compressor = None
+        if self.__algorithm == ZSTD_ALGORITHM:
+            try:
+                self.__zstd_compressor = self.__load_zstandard().ZstdCompressor(level=self.__level)
+            except Exception as e:
+                log.warning("zstd compression is not available (%s), gzip will be used", e)
+                self.__algorithm = GZIP_ALGORITHM
+        elif self.__algorithm != GZIP_ALGORITHM:
+            log.warning("Unknown compression algorithm %s, gzip will be used", self.__algorithm)
+            self.__algorithm = GZIP_ALGORITHM
+        self.__lock = Lock()
+        self.__statistics = {"RawBytes": 0, "SentBytes": 0, "CompressedMessages": 0, "PlainMessages": 0}
+
+    @staticmethod
+    def __load_zstandard():
+        try:
+            import zstandard
+        except ImportError:
+            from thingsboard_gateway.tb_utility.tb_utility import TBUtility
+            TBUtility.install_package('zstandard')
+            import zstandard
+        return zstandard
+
+    def get_algorithm(self):
+        return self.__algorithm
+
+    def is_compression_enabled(self):
+        return bool(self.__telemetry_topic or self.__attributes_topic)
+
+    def compress(self, payload):
+        if self.__zstd_compressor is not None:
+            return self.__zstd_compressor.compress(payload)
+        compressor = compressobj(self.__level, DEFLATED, GZIP_WBITS)
+        return compressor.compress(payload) + compressor.flush()
+
+    def encode(self, data, compression_allowed=True):
+        """
+        Returns the payload and True when the payload is compressed
+        """
+        payload = dumps(data).encode('utf-8')
+        compressed = compression_allowed and len(payload) >= self.__threshold_bytes
+        encoded_payload = self.compress(payload) if compressed else payload
+        with self.__lock:
+            self.__statistics["RawBytes"] += len(payload)
+            self.__statistics["SentBytes"] += len(encoded_payload)
+            self.__statistics["CompressedMessages" if compressed else "PlainMessages"] += 1
+        return encoded_payload, compressed
+
+    def publish_telemetry(self, client, devices_telemetry, qos):
+        return self.__publish(client, GATEWAY_TELEMETRY_TOPIC, self.__telemetry_topic, devices_telemetry, qos)
+
+    def publish_attributes(self, client, devices_attributes, qos):
+        return self.__publish(client, GATEWAY_ATTRIBUTES_TOPIC, self.__attributes_topic, devices_attributes, qos)
+
+    def __publish(self, client, topic, compressed_topic, data, qos):
+        payload, compressed = self.encode(data, compression_allowed=bool(compressed_topic))
+        return client.publish(compressed_topic if compressed else topic, payload, qos=qos)
+
+    def get_statistics(self, prefix):
+        with self.__lock:
+            return {prefix + key: value for key, value in self.__statistics.items()}
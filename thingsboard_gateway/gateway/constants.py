@@ -41,6 +41,8 @@ ATTRIBUTES_PARAMETER = "attributes"
 TELEMETRY_PARAMETER = "telemetry"
 TELEMETRY_TIMESTAMP_PARAMETER = "ts"
 TELEMETRY_VALUES_PARAMETER = "values"
+# Time in milliseconds when the gateway got the converted data, it is used only for latency statistics
+RECEIVED_TS_PARAMETER = "receivedTs"
 
 SEND_ON_CHANGE_PARAMETER = "sendDataOnlyOnChange"
 # TTL value in milliseconds
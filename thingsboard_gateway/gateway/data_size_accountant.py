@@ -0,0 +1,83 @@
+#      Copyright 2022. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+
+from simplejson import dumps
+
+# Sizes of the JSON separators produced by dumps with default settings
+ITEM_SEPARATOR_SIZE = len(', ')
+KEY_SEPARATOR_SIZE = len(': ')
+EMPTY_DEVICE_DATA_SIZE = len(dumps({"telemetry": [], "attributes": {}}))
+
+
+def get_json_size(data):
+    # dumps escapes non-ASCII characters by default, so the string length equals the size in bytes
+    return len(dumps(data))
+
+
+class DataSizeAccountant:
+    """
+    Tracks the JSON size of the {device name: {"telemetry": [...], "attributes": {...}}} event pack
+    while items are added, so the size check does not serialize the whole pack every time.
+    """
+
+    def __init__(self):
+        self.__size = len('{}')
+        self.__devices = {}
+
+    def get_size(self):
+        return self.__size
+
+    def add_device(self, device_name):
+        if device_name in self.__devices:
+            return
+        if self.__devices:
+            self.__size += ITEM_SEPARATOR_SIZE
+        self.__size += get_json_size(device_name) + KEY_SEPARATOR_SIZE + EMPTY_DEVICE_DATA_SIZE
+        self.__devices[device_name] = {"telemetry_count": 0, "attributes": {}}
+
+    def add_telemetry(self, device_name, telemetry):
+        self.add_device(device_name)
+        device = self.__devices[device_name]
+        if device["telemetry_count"]:
+            self.__size += ITEM_SEPARATOR_SIZE
+        self.__size += get_json_size(telemetry)
+        device["telemetry_count"] += 1
+
+    def add_attributes(self, device_name, attributes):
+        self.add_device(device_name)
+        device_attributes = self.__devices[device_name]["attributes"]
+        for key, value in attributes.items():
+            attribute_size = get_json_size(key) + KEY_SEPARATOR_SIZE + get_json_size(value)
+            previous_size = device_attributes.get(key)
+            if previous_size is not None:
+                self.__size += attribute_size - previous_size
+            else:
+                if device_attributes:
+                    self.__size += ITEM_SEPARATOR_SIZE
+                self.__size += attribute_size
+            device_attributes[key] = attribute_size
+
+    def clear_data(self):
+        """
+        Called when the pack is sent, devices are kept with empty telemetry and attributes
+        """
+        self.__size = len('{}')
+        devices = self.__devices
+        self.__devices = {}
+        for device_name in devices:
+            self.add_device(device_name)
+
+    def clear(self):
+        self.__size = len('{}')
+        self.__devices = {}
@@ -1,12 +1,63 @@
 import re
+from functools import lru_cache, partial
+from logging import getLogger
+from os import stat
 
 import simplejson
 
+log = getLogger("service")
+
+# A pattern without these characters matches only the same device name
+REGEX_SPECIAL_CHARACTERS = frozenset('.^$*+?{}[]\\|()')
+NUMBERED_BACKREFERENCE = re.compile(r'\\[1-9]')
+DEFAULT_VERDICT_CACHE_SIZE = 10000
+
+
+class DeviceNameMatcher:
+    """
+    Matches a device name against a list of patterns: literal names are looked up in a set,
+    the other patterns are compiled into one alternation.
+    """
+
+    def __init__(self, patterns):
+        self.names = set()
+        regex_patterns = []
+        for pattern in patterns:
+            if REGEX_SPECIAL_CHARACTERS.isdisjoint(pattern):
+                self.names.add(pattern)
+            else:
+                regex_patterns.append(pattern)
+        self.regexes = []
+        combined_patterns = []
+        for pattern in regex_patterns:
+            try:
+                regex = re.compile(pattern)
+            except re.error as e:
+                log.error("Invalid device filter pattern %s: %s", pattern, e)
+                continue
+            # Group numbers change in the alternation, so patterns with numbered backreferences stay separate
+            if NUMBERED_BACKREFERENCE.search(pattern):
+                self.regexes.append(regex)
+            else:
+                combined_patterns.append(pattern)
+        if combined_patterns:
+            try:
+                self.regexes.append(re.compile('|'.join('(?:%s)' % pattern for pattern in combined_patterns)))
+            except re.error:
+                # Patterns may not be combined when they use the same group name
+                self.regexes.extend(re.compile(pattern) for pattern in combined_patterns)
+
+    def match(self, device_name):
+        return device_name in self.names or any(regex.fullmatch(device_name) for regex in self.regexes)
+
 
 class DeviceFilter:
-    def __init__(self, config_path):
+    def __init__(self, config_path, verdict_cache_size=DEFAULT_VERDICT_CACHE_SIZE):
         self._config_path = config_path
+        self.__verdict_cache_size = verdict_cache_size
         self._config = self._load_config()
+        self._config_updated = self._get_config_updated()
+        self.__get_verdict = self.__create_verdict_cache(self._config)
 
     def _load_config(self):
         if self._config_path:
@@ -15,17 +66,47 @@ class DeviceFilter:
 
         return {'deny': {}, 'allow': {}}
 
+    def _get_config_updated(self):
+        if not self._config_path:
+            return None
+        config_stat = stat(self._config_path)
+        return config_stat.st_mtime, config_stat.st_size
+
+    def __create_verdict_cache(self, config):
+        deny_matchers = {con_name: DeviceNameMatcher(device_list) for con_name, device_list in config['deny'].items()}
+        allow_matchers = {con_name: DeviceNameMatcher(device_list)
+                          for con_name, device_list in config['allow'].items()}
+        # Verdicts depend only on the connector and the device name, so they are cached with the matchers.
+        # The cache is replaced together with the matchers, so no verdict of old matchers is kept after reload
+        return lru_cache(maxsize=self.__verdict_cache_size)(
+            partial(self.__validate_device_name, deny_matchers, allow_matchers))
+
+    def reload_config(self):
+        config_updated = self._get_config_updated()
+        config = self._load_config()
+        self.__get_verdict = self.__create_verdict_cache(config)
+        self._config = config
+        self._config_updated = config_updated
+
+    def reload_config_if_changed(self):
+        try:
+            if self._config_path and self._get_config_updated() != self._config_updated:
+                self.reload_config()
+        except Exception as e:
+            # The file may be missing or half written while it is saved, it is read again on the next check
+            log.error("Failed to reload device filter config %s, the current one is kept: %s", self._config_path, e)
+
     def validate_device(self, connector_name, data):
-        for con_name, device_list in self._config['deny'].items():
-            if con_name == connector_name:
-                for device in device_list:
-                    if re.fullmatch(device, data['deviceName']):
-                        return False
-
-        for con_name, device_list in self._config['allow'].items():
-            if con_name == connector_name:
-                for device in device_list:
-                    if re.fullmatch(device, data['deviceName']):
-                        return True
+        return self.__get_verdict(connector_name, data['deviceName'])
+
+    @staticmethod
+    def __validate_device_name(deny_matchers, allow_matchers, connector_name, device_name):
+        deny_matcher = deny_matchers.get(connector_name)
+        if deny_matcher is not None and deny_matcher.match(device_name):
+            return False
+
+        allow_matcher = allow_matchers.get(connector_name)
+        if allow_matcher is not None and allow_matcher.match(device_name):
+            return True
 
         return True
@@ -0,0 +1,124 @@
+#      Copyright 2022. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+
+from logging import getLogger
+from os import path, remove, replace
+from threading import RLock
+
+from simplejson import dumps, load, loads
+
+log = getLogger("service")
+
+JOURNAL_FILE_SUFFIX = '.journal'
+DEFAULT_MAX_JOURNAL_RECORDS = 10000
+
+
+class DeviceRegistry:
+    """
+    Keeps saved devices in the connected devices file as {device name: [connector name, device type, new name]}.
+    Changes are appended to the journal file next to it and the file is rewritten only when the journal
+    grows over "max_journal_records" changes, so a device change does not rewrite all devices.
+    """
+
+    def __init__(self, file_path, max_journal_records=DEFAULT_MAX_JOURNAL_RECORDS):
+        self.__file_path = file_path
+        self.__journal_path = file_path + JOURNAL_FILE_SUFFIX
+        self.__max_journal_records = max_journal_records
+        self.__lock = RLock()
+        self.__devices = {}
+        self.__journal_records = 0
+
+    def load(self):
+        """
+        Returns saved devices, the journal is applied to the devices read from the connected devices file
+        """
+        with self.__lock:
+            self.__devices = {}
+            if path.exists(self.__file_path) and path.getsize(self.__file_path) > 0:
+                try:
+                    with open(self.__file_path, 'r') as devices_file:
+                        self.__devices = load(devices_file)
+                except Exception as e:
+                    log.exception(e)
+            self.__journal_records = 0
+            if path.exists(self.__journal_path):
+                with open(self.__journal_path, 'r') as journal_file:
+                    for line in journal_file:
+                        try:
+                            device_name, device = loads(line)
+                        except ValueError:
+                            # The last line is incomplete when the gateway stopped in the middle of the write
+                            log.warning("Skipped damaged line of the connected devices journal")
+                            continue
+                        self.__apply(device_name, device)
+                        self.__journal_records += 1
+            return dict(self.__devices)
+
+    def __apply(self, device_name, device):
+        if device is None:
+            self.__devices.pop(device_name, None)
+        else:
+            self.__devices[device_name] = device
+
+    def save(self, device_name, device):
+        self.save_many({device_name: device})
+
+    def delete(self, device_name):
+        self.save_many({device_name: None})
+
+    def save_many(self, devices):
+        """
+        Saves {device name: device} changes with one journal write, None as a device deletes the device
+        """
+        with self.__lock:
+            changes = {device_name: device for device_name, device in devices.items()
+                       if self.__devices.get(device_name) != device}
+            if not changes:
+                return
+            for device_name, device in changes.items():
+                self.__apply(device_name, device)
+            try:
+                with open(self.__journal_path, 'a') as journal_file:
+                    journal_file.write(''.join(dumps([device_name, device]) + '\n'
+                                               for device_name, device in changes.items()))
+                self.__journal_records += len(changes)
+            except Exception as e:
+                log.exception(e)
+            if self.__journal_records >= self.__max_journal_records:
+                self.compact()
+
+    def clear(self):
+        with self.__lock:
+            self.__devices = {}
+            self.compact()
+
+    def compact(self):
+        """
+        Rewrites the connected devices file with all devices and clears the journal
+        """
+        with self.__lock:
+            temporary_path = self.__file_path + '.tmp'
+            try:
+                with open(temporary_path, 'w') as devices_file:
+                    devices_file.write(dumps(self.__devices, indent=2, sort_keys=True))
+                replace(temporary_path, self.__file_path)
+                if path.exists(self.__journal_path):
+                    remove(self.__journal_path)
+                self.__journal_records = 0
+                log.debug("Saved connected devices.")
+            except Exception as e:
+                log.exception(e)
+
+    def get_journal_records_count(self):
+        return self.__journal_records
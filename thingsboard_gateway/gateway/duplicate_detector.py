@@ -12,31 +12,156 @@
 #      See the License for the specific language governing permissions and
 #      limitations under the License.
 
-from time import time
+from collections import OrderedDict
+from hashlib import blake2b
 from logging import getLogger
+from os import path, replace
+from threading import RLock
+from time import time
+
+from simplejson import dump, load
+
 from thingsboard_gateway.gateway.constants import SEND_ON_CHANGE_PARAMETER, DEVICE_NAME_PARAMETER, \
     ATTRIBUTES_PARAMETER, TELEMETRY_PARAMETER, TELEMETRY_TIMESTAMP_PARAMETER, TELEMETRY_VALUES_PARAMETER, \
     DEVICE_TYPE_PARAMETER, SEND_ON_CHANGE_TTL_PARAMETER, DEFAULT_SEND_ON_CHANGE_INFINITE_TTL_VALUE
 
 log = getLogger("service")
 
+SNAPSHOT_VERSION = 1
+
+
+class HashedValue:
+    """
+    Digest kept instead of a large string value, only equality with other values matters
+    """
+    __slots__ = ('digest',)
+
+    def __init__(self, digest):
+        self.digest = digest
+
+    def __eq__(self, other):
+        return isinstance(other, HashedValue) and other.digest == self.digest
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.digest)
+
+
+class LatestValue:
+    __slots__ = ('value', 'ts')
+
+    def __init__(self, value, ts):
+        self.value = value
+        self.ts = ts
+
+
+class DeviceLatestData:
+    __slots__ = ('attributes', 'telemetry', 'last_activity')
+
+    def __init__(self, last_activity=0):
+        self.attributes = {}
+        self.telemetry = {}
+        self.last_activity = last_activity
+
+    def get(self, data_type):
+        return self.attributes if data_type == ATTRIBUTES_PARAMETER else self.telemetry
+
 
 class DuplicateDetector:
-    ABSENT_DATA_PAIR_VALUES = [None, 0]
+    ABSENT_DATA_PAIR_VALUES = LatestValue(None, 0)
 
-    def __init__(self, connectors):
-        self._latest_data = {}
+    def __init__(self, connectors, config=None, snapshot_path=None):
+        config = config or {}
         self._connectors = connectors
+        self._latest_data = OrderedDict()
+        self.__lock = RLock()
+        # 0 disables the limit
+        self.__max_devices = config.get('maxDevices', 0)
+        self.__device_idle_ttl_ms = config.get('deviceIdleTtlSec', 0) * 1000
+        self.__hash_values_longer_than = config.get('hashValuesLongerThan', 0)
+        self.__snapshot_path = snapshot_path
+        self.__changed_since_snapshot = False
+        if self.__snapshot_path is not None:
+            self.__load_latest_values()
 
     def rename_device(self, old_device_name, new_device_name):
-        self._latest_data[new_device_name] = self._latest_data.pop(old_device_name,
-                                                                   DuplicateDetector._create_device_latest_data())
+        with self.__lock:
+            self._latest_data[new_device_name] = self._latest_data.pop(old_device_name,
+                                                                       DuplicateDetector._create_device_latest_data())
+            self.__changed_since_snapshot = True
 
     def delete_device(self, device_name):
-        self._latest_data.pop(device_name, None)
+        with self.__lock:
+            self._latest_data.pop(device_name, None)
+            self.__changed_since_snapshot = True
+
+    def get_devices_count(self):
+        return len(self._latest_data)
+
+    def evict_idle_devices(self):
+        """
+        Called periodically, new devices evict the idle ones too, but a fixed set of devices never adds one
+        """
+        with self.__lock:
+            self.__evict_devices(int(time() * 1000))
 
     def persist_latest_values(self):
-        raise NotImplementedError("Persisting feature for latest attributes/telemetry values is not implemented!")
+        """
+        Writes the latest values to the snapshot file, so the filtering continues after restart
+        """
+        if self.__snapshot_path is None:
+            raise NotImplementedError("Snapshot file for latest attributes/telemetry values is not configured!")
+        with self.__lock:
+            if not self.__changed_since_snapshot:
+                return
+            snapshot = {"version": SNAPSHOT_VERSION,
+                        "devices": {device_name: self.__device_to_snapshot(device_data)
+                                    for device_name, device_data in self._latest_data.items()}}
+            self.__changed_since_snapshot = False
+        temporary_path = self.__snapshot_path + '.tmp'
+        try:
+            with open(temporary_path, 'w') as snapshot_file:
+                dump(snapshot, snapshot_file)
+            replace(temporary_path, self.__snapshot_path)
+        except Exception as e:
+            log.exception("Failed to persist latest values: %s", e)
+            self.__changed_since_snapshot = True
+
+    @staticmethod
+    def __device_to_snapshot(device_data):
+        return {"lastActivity": device_data.last_activity,
+                ATTRIBUTES_PARAMETER: DuplicateDetector.__values_to_snapshot(device_data.attributes),
+                TELEMETRY_PARAMETER: DuplicateDetector.__values_to_snapshot(device_data.telemetry)}
+
+    @staticmethod
+    def __values_to_snapshot(values):
+        # Hashed values are marked with the third item, they are never equal to a plain value
+        return {key: [latest.value.digest, latest.ts, True] if isinstance(latest.value, HashedValue)
+                else [latest.value, latest.ts]
+                for key, latest in values.items()}
+
+    def __load_latest_values(self):
+        if not path.exists(self.__snapshot_path):
+            return
+        try:
+            with open(self.__snapshot_path, 'r') as snapshot_file:
+                snapshot = load(snapshot_file)
+            if snapshot.get("version") != SNAPSHOT_VERSION:
+                log.warning("Unsupported latest values snapshot version %s, snapshot skipped",
+                            snapshot.get("version"))
+                return
+            for device_name, device_snapshot in snapshot["devices"].items():
+                device_data = DeviceLatestData(device_snapshot.get("lastActivity", 0))
+                for data_type in (ATTRIBUTES_PARAMETER, TELEMETRY_PARAMETER):
+                    values = device_data.get(data_type)
+                    for key, item in device_snapshot.get(data_type, {}).items():
+                        values[key] = LatestValue(HashedValue(item[0]) if len(item) > 2 else item[0], item[1])
+                self._latest_data[device_name] = device_data
+            log.info("Loaded latest values of %i devices", len(self._latest_data))
+        except Exception as e:
+            log.exception("Failed to load latest values snapshot: %s", e)
 
     def filter_data(self, connector_name, new_data):
         if new_data:
@@ -97,10 +222,7 @@ class DuplicateDetector:
 
     @staticmethod
     def _create_device_latest_data():
-        return {
-            ATTRIBUTES_PARAMETER: {},
-            TELEMETRY_PARAMETER: {}
-        }
+        return DeviceLatestData()
 
     def _update_latest_attribute_value(self, device_name, key, value, ts, ttl):
         return self._update_latest_value(device_name, ATTRIBUTES_PARAMETER, key, value, ts, ttl)
@@ -108,14 +230,47 @@ class DuplicateDetector:
     def _update_latest_telemetry_value(self, device_name, key, value, ts, ttl):
         return self._update_latest_value(device_name, TELEMETRY_PARAMETER, key, value, ts, ttl)
 
+    def __get_comparable_value(self, value):
+        if self.__hash_values_longer_than and isinstance(value, (str, bytes)) and \
+                len(value) > self.__hash_values_longer_than:
+            return HashedValue(blake2b(value.encode('utf-8') if isinstance(value, str) else value,
+                                       digest_size=16).hexdigest())
+        return value
+
     def _update_latest_value(self, device_name, data_type, key, value, ts, ttl):
-        if device_name not in self._latest_data:
-            self._latest_data[device_name] = DuplicateDetector._create_device_latest_data()
-            self._latest_data[device_name][data_type][key] = [value, ts]
-            return True
-
-        data_pair = self._latest_data[device_name][data_type].get(key, self.ABSENT_DATA_PAIR_VALUES)
-        if data_pair[0] != value or (ttl and (ts - data_pair[1]) > ttl):
-            self._latest_data[device_name][data_type][key] = [value, ts]
-            return True
-        return False
+        value = self.__get_comparable_value(value)
+        now = int(time() * 1000)
+        with self.__lock:
+            device_data = self._latest_data.get(device_name)
+            if device_data is None:
+                device_data = self._latest_data[device_name] = DuplicateDetector._create_device_latest_data()
+                device_data.get(data_type)[key] = LatestValue(value, ts)
+                device_data.last_activity = now
+                self.__changed_since_snapshot = True
+                self.__evict_devices(now)
+                return True
+
+            # Devices are kept in the order of activity, so the idle ones are at the beginning
+            self._latest_data.move_to_end(device_name)
+            device_data.last_activity = now
+            latest_value = device_data.get(data_type).get(key, self.ABSENT_DATA_PAIR_VALUES)
+            if latest_value.value != value or (ttl and (ts - latest_value.ts) > ttl):
+                device_data.get(data_type)[key] = LatestValue(value, ts)
+                self.__changed_since_snapshot = True
+                return True
+            return False
+
+    def __evict_devices(self, now):
+        evicted_count = 0
+        while self.__max_devices and len(self._latest_data) > self.__max_devices:
+            self._latest_data.popitem(last=False)
+            evicted_count += 1
+        while self.__device_idle_ttl_ms and self._latest_data:
+            device_data = next(iter(self._latest_data.values()))
+            if now - device_data.last_activity <= self.__device_idle_ttl_ms:
+                break
+            self._latest_data.popitem(last=False)
+            evicted_count += 1
+        if evicted_count:
+            self.__changed_since_snapshot = True
+            log.debug("%i devices evicted from the duplicate detector", evicted_count)
@@ -0,0 +1,68 @@
+#      Copyright 2022. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+
+from bisect import bisect_left
+from threading import Lock
+
+# Upper bounds of the buckets in milliseconds, the last bucket collects everything above
+DEFAULT_BUCKET_BOUNDS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+
+class LatencyHistogram:
+    def __init__(self, bucket_bounds_ms=DEFAULT_BUCKET_BOUNDS_MS):
+        self.__bounds = tuple(bucket_bounds_ms)
+        self.__lock = Lock()
+        self.__counts = [0] * (len(self.__bounds) + 1)
+        self.__count = 0
+        self.__max = 0
+
+    def observe(self, latency_ms):
+        with self.__lock:
+            self.__counts[bisect_left(self.__bounds, latency_ms)] += 1
+            self.__count += 1
+            self.__max = max(self.__max, latency_ms)
+
+    def get_count(self):
+        return self.__count
+
+    def get_percentile(self, percentile):
+        """
+        Returns the upper bound of the bucket that holds the percentile, None when nothing is observed
+        """
+        with self.__lock:
+            if not self.__count:
+                return None
+            rank = self.__count * percentile / 100
+            observed = 0
+            for index, bucket_count in enumerate(self.__counts):
+                observed += bucket_count
+                if bucket_count and observed >= rank:
+                    return self.__bounds[index] if index < len(self.__bounds) else self.__max
+        return self.__max
+
+    def get_statistics(self, prefix):
+        with self.__lock:
+            statistics = {prefix + 'Bucket' + str(bound) + 'Ms': count for bound, count in zip(self.__bounds, self.__counts)}
+            statistics[prefix + 'BucketInf'] = self.__counts[-1]
+            statistics[prefix + 'Count'] = self.__count
+            statistics[prefix + 'MaxMs'] = self.__max
+        statistics[prefix + 'P50Ms'] = self.get_percentile(50)
+        statistics[prefix + 'P99Ms'] = self.get_percentile(99)
+        return statistics
+
+    def clear(self):
+        with self.__lock:
+            self.__counts = [0] * (len(self.__bounds) + 1)
+            self.__count = 0
+            self.__max = 0
@@ -0,0 +1,117 @@
+#      Copyright 2022. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+
+from threading import Lock
+
+# The send delay never grows from zero, so throttling makes the gateway wait at least this long
+MIN_THROTTLING_SEND_DELAY_SEC = .1
+
+
+class PackSizeController:
+    """
+    Adapts the uplink like TCP congestion control. The window of packs in flight and the payload size grow
+    while there is a backlog and packs are acknowledged in time: by one pack per acknowledgement up to the slow
+    start threshold, by one pack per window of acknowledgements above it. Acknowledgements slower than
+    "targetLatencyMs" halve the window and the payload size, a failed pack sets them to the minimum.
+    Throttling doubles the send delay up to "maxSendDelayMs", acknowledged packs halve it back.
+    When the controller is disabled the configured values are used as is.
+    """
+
+    def __init__(self, config, max_packs_in_flight, payload_size_bytes, send_delay_sec):
+        self.__enabled = config.get('enable', False)
+        self.__lock = Lock()
+        self.__min_payload_size = config.get('minPayloadSizeBytes', payload_size_bytes)
+        self.__min_send_delay = send_delay_sec
+        if self.__enabled:
+            self.__max_window = max(config.get('maxPacksInFlight', max(max_packs_in_flight, 8)), 1)
+            self.__max_payload_size = max(config.get('maxPayloadSizeBytes', payload_size_bytes * 4),
+                                          self.__min_payload_size)
+            self.__window = 1
+            self.__payload_size = self.__min_payload_size
+        else:
+            self.__max_window = max_packs_in_flight
+            self.__max_payload_size = payload_size_bytes
+            self.__window = max_packs_in_flight
+            self.__payload_size = payload_size_bytes
+        self.__target_latency = config.get('targetLatencyMs', 1000) / 1000.0
+        self.__max_send_delay = max(config.get('maxSendDelayMs', 10000) / 1000.0, send_delay_sec)
+        self.__send_delay = send_delay_sec
+        self.__slow_start_threshold = self.__max_window
+        self.__acknowledged_in_window = 0
+        self.__statistics = {"AcknowledgedPacks": 0, "FailedPacks": 0, "ThrottledPacks": 0, "SlowPacks": 0}
+
+    def is_enabled(self):
+        return self.__enabled
+
+    def get_window(self):
+        return self.__window
+
+    def get_payload_size_bytes(self):
+        return self.__payload_size
+
+    def get_send_delay(self):
+        return self.__send_delay
+
+    def on_pack_acknowledged(self, latency_sec, backlog):
+        with self.__lock:
+            self.__statistics["AcknowledgedPacks"] += 1
+            if not self.__enabled:
+                return
+            self.__send_delay = max(self.__send_delay / 2, self.__min_send_delay)
+            if latency_sec > self.__target_latency:
+                self.__statistics["SlowPacks"] += 1
+                self.__decrease()
+            elif backlog:
+                self.__increase()
+
+    def on_pack_failed(self, throttled=False):
+        with self.__lock:
+            self.__statistics["ThrottledPacks" if throttled else "FailedPacks"] += 1
+            if not self.__enabled:
+                return
+            self.__slow_start_threshold = max(self.__window // 2, 1)
+            self.__window = 1
+            self.__payload_size = self.__min_payload_size
+            self.__acknowledged_in_window = 0
+            if throttled:
+                self.__send_delay = min(max(self.__send_delay * 2, MIN_THROTTLING_SEND_DELAY_SEC),
+                                        self.__max_send_delay)
+
+    def __increase(self):
+        if self.__window < self.__slow_start_threshold:
+            self.__grow()
+            return
+        self.__acknowledged_in_window += 1
+        if self.__acknowledged_in_window >= self.__window:
+            self.__acknowledged_in_window = 0
+            self.__grow()
+
+    def __grow(self):
+        self.__window = min(self.__window + 1, self.__max_window)
+        self.__payload_size = min(self.__payload_size + self.__min_payload_size, self.__max_payload_size)
+
+    def __decrease(self):
+        self.__slow_start_threshold = max(self.__window // 2, 1)
+        self.__window = self.__slow_start_threshold
+        self.__payload_size = max(self.__payload_size // 2, self.__min_payload_size)
+        self.__acknowledged_in_window = 0
+
+    def get_statistics(self, prefix):
+        with self.__lock:
+            statistics = {prefix + key: value for key, value in self.__statistics.items()}
+            statistics[prefix + 'Window'] = self.__window
+            statistics[prefix + 'SlowStartThreshold'] = self.__slow_start_threshold
+            statistics[prefix + 'PayloadSizeBytes'] = self.__payload_size
+            statistics[prefix + 'SendDelayMs'] = int(self.__send_delay * 1000)
+        return statistics
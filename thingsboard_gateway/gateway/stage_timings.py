@@ -0,0 +1,43 @@
+#      Copyright 2022. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+
+from threading import Lock
+
+
+class StageTimings:
+    """
+    Accumulates the time spent in the named stages of a processing pipeline
+    """
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.__stages = {}
+
+    def add(self, stage, duration_sec):
+        with self.__lock:
+            stage_timing = self.__stages.get(stage)
+            if stage_timing is None:
+                stage_timing = self.__stages[stage] = [0, 0.0]
+            stage_timing[0] += 1
+            stage_timing[1] += duration_sec
+
+    def get_statistics(self, prefix):
+        statistics = {}
+        with self.__lock:
+            for stage, (count, total_sec) in self.__stages.items():
+                stage_prefix = prefix + stage[0].upper() + stage[1:]
+                statistics[stage_prefix + 'Count'] = count
+                statistics[stage_prefix + 'TotalMs'] = round(total_sec * 1000, 3)
+                statistics[stage_prefix + 'AvgMs'] = round(total_sec * 1000 / count, 3)
+        return statistics
@@ -20,6 +20,7 @@ from time import sleep, time
 from os.path import exists
 from ssl import CERT_REQUIRED, PROTOCOL_TLSv1_2
 
+from paho.mqtt.client import MQTTMessageInfo
 from simplejson import dumps, load
 
 from thingsboard_gateway.tb_utility.tb_utility import TBUtility
@@ -30,6 +31,7 @@ except ImportError:
     print("tb-mqtt-client library not found - installing...")
     TBUtility.install_package('tb-mqtt-client')
     from tb_gateway_mqtt import TBGatewayMqttClient, TBDeviceMqttClient
+from tb_device_mqtt import TBPublishInfo
 
 log = logging.getLogger("tb_connection")
 
@@ -232,6 +234,30 @@ class TBClient(threading.Thread):
         self.unsubscribe('*')
         self.client.disconnect()
 
+    def publish(self, topic, payload, qos=None):
+        """
+        Publishes a prepared payload, e.g. compressed bytes, that the SDK send methods can not take.
+        The message is counted in the messages rate limit of the SDK client.
+        The SDK has no public API for raw payloads, its internals used here are those of the pinned
+        tb-mqtt-client 1.13 release (see requirements.txt).
+        """
+        qos = self.client.quality_of_service if qos is None else qos
+        # pylint: disable=protected-access
+        rate_limit = self.client._messages_rate_limit
+        if rate_limit.check_limit_reached():
+            return self.__get_failed_publish_info(TBPublishInfo.TB_ERR_QUEUE_SIZE)
+        if not self.is_connected():
+            return self.__get_failed_publish_info(TBPublishInfo.TB_ERR_NO_CONN)
+        publish_info = TBPublishInfo(self.client._client.publish(topic, payload, qos=qos))
+        rate_limit.increase_rate_limit_counter()
+        return publish_info
+
+    @staticmethod
+    def __get_failed_publish_info(result_code):
+        message_info = MQTTMessageInfo(0)
+        message_info.rc = result_code
+        return TBPublishInfo(message_info)
+
     def unsubscribe(self, subsription_id):
         self.client.gw_unsubscribe(subsription_id)
         self.client.unsubscribe_from_attribute(subsription_id)
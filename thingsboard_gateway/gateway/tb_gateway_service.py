@@ -19,27 +19,36 @@ import multiprocessing.managers
 import subprocess
 from os import execv, listdir, path, pathsep, stat, system, environ
 from platform import system as platform_system
-from queue import SimpleQueue
+from collections import deque
+from queue import Empty, SimpleQueue
 from random import choice
 from signal import signal, SIGINT
 from string import ascii_lowercase, hexdigits
-from sys import argv, executable, getsizeof
+from sys import argv, executable
 from threading import RLock, Thread, main_thread, current_thread
-from time import sleep, time
+from time import monotonic, perf_counter, sleep, time
 
 import simplejson
 from simplejson import JSONDecodeError, dumps, load, loads
 from yaml import safe_load
 
+from thingsboard_gateway.gateway.compressed_publisher import CompressedPublisher
 from thingsboard_gateway.gateway.constant_enums import DeviceActions, Status
 from thingsboard_gateway.gateway.constants import CONNECTED_DEVICES_FILENAME, CONNECTOR_PARAMETER, \
-    PERSISTENT_GRPC_CONNECTORS_KEY_FILENAME
-from thingsboard_gateway.gateway.device_filter import DeviceFilter
+    PERSISTENT_GRPC_CONNECTORS_KEY_FILENAME, RECEIVED_TS_PARAMETER
+from thingsboard_gateway.gateway.data_size_accountant import DataSizeAccountant, get_json_size
+from thingsboard_gateway.gateway.device_filter import DEFAULT_VERDICT_CACHE_SIZE, DeviceFilter
+from thingsboard_gateway.gateway.device_registry import DEFAULT_MAX_JOURNAL_RECORDS, DeviceRegistry
 from thingsboard_gateway.gateway.duplicate_detector import DuplicateDetector
+from thingsboard_gateway.gateway.latency_histogram import LatencyHistogram
+from thingsboard_gateway.gateway.pack_size_controller import PackSizeController
 from thingsboard_gateway.gateway.shell.proxy import AutoProxy
+from thingsboard_gateway.gateway.stage_timings import StageTimings
 from thingsboard_gateway.gateway.statistics_service import StatisticsService
 from thingsboard_gateway.gateway.tb_client import TBClient
+from thingsboard_gateway.gateway.telemetry_coalescer import TelemetryCoalescer
 from thingsboard_gateway.storage.file.file_event_storage import FileEventStorage
+from thingsboard_gateway.storage.hybrid.hybrid_event_storage import HybridEventStorage
 from thingsboard_gateway.storage.memory.memory_event_storage import MemoryEventStorage
 from thingsboard_gateway.storage.sqlite.sqlite_event_storage import SQLiteEventStorage
 from thingsboard_gateway.tb_utility.tb_gateway_remote_configurator import RemoteConfigurator
@@ -49,6 +58,8 @@ from thingsboard_gateway.tb_utility.tb_remote_shell import RemoteShell
 from thingsboard_gateway.tb_utility.tb_updater import TBUpdater
 from thingsboard_gateway.tb_utility.tb_utility import TBUtility
 
+from tb_device_mqtt import TBPublishInfo
+
 GRPC_LOADED = False
 try:
     from thingsboard_gateway.gateway.grpc_service.grpc_connector import GrpcConnector
@@ -90,6 +101,17 @@ DEFAULT_DEVICE_FILTER = {
 
 SECURITY_VAR = ('accessToken', 'caCert', 'privateKey', 'cert')
 
+# Worker threads block on their queues, the timeout only bounds the time to notice the gateway stop
+QUEUE_GET_TIMEOUT_SEC = 1
+# Max count of queued converted data items saved to the storage with one put_many call
+MAX_CONVERTED_DATA_BATCH_SIZE = 100
+# Max count of queued device actions saved to the device registry with one write
+MAX_DEVICE_ACTIONS_BATCH_SIZE = 100
+# Publish results that mean the client or the broker can not take more messages now
+THROTTLING_PUBLISH_RESULT_CODES = (TBPublishInfo.TB_ERR_QUEUE_SIZE, TBPublishInfo.TB_ERR_NOMEM)
+# A published pack without all acknowledgements after this time is failed and read from the storage again
+DEFAULT_PACK_ACK_TIMEOUT_SEC = 10
+
 
 def load_file(path_to_file):
     content = None
@@ -185,6 +207,8 @@ class TBGatewayService:
         self.__updates_check_time = 0
         self.version = self.__updater.get_version()
         log.info("ThingsBoard IoT gateway version: %s", self.version["current_version"])
+        if self.__config['thingsboard'].get('expressionCacheSize') is not None:
+            TBUtility.set_expression_cache_size(self.__config['thingsboard']['expressionCacheSize'])
         self.available_connectors = {}
         self.__connector_incoming_messages = {}
         self.__connected_devices = {}
@@ -212,15 +236,22 @@ class TBGatewayService:
         self.remote_handler = TBLoggerHandler(self)
         self.main_handler.setTarget(self.remote_handler)
         self._default_connectors = DEFAULT_CONNECTORS
-        self.__converted_data_queue = SimpleQueue()
-        self.__save_converted_data_thread = Thread(name="Save converted data", daemon=True,
-                                                   target=self.__send_to_storage)
-        self.__save_converted_data_thread.start()
+        self.__event_latency_histogram = LatencyHistogram()
+        self.__save_converted_data_timings = StageTimings()
+        save_converted_data_workers = max(self.__config["thingsboard"].get("saveConvertedDataWorkers", 1), 1)
+        self.__converted_data_queues = [SimpleQueue() for _ in range(save_converted_data_workers)]
+        self.__save_converted_data_threads = []
+        for worker_index, converted_data_queue in enumerate(self.__converted_data_queues):
+            save_converted_data_thread = Thread(name="Save converted data %i" % worker_index, daemon=True,
+                                                target=self.__send_to_storage, args=(converted_data_queue,))
+            save_converted_data_thread.start()
+            self.__save_converted_data_threads.append(save_converted_data_thread)
         self._implemented_connectors = {}
         self._event_storage_types = {
             "memory": MemoryEventStorage,
             "file": FileEventStorage,
             "sqlite": SQLiteEventStorage,
+            "hybrid": HybridEventStorage,
         }
         self.__gateway_rpc_methods = {
             "ping": self.__rpc_ping,
@@ -246,6 +277,17 @@ class TBGatewayService:
         self.__rpc_processing_thread = Thread(target=self.__send_rpc_reply_processing, daemon=True,
                                               name="RPC processing thread")
         self.__rpc_processing_thread.start()
+        self.__max_payload_size_bytes = self.__config['thingsboard'].get('maxPayloadSizeBytes', 400)
+        compression_config = self.__config['thingsboard'].get('compression', {})
+        self.__compressed_publisher = None
+        if compression_config.get('enable'):
+            self.__compressed_publisher = CompressedPublisher(compression_config)
+            if self.__compressed_publisher.is_compression_enabled():
+                # Converted data is split by this size too, so the compression gets large payloads
+                self.__max_payload_size_bytes = compression_config.get('maxPayloadSizeBytes',
+                                                                       self.__max_payload_size_bytes)
+                log.warning("Compressed publishing is enabled, payloads sent to the compressed topics must be "
+                            "decompressed before they reach ThingsBoard")
         self._event_storage = self._event_storage_types[self.__config["storage"]["type"]](self.__config["storage"])
         self.connectors_configs = {}
         self.__remote_configurator = None
@@ -260,6 +302,9 @@ class TBGatewayService:
             self.__grpc_manager.set_gateway_read_callbacks(self.__register_connector, self.__unregister_connector)
         self._load_connectors()
         self._connect_with_connectors()
+        self.__device_registry = DeviceRegistry(self._config_dir + CONNECTED_DEVICES_FILENAME,
+                                                self.__config['thingsboard'].get('maxConnectedDevicesJournalRecords',
+                                                                                 DEFAULT_MAX_JOURNAL_RECORDS))
         self.__load_persistent_devices()
 
         self.__devices_idle_checker = self.__config['thingsboard'].get('checkingDeviceActivity', {})
@@ -277,11 +322,18 @@ class TBGatewayService:
                                                               'configuration'] if self.__statistics.get(
                                                               'configuration') else None)
 
-        self._published_events = SimpleQueue()
-
         self.__min_pack_send_delay_ms = self.__config['thingsboard'].get('minPackSendDelayMS', 200)
         self.__min_pack_send_delay_ms = self.__min_pack_send_delay_ms / 1000.0
-        self.__min_pack_size_to_send = self.__config['thingsboard'].get('minPackSizeToSend', 50)
+        self.__max_packs_in_flight = max(self.__config['thingsboard'].get('maxPacksInFlight', 1), 1)
+        self.__pack_ack_timeout_sec = self.__config['thingsboard'].get('packAckTimeoutSec',
+                                                                       DEFAULT_PACK_ACK_TIMEOUT_SEC)
+        telemetry_coalescing_config = self.__config['thingsboard'].get('telemetryCoalescing', {})
+        self.__telemetry_coalescer = None
+        if telemetry_coalescing_config.get('enable'):
+            self.__telemetry_coalescer = TelemetryCoalescer(telemetry_coalescing_config)
+        self.__pack_size_controller = PackSizeController(self.__config['thingsboard'].get('adaptivePackSizing', {}),
+                                                         self.__max_packs_in_flight, self.__max_payload_size_bytes,
+                                                         self.__min_pack_send_delay_ms)
 
         self._send_thread = Thread(target=self.__read_data_from_storage, daemon=True,
                                    name="Send data to Thingsboard Thread")
@@ -291,9 +343,14 @@ class TBGatewayService:
         self.__device_filter = None
         if self.__device_filter_config['enable']:
             self.__device_filter = DeviceFilter(config_path=self._config_dir + self.__device_filter_config[
-                'filterFile'] if self.__device_filter_config.get('filterFile') else None)
+                'filterFile'] if self.__device_filter_config.get('filterFile') else None,
+                verdict_cache_size=self.__device_filter_config.get('verdictCacheSize', DEFAULT_VERDICT_CACHE_SIZE))
 
-        self.__duplicate_detector = DuplicateDetector(self.available_connectors)
+        self.__duplicate_detection_config = self.__config['thingsboard'].get('duplicateDetection', {})
+        snapshot_file = self.__duplicate_detection_config.get('snapshotFile')
+        self.__duplicate_detector = DuplicateDetector(self.available_connectors, self.__duplicate_detection_config,
+                                                      snapshot_path=self._config_dir + snapshot_file
+                                                      if snapshot_file else None)
 
         log.info("Gateway started.")
 
@@ -329,17 +386,18 @@ class TBGatewayService:
         try:
             gateway_statistic_send = 0
             connectors_configuration_check_time = 0
+            duplicate_detector_snapshot_time = time() * 1000
 
             while not self.stopped:
                 cur_time = time() * 1000
 
                 if not self.tb_client.is_connected() and self.__subscribed_to_rpc_topics:
                     self.__subscribed_to_rpc_topics = False
+                    self._event_storage.on_connection_state_changed(False)
 
                 if self.tb_client.is_connected() and not self.__subscribed_to_rpc_topics:
-                    for device in self.__saved_devices:
-                        self.add_device(device, {"connector": self.__saved_devices[device]["connector"]},
-                                        device_type=self.__saved_devices[device]["device_type"], reconnect=True)
+                    self._event_storage.on_connection_state_changed(True)
+                    self.__reconnect_saved_devices()
                     self.subscribe_to_required_topics()
                     self.__subscribed_to_rpc_topics = True
 
@@ -397,6 +455,13 @@ class TBGatewayService:
                     self.check_connector_configuration_updates()
                     connectors_configuration_check_time = time() * 1000
 
+                if cur_time - duplicate_detector_snapshot_time > self.__duplicate_detection_config.get(
+                        'snapshotPeriodInSeconds', 60) * 1000:
+                    self.__duplicate_detector.evict_idle_devices()
+                    if self.__duplicate_detection_config.get('snapshotFile'):
+                        self.__duplicate_detector.persist_latest_values()
+                    duplicate_detector_snapshot_time = time() * 1000
+
                 if cur_time - self.__updates_check_time >= self.__updates_check_period_ms:
                     self.__updates_check_time = time() * 1000
                     self.version = self.__updater.get_version()
@@ -430,6 +495,9 @@ class TBGatewayService:
         if self.__grpc_manager is not None:
             self.__grpc_manager.stop()
         self.__close_connectors()
+        self.__device_registry.compact()
+        if self.__duplicate_detection_config.get('snapshotFile'):
+            self.__duplicate_detector.persist_latest_values()
         self._event_storage.stop()
         log.info("The gateway has been stopped.")
         self.tb_client.disconnect()
@@ -525,8 +593,7 @@ class TBGatewayService:
             del self.__saved_devices[deleted_device_name]
             log.debug("Device %s - was removed from __saved_devices", deleted_device_name)
         self.__duplicate_detector.delete_device(deleted_device_name)
-        self.__save_persistent_devices()
-        self.__load_persistent_devices()
+        self.__save_persistent_devices(deleted_device_name)
 
     def __process_renamed_gateway_devices(self, renamed_device: dict):
         if self.__config.get('handleDeviceRenaming', True):
@@ -539,8 +606,7 @@ class TBGatewayService:
             self.__renamed_devices[device_name_key] = new_device_name
             self.__duplicate_detector.rename_device(old_device_name, new_device_name)
 
-            self.__save_persistent_devices()
-            self.__load_persistent_devices()
+            self.__save_persistent_devices(device_name_key)
             log.debug("Current renamed_devices dict: %s", self.__renamed_devices)
         else:
             log.debug("Received renamed device notification %r, but device renaming handle is disabled", renamed_device)
@@ -730,6 +796,8 @@ class TBGatewayService:
                        universal_newlines=True)
 
     def check_connector_configuration_updates(self):
+        if self.__device_filter:
+            self.__device_filter.reload_config_if_changed()
         configuration_changed = False
         for connector_type in self.connectors_configs:
             for connector_config in self.connectors_configs[connector_type]:
@@ -755,7 +823,7 @@ class TBGatewayService:
 
             filtered_data = self.__duplicate_detector.filter_data(connector_name, data)
             if filtered_data:
-                self.__converted_data_queue.put((connector_name, filtered_data), True, 100)
+                self.__put_converted_data(connector_name, filtered_data, int(time() * 1000))
                 return Status.SUCCESS
             else:
                 return Status.NO_NEW_DATA
@@ -763,106 +831,159 @@ class TBGatewayService:
             log.exception("Cannot put converted data!", e)
             return Status.FAILURE
 
-    def __send_to_storage(self):
+    def __get_converted_data_queue_index(self, data):
+        # Data of one device always goes to the same worker, so the order of its data is kept
+        return hash(data.get("deviceName")) % len(self.__converted_data_queues)
+
+    def __put_converted_data(self, connector_name, data, received_ts):
+        if len(self.__converted_data_queues) == 1:
+            self.__converted_data_queues[0].put((connector_name, data, received_ts), True, 100)
+            return
+
+        data_by_queue_index = {}
+        for item in (data if isinstance(data, list) else [data]):
+            data_by_queue_index.setdefault(self.__get_converted_data_queue_index(item), []).append(item)
+        for queue_index, queue_data in data_by_queue_index.items():
+            self.__converted_data_queues[queue_index].put((connector_name, queue_data, received_ts), True, 100)
+
+    def __send_to_storage(self, converted_data_queue):
         while not self.stopped:
             try:
-                if not self.__converted_data_queue.empty():
-                    connector_name, event = self.__converted_data_queue.get(True, 100)
+                try:
+                    converted_data = [converted_data_queue.get(True, QUEUE_GET_TIMEOUT_SEC)]
+                except Empty:
+                    continue
+                # Everything that is already queued is saved with one storage call
+                while len(converted_data) < MAX_CONVERTED_DATA_BATCH_SIZE:
+                    try:
+                        converted_data.append(converted_data_queue.get(False))
+                    except Empty:
+                        break
+
+                events_to_store = []
+                sources = set()
+                for connector_name, event, received_ts in converted_data:
                     data_array = event if isinstance(event, list) else [event]
                     for data in data_array:
-                        if not connector_name == self.name:
-                            if 'telemetry' not in data:
-                                data['telemetry'] = []
-                            if 'attributes' not in data:
-                                data['attributes'] = []
-                            if not TBUtility.validate_converted_data(data):
-                                log.error("Data from %s connector is invalid.", connector_name)
+                        try:
+                            started = perf_counter()
+                            data = self.__prepare_converted_data(connector_name, data, received_ts)
+                            prepared = perf_counter()
+                            self.__save_converted_data_timings.add('prepare', prepared - started)
+                            if data is None:
                                 continue
-                            if data.get('deviceType') is None:
-                                device_name = data['deviceName']
-                                if self.__connected_devices.get(device_name) is not None:
-                                    data["deviceType"] = self.__connected_devices[device_name]['device_type']
-                                elif self.__saved_devices.get(device_name) is not None:
-                                    data["deviceType"] = self.__saved_devices[device_name]['device_type']
-                                else:
-                                    data["deviceType"] = "default"
-                            if data["deviceName"] not in self.get_devices() and self.tb_client.is_connected():
-                                self.add_device(data["deviceName"],
-                                                {"connector": self.available_connectors[connector_name]},
-                                                device_type=data["deviceType"])
-                            if not self.__connector_incoming_messages.get(connector_name):
-                                self.__connector_incoming_messages[connector_name] = 0
-                            else:
-                                self.__connector_incoming_messages[connector_name] += 1
-                        else:
-                            data["deviceName"] = "currentThingsBoardGateway"
-                            data['deviceType'] = "gateway"
-
-                        if self.__check_devices_idle:
-                            self.__connected_devices[data['deviceName']]['last_receiving_data'] = time()
-
-                        data = self.__convert_telemetry_to_ts(data)
-
-                        max_data_size = self.__config["thingsboard"].get("maxPayloadSizeBytes", 400)
-                        if self.__get_data_size(data) >= max_data_size:
-                            # Data is too large, so we will attempt to send in pieces
-                            adopted_data = {"deviceName": data['deviceName'],
-                                            "deviceType": data['deviceType'],
-                                            "attributes": {},
-                                            "telemetry": []}
-                            empty_adopted_data_size = self.__get_data_size(adopted_data)
-                            adopted_data_size = empty_adopted_data_size
-
-                            # First, loop through the attributes
-                            for attribute in data['attributes']:
-                                adopted_data['attributes'].update(attribute)
-                                adopted_data_size += self.__get_data_size(attribute)
-                                if adopted_data_size >= max_data_size:
-                                    # We have surpassed the max_data_size, so send what we have and clear attributes
-                                    self.__send_data_pack_to_storage(adopted_data, connector_name)
-                                    adopted_data['attributes'] = {}
-                                    adopted_data_size = empty_adopted_data_size
-
-                            # Now, loop through telemetry. Possibly have some unsent attributes that have been adopted.
-                            telemetry = data['telemetry'] if isinstance(data['telemetry'], list) else [data['telemetry']]
-                            ts_to_index = {}
-                            for ts_kv_list in telemetry:
-                                ts = ts_kv_list['ts']
-                                for kv in ts_kv_list['values']:
-                                    if ts in ts_to_index:
-                                        kv_data = {kv: ts_kv_list['values'][kv]}
-                                        adopted_data['telemetry'][ts_to_index[ts]]['values'].update(kv_data)
-                                    else:
-                                        kv_data = {'ts': ts, 'values': {kv: ts_kv_list['values'][kv]}}
-                                        adopted_data['telemetry'].append(kv_data)
-                                        ts_to_index[ts] = len(adopted_data['telemetry']) - 1
-
-                                    adopted_data_size += self.__get_data_size(kv_data)
-                                    if adopted_data_size >= max_data_size:
-                                        # we have surpassed the max_data_size, so send what we have and clear attributes and telemetry
-                                        self.__send_data_pack_to_storage(adopted_data, connector_name)
-                                        adopted_data['telemetry'] = []
-                                        adopted_data['attributes'] = {}
-                                        adopted_data_size = empty_adopted_data_size
-                                        ts_to_index = {}
-
-                            # It is possible that we get here and have some telemetry or attributes not yet sent, so check for that.
-                            if len(adopted_data['telemetry']) > 0 or len(adopted_data['attributes']) > 0:
-                                self.__send_data_pack_to_storage(adopted_data, connector_name)
-                                # technically unnecessary to clear here, but leaving for consistency.
-                                adopted_data['telemetry'] = []
-                                adopted_data['attributes'] = {}
-                        else:
-                            self.__send_data_pack_to_storage(data, connector_name)
-
-                else:
-                    sleep(0.2)
+                            sources.add((connector_name, data["deviceName"]))
+                            self.__split_data_pack(data, events_to_store)
+                            self.__save_converted_data_timings.add('serialize', perf_counter() - prepared)
+                        except Exception as e:
+                            log.error(e)
+
+                if events_to_store:
+                    started = perf_counter()
+                    if not self._event_storage.put_many(events_to_store):
+                        log.error('Data cannot be saved for (connector, device): %s.',
+                                  ', '.join('(%s, %s)' % source for source in sources))
+                    self.__save_converted_data_timings.add('storagePut', perf_counter() - started)
             except Exception as e:
                 log.error(e)
 
-    @staticmethod
-    def __get_data_size(data: dict):
-        return getsizeof(str(data))
+    def __prepare_converted_data(self, connector_name, data, received_ts):
+        if not connector_name == self.name:
+            if 'telemetry' not in data:
+                data['telemetry'] = []
+            if 'attributes' not in data:
+                data['attributes'] = []
+            if not TBUtility.validate_converted_data(data):
+                log.error("Data from %s connector is invalid.", connector_name)
+                return None
+            # Several save workers prepare data at the same time
+            with self.__lock:
+                if data.get('deviceType') is None:
+                    device_name = data['deviceName']
+                    if self.__connected_devices.get(device_name) is not None:
+                        data["deviceType"] = self.__connected_devices[device_name]['device_type']
+                    elif self.__saved_devices.get(device_name) is not None:
+                        data["deviceType"] = self.__saved_devices[device_name]['device_type']
+                    else:
+                        data["deviceType"] = "default"
+                if data["deviceName"] not in self.get_devices() and self.tb_client.is_connected():
+                    self.add_device(data["deviceName"],
+                                    {"connector": self.available_connectors[connector_name]},
+                                    device_type=data["deviceType"])
+                if not self.__connector_incoming_messages.get(connector_name):
+                    self.__connector_incoming_messages[connector_name] = 0
+                else:
+                    self.__connector_incoming_messages[connector_name] += 1
+        else:
+            data["deviceName"] = "currentThingsBoardGateway"
+            data['deviceType'] = "gateway"
+
+        if self.__check_devices_idle:
+            with self.__lock:
+                self.__connected_devices[data['deviceName']]['last_receiving_data'] = time()
+
+        data = self.__convert_telemetry_to_ts(data)
+        data[RECEIVED_TS_PARAMETER] = received_ts
+        return data
+
+    def __split_data_pack(self, data, events_to_store):
+        max_data_size = self.__max_payload_size_bytes
+        if self._event_storage.is_structured_events_supported():
+            # The storage keeps dicts, so the size is estimated without serialization
+            json_data = None
+            data_size = self._event_storage.get_event_size(data)
+        else:
+            json_data = dumps(data)
+            data_size = len(json_data)
+        if data_size >= max_data_size:
+            # Data is too large, so we will attempt to send in pieces
+            adopted_data = {"deviceName": data['deviceName'],
+                            "deviceType": data['deviceType'],
+                            "attributes": {},
+                            "telemetry": [],
+                            RECEIVED_TS_PARAMETER: data[RECEIVED_TS_PARAMETER]}
+            empty_adopted_data_size = get_json_size(adopted_data)
+            adopted_data_size = empty_adopted_data_size
+
+            # First, loop through the attributes
+            for attribute in data['attributes']:
+                adopted_data['attributes'].update(attribute)
+                adopted_data_size += get_json_size(attribute)
+                if adopted_data_size >= max_data_size:
+                    # We have surpassed the max_data_size, so send what we have and clear attributes
+                    events_to_store.append(self.__get_storage_event(adopted_data))
+                    adopted_data['telemetry'] = []
+                    adopted_data['attributes'] = {}
+                    adopted_data_size = empty_adopted_data_size
+
+            # Now, loop through telemetry. Possibly have some unsent attributes that have been adopted.
+            telemetry = data['telemetry'] if isinstance(data['telemetry'], list) else [data['telemetry']]
+            ts_to_index = {}
+            for ts_kv_list in telemetry:
+                ts = ts_kv_list['ts']
+                for kv in ts_kv_list['values']:
+                    if ts in ts_to_index:
+                        kv_data = {kv: ts_kv_list['values'][kv]}
+                        adopted_data['telemetry'][ts_to_index[ts]]['values'].update(kv_data)
+                    else:
+                        kv_data = {'ts': ts, 'values': {kv: ts_kv_list['values'][kv]}}
+                        adopted_data['telemetry'].append(kv_data)
+                        ts_to_index[ts] = len(adopted_data['telemetry']) - 1
+
+                    adopted_data_size += get_json_size(kv_data)
+                    if adopted_data_size >= max_data_size:
+                        # we have surpassed the max_data_size, so send what we have and clear attributes and telemetry
+                        events_to_store.append(self.__get_storage_event(adopted_data))
+                        adopted_data['telemetry'] = []
+                        adopted_data['attributes'] = {}
+                        adopted_data_size = empty_adopted_data_size
+                        ts_to_index = {}
+
+            # It is possible that we get here and have some telemetry or attributes not yet sent, so check for that.
+            if len(adopted_data['telemetry']) > 0 or len(adopted_data['attributes']) > 0:
+                events_to_store.append(self.__get_storage_event(adopted_data))
+        else:
+            events_to_store.append(self.__get_storage_event(data, json_data))
 
     @staticmethod
     def __convert_telemetry_to_ts(data):
@@ -879,115 +1000,165 @@ class TBGatewayService:
             data["telemetry"] = {"ts": int(time() * 1000), "values": telemetry}
         return data
 
-    def __send_data_pack_to_storage(self, data, connector_name):
-        json_data = dumps(data)
-        save_result = self._event_storage.put(json_data)
-        if not save_result:
-            log.error('Data from the device "%s" cannot be saved, connector name is %s.',
-                      data["deviceName"],
-                      connector_name)
-
-    def check_size(self, devices_data_in_event_pack):
-        if self.__get_data_size(devices_data_in_event_pack) >= self.__config["thingsboard"].get("maxPayloadSizeBytes",
-                                                                                                400):
-            self.__send_data(devices_data_in_event_pack)
+    def __get_storage_event(self, data, json_data=None):
+        if self._event_storage.is_structured_events_supported():
+            # Shallow copy, because the caller reuses the dict when the data is sent in pieces
+            return {**data}
+        return json_data if json_data is not None else dumps(data)
+
+    def check_size(self, devices_data_in_event_pack, data_size_accountant, published_events):
+        if data_size_accountant.get_size() >= self.__pack_size_controller.get_payload_size_bytes():
+            self.__send_data(devices_data_in_event_pack, published_events=published_events)
             for device in devices_data_in_event_pack:
                 devices_data_in_event_pack[device]["telemetry"] = []
                 devices_data_in_event_pack[device]["attributes"] = {}
+            data_size_accountant.clear_data()
 
     def __read_data_from_storage(self):
-        devices_data_in_event_pack = {}
         log.debug("Send data Thread has been started successfully.")
         log.debug("Maximal size of the client message queue is: %r", self.tb_client.client._client._max_queued_messages)
+        # Published packs waiting for the acknowledgement with their publish time, the oldest first. Packs are
+        # confirmed to the storage in the same order, so a later pack may be published while the previous ones
+        # are not acknowledged yet
+        packs_in_flight = deque()
+        controller = self.__pack_size_controller
 
         while not self.stopped:
             try:
-                if self.tb_client.is_connected():
-                    events = []
+                if not self.tb_client.is_connected() or (
+                        self.__remote_configurator is not None and self.__remote_configurator.in_process):
+                    # Not acknowledged packs are read from the storage again when the sending is resumed
+                    if packs_in_flight and not self.tb_client.is_connected():
+                        controller.on_pack_failed()
+                    packs_in_flight.clear()
+                    sleep(1 if not self.tb_client.is_connected() else self.__min_pack_send_delay_ms)
+                    continue
 
-                    if self.__remote_configurator is None or not self.__remote_configurator.in_process:
+                events = []
+                if len(packs_in_flight) < controller.get_window():
+                    if packs_in_flight:
+                        events = self._event_storage.get_next_event_pack()
+                    else:
                         events = self._event_storage.get_event_pack()
-
                     if events:
-                        for event in events:
-                            try:
-                                current_event = loads(event)
-                            except Exception as e:
-                                log.exception(e)
-                                continue
+                        packs_in_flight.append((self.__publish_event_pack(events), monotonic()))
 
-                            if not devices_data_in_event_pack.get(current_event["deviceName"]):
-                                devices_data_in_event_pack[current_event["deviceName"]] = {"telemetry": [],
-                                                                                           "attributes": {}}
-                            if current_event.get("telemetry"):
-                                if isinstance(current_event["telemetry"], list):
-                                    for item in current_event["telemetry"]:
-                                        self.check_size(devices_data_in_event_pack)
-                                        devices_data_in_event_pack[current_event["deviceName"]]["telemetry"].append(
-                                            item)
-                                else:
-                                    self.check_size(devices_data_in_event_pack)
-                                    devices_data_in_event_pack[current_event["deviceName"]]["telemetry"].append(
-                                        current_event["telemetry"])
-                            if current_event.get("attributes"):
-                                if isinstance(current_event["attributes"], list):
-                                    for item in current_event["attributes"]:
-                                        self.check_size(devices_data_in_event_pack)
-                                        devices_data_in_event_pack[current_event["deviceName"]]["attributes"].update(
-                                            item.items())
-                                else:
-                                    self.check_size(devices_data_in_event_pack)
-                                    devices_data_in_event_pack[current_event["deviceName"]]["attributes"].update(
-                                        current_event["attributes"].items())
-                        if devices_data_in_event_pack:
-                            if not self.tb_client.is_connected():
-                                continue
-                            while self.__rpc_reply_sent:
-                                sleep(.01)
-                            self.__send_data(devices_data_in_event_pack)
-
-                        if self.tb_client.is_connected() and (
-                                self.__remote_configurator is None or not self.__remote_configurator.in_process):
-                            success = True
-                            while not self._published_events.empty():
-                                if (self.__remote_configurator is not None and self.__remote_configurator.in_process) or \
-                                        not self.tb_client.is_connected() or \
-                                        self._published_events.empty() or \
-                                        self.__rpc_reply_sent:
-                                    success = False
-                                    break
-
-                                events = [self._published_events.get(False, 10) for _ in
-                                          range(min(self.__min_pack_size_to_send, self._published_events.qsize()))]
-                                for event in events:
-                                    try:
-                                        if self.tb_client.is_connected() and (
-                                                self.__remote_configurator is None or not self.__remote_configurator.in_process):
-                                            if self.tb_client.client.quality_of_service == 1:
-                                                success = event.get() == event.TB_ERR_SUCCESS
-                                            else:
-                                                success = True
-                                        else:
-                                            break
-                                    except Exception as e:
-                                        log.exception(e)
-                                        success = False
-                            if success and self.tb_client.is_connected():
-                                self._event_storage.event_pack_processing_done()
-                                del devices_data_in_event_pack
-                                devices_data_in_event_pack = {}
-                        else:
-                            continue
-                    else:
-                        sleep(self.__min_pack_send_delay_ms)
+                if not packs_in_flight:
+                    self._event_storage.wait_for_data(controller.get_send_delay())
+                    continue
+
+                # Wait for the acknowledgement only when there is nothing more to publish
+                wait_timeout = 0 if events and len(packs_in_flight) < controller.get_window() else 1
+                published_events, published_time = packs_in_flight[0]
+                publish_result = self.__get_publish_result(published_events, wait_timeout)
+                if publish_result is None:
+                    if monotonic() - published_time < self.__pack_ack_timeout_sec:
+                        continue
+                    # The acknowledgement may never come, e.g. the broker dropped the message after a reconnect
+                    log.warning("Pack was not acknowledged in %r seconds, it will be sent again",
+                                self.__pack_ack_timeout_sec)
+                    publish_result = False
+                if publish_result and self.tb_client.is_connected():
+                    packs_in_flight.popleft()
+                    self._event_storage.event_pack_processing_done()
+                    controller.on_pack_acknowledged(monotonic() - published_time,
+                                                    backlog=bool(events) or bool(packs_in_flight))
                 else:
-                    sleep(1)
+                    controller.on_pack_failed(throttled=self.__is_publish_throttled(published_events))
+                    packs_in_flight.clear()
+                    sleep(controller.get_send_delay())
             except Exception as e:
                 log.exception(e)
+                packs_in_flight.clear()
                 sleep(1)
 
+    @staticmethod
+    def __is_publish_throttled(published_events):
+        return any(publish_info.rc() in THROTTLING_PUBLISH_RESULT_CODES for publish_info in published_events)
+
+    def __publish_event_pack(self, events):
+        devices_data_in_event_pack = {}
+        data_size_accountant = DataSizeAccountant()
+        published_events = []
+        received_timestamps = []
+        current_events = []
+        for event in events:
+            try:
+                current_event = event if isinstance(event, dict) else loads(event)
+            except Exception as e:
+                log.exception(e)
+                continue
+            if current_event.get(RECEIVED_TS_PARAMETER) is not None:
+                received_timestamps.append(current_event[RECEIVED_TS_PARAMETER])
+            current_events.append(current_event)
+        if self.__telemetry_coalescer is not None:
+            current_events = self.__telemetry_coalescer.coalesce(current_events)
+
+        for current_event in current_events:
+            device_name = current_event["deviceName"]
+            if not devices_data_in_event_pack.get(device_name):
+                devices_data_in_event_pack[device_name] = {"telemetry": [], "attributes": {}}
+                data_size_accountant.add_device(device_name)
+            if current_event.get("telemetry"):
+                if isinstance(current_event["telemetry"], list):
+                    for item in current_event["telemetry"]:
+                        self.check_size(devices_data_in_event_pack, data_size_accountant, published_events)
+                        devices_data_in_event_pack[device_name]["telemetry"].append(item)
+                        data_size_accountant.add_telemetry(device_name, item)
+                else:
+                    self.check_size(devices_data_in_event_pack, data_size_accountant, published_events)
+                    devices_data_in_event_pack[device_name]["telemetry"].append(current_event["telemetry"])
+                    data_size_accountant.add_telemetry(device_name, current_event["telemetry"])
+            if current_event.get("attributes"):
+                if isinstance(current_event["attributes"], list):
+                    for item in current_event["attributes"]:
+                        self.check_size(devices_data_in_event_pack, data_size_accountant, published_events)
+                        devices_data_in_event_pack[device_name]["attributes"].update(item.items())
+                        data_size_accountant.add_attributes(device_name, item)
+                else:
+                    self.check_size(devices_data_in_event_pack, data_size_accountant, published_events)
+                    devices_data_in_event_pack[device_name]["attributes"].update(
+                        current_event["attributes"].items())
+                    data_size_accountant.add_attributes(device_name, current_event["attributes"])
+        if devices_data_in_event_pack:
+            while self.__rpc_reply_sent:
+                sleep(.01)
+            self.__send_data(devices_data_in_event_pack, published_events=published_events)
+            published_ts = int(time() * 1000)
+            for received_ts in received_timestamps:
+                self.__event_latency_histogram.observe(published_ts - received_ts)
+        return published_events
+
+    def __get_publish_result(self, published_events, timeout):
+        """
+        Returns True when all messages of the pack are acknowledged, False when publishing failed
+        and None while the acknowledgements are expected
+        """
+        if self.tb_client.client.quality_of_service != 1:
+            return True
+        for publish_info in published_events:
+            if publish_info.rc() != publish_info.TB_ERR_SUCCESS:
+                return False
+            message_infos = publish_info.message_info if isinstance(publish_info.message_info, list) \
+                else [publish_info.message_info]
+            for message_info in message_infos:
+                try:
+                    if not message_info.is_published():
+                        if not timeout:
+                            return None
+                        message_info.wait_for_publish(timeout)
+                        if not message_info.is_published():
+                            return None
+                except (ValueError, RuntimeError) as e:
+                    log.debug("Message was not published: %s", e)
+                    return False
+        return True
+
     @StatisticsService.CollectAllSentTBBytesStatistics(start_stat_type='allBytesSentToTB')
-    def __send_data(self, devices_data_in_event_pack):
+    def __send_data(self, devices_data_in_event_pack, published_events):
+        if self.__compressed_publisher is not None:
+            self.__send_compressed_data(devices_data_in_event_pack, published_events)
+            return
         try:
             for device in devices_data_in_event_pack:
                 final_device_name = device if self.__renamed_devices.get(device) is None else self.__renamed_devices[
@@ -995,21 +1166,50 @@ class TBGatewayService:
 
                 if devices_data_in_event_pack[device].get("attributes"):
                     if device == self.name or device == "currentThingsBoardGateway":
-                        self._published_events.put(
+                        published_events.append(
                             self.tb_client.client.send_attributes(devices_data_in_event_pack[device]["attributes"]))
                     else:
-                        self._published_events.put(self.tb_client.client.gw_send_attributes(final_device_name,
-                                                                                            devices_data_in_event_pack[
-                                                                                                device]["attributes"]))
+                        published_events.append(self.tb_client.client.gw_send_attributes(
+                            final_device_name, devices_data_in_event_pack[device]["attributes"]))
                 if devices_data_in_event_pack[device].get("telemetry"):
                     if device == self.name or device == "currentThingsBoardGateway":
-                        self._published_events.put(
+                        published_events.append(
                             self.tb_client.client.send_telemetry(devices_data_in_event_pack[device]["telemetry"]))
                     else:
-                        self._published_events.put(self.tb_client.client.gw_send_telemetry(final_device_name,
-                                                                                           devices_data_in_event_pack[
-                                                                                               device]["telemetry"]))
+                        published_events.append(self.tb_client.client.gw_send_telemetry(
+                            final_device_name, devices_data_in_event_pack[device]["telemetry"]))
+                devices_data_in_event_pack[device] = {"telemetry": [], "attributes": {}}
+        except Exception as e:
+            log.exception(e)
+
+    def __send_compressed_data(self, devices_data_in_event_pack, published_events):
+        try:
+            devices_telemetry = {}
+            devices_attributes = {}
+            for device in devices_data_in_event_pack:
+                device_data = devices_data_in_event_pack[device]
+                if device == self.name or device == "currentThingsBoardGateway":
+                    if device_data.get("attributes"):
+                        published_events.append(self.tb_client.client.send_attributes(device_data["attributes"]))
+                    if device_data.get("telemetry"):
+                        published_events.append(self.tb_client.client.send_telemetry(device_data["telemetry"]))
+                else:
+                    final_device_name = device if self.__renamed_devices.get(device) is None else \
+                        self.__renamed_devices[device]
+                    if device_data.get("attributes"):
+                        devices_attributes[final_device_name] = device_data["attributes"]
+                    if device_data.get("telemetry"):
+                        devices_telemetry[final_device_name] = device_data["telemetry"]
                 devices_data_in_event_pack[device] = {"telemetry": [], "attributes": {}}
+
+            # All devices of the pack go in one message, so the compression works on the whole pack
+            qos = self.tb_client.client.quality_of_service
+            if devices_attributes:
+                published_events.append(self.__compressed_publisher.publish_attributes(self.tb_client,
+                                                                                       devices_attributes, qos))
+            if devices_telemetry:
+                published_events.append(self.__compressed_publisher.publish_telemetry(self.tb_client,
+                                                                                      devices_telemetry, qos))
         except Exception as e:
             log.exception(e)
 
@@ -1093,9 +1293,10 @@ class TBGatewayService:
 
     def __rpc_devices(self, *args):
         data_to_send = {}
-        for device in self.__connected_devices:
-            if self.__connected_devices[device]["connector"] is not None:
-                data_to_send[device] = self.__connected_devices[device]["connector"].get_name()
+        with self.__lock:
+            for device in self.__connected_devices:
+                if self.__connected_devices[device]["connector"] is not None:
+                    data_to_send[device] = self.__connected_devices[device]["connector"].get_name()
         return {"code": 200, "resp": data_to_send}
 
     def __rpc_update(self, *args):
@@ -1136,11 +1337,11 @@ class TBGatewayService:
 
     def __send_rpc_reply_processing(self):
         while not self.stopped:
-            if not self.__rpc_processing_queue.empty():
-                args = self.__rpc_processing_queue.get()
-                self.__send_rpc_reply(*args)
-            else:
-                sleep(.1)
+            try:
+                args = self.__rpc_processing_queue.get(True, QUEUE_GET_TIMEOUT_SEC)
+            except Empty:
+                continue
+            self.__send_rpc_reply(*args)
 
     def __send_rpc_reply(self, device=None, req_id=None, content=None, success_sent=None, wait_for_publish=None,
                          quality_of_service=0):
@@ -1199,6 +1400,16 @@ class TBGatewayService:
             summary_messages['eventsSent'] += telemetry[
                 str(connector_camel_case + ' EventsSent').replace(' ', '')]
             summary_messages.update(telemetry)
+            if hasattr(self.available_connectors[connector], 'get_statistics'):
+                summary_messages.update(self.available_connectors[connector].get_statistics(connector_camel_case))
+        for (stat_key, stat_value) in self._event_storage.get_statistics().items():
+            summary_messages['storage' + stat_key[0].upper() + stat_key[1:]] = stat_value
+        summary_messages.update(self.__event_latency_histogram.get_statistics('eventLatency'))
+        summary_messages.update(self.__save_converted_data_timings.get_statistics('saveConvertedData'))
+        if self.__compressed_publisher is not None:
+            summary_messages.update(self.__compressed_publisher.get_statistics('compression'))
+        summary_messages.update(self.__pack_size_controller.get_statistics('uplink'))
+        summary_messages.update(TBUtility.get_expression_cache_statistics('expressionCache'))
         return summary_messages
 
     def add_device_async(self, data):
@@ -1209,17 +1420,35 @@ class TBGatewayService:
             return Status.FAILURE
 
     def add_device(self, device_name, content, device_type=None, reconnect=False):
+        if self.__add_device(device_name, content, device_type, reconnect):
+            self.__save_persistent_devices(device_name)
+
+    def __add_device(self, device_name, content, device_type=None, reconnect=False):
         if device_name not in self.__saved_devices or reconnect:
             device_type = device_type if device_type is not None else 'default'
-            self.__connected_devices[device_name] = {**content, "device_type": device_type}
-            self.__saved_devices[device_name] = {**content, "device_type": device_type}
-            self.__save_persistent_devices()
+            with self.__lock:
+                self.__connected_devices[device_name] = {**content, "device_type": device_type}
+                self.__saved_devices[device_name] = {**content, "device_type": device_type}
             self.tb_client.client.gw_connect_device(device_name, device_type)
+            return True
+        return False
+
+    def __reconnect_saved_devices(self):
+        # Saved devices are in the registry already, so only the connect messages are sent again
+        with self.__lock:
+            saved_devices = list(self.__saved_devices.items())
+        for device_name, device in saved_devices:
+            with self.__lock:
+                self.__connected_devices[device_name] = {"connector": device["connector"],
+                                                         "device_type": device["device_type"]}
+            self.tb_client.client.gw_connect_device(device_name, device["device_type"])
+        log.debug("%i saved devices connected again", len(saved_devices))
 
     def update_device(self, device_name, event, content):
-        if event == 'connector' and self.__connected_devices[device_name].get(event) != content:
-            self.__save_persistent_devices()
+        connector_changed = event == 'connector' and self.__connected_devices[device_name].get(event) != content
         self.__connected_devices[device_name][event] = content
+        if connector_changed:
+            self.__save_persistent_devices(device_name)
 
     def del_device_async(self, data):
         if data['deviceName'] in self.__saved_devices:
@@ -1229,10 +1458,14 @@ class TBGatewayService:
             return Status.FAILURE
 
     def del_device(self, device_name):
+        self.__del_device(device_name)
+        self.__save_persistent_devices(device_name)
+
+    def __del_device(self, device_name):
         self.tb_client.client.gw_disconnect_device(device_name)
-        self.__connected_devices.pop(device_name)
-        self.__saved_devices.pop(device_name)
-        self.__save_persistent_devices()
+        with self.__lock:
+            self.__connected_devices.pop(device_name)
+            self.__saved_devices.pop(device_name)
 
     def get_devices(self, connector_name: str = None):
         return self.__connected_devices if connector_name is None else {
@@ -1242,15 +1475,31 @@ class TBGatewayService:
 
     def __process_async_device_actions(self):
         while not self.stopped:
-            if not self.__async_device_actions_queue.empty():
-                action, data = self.__async_device_actions_queue.get()
-                if action == DeviceActions.CONNECT:
-                    self.add_device(data['deviceName'], {CONNECTOR_PARAMETER: self.available_connectors[data['name']]},
-                                    data.get('deviceType'))
-                elif action == DeviceActions.DISCONNECT:
-                    self.del_device(data['deviceName'])
-            else:
-                sleep(.2)
+            try:
+                device_actions = [self.__async_device_actions_queue.get(True, QUEUE_GET_TIMEOUT_SEC)]
+            except Empty:
+                continue
+            # Changes of all queued actions are saved to the device registry with one write
+            while len(device_actions) < MAX_DEVICE_ACTIONS_BATCH_SIZE:
+                try:
+                    device_actions.append(self.__async_device_actions_queue.get(False))
+                except Empty:
+                    break
+
+            changed_devices = []
+            for action, data in device_actions:
+                try:
+                    if action == DeviceActions.CONNECT:
+                        if self.__add_device(data['deviceName'],
+                                             {CONNECTOR_PARAMETER: self.available_connectors[data['name']]},
+                                             data.get('deviceType')):
+                            changed_devices.append(data['deviceName'])
+                    elif action == DeviceActions.DISCONNECT:
+                        self.__del_device(data['deviceName'])
+                        changed_devices.append(data['deviceName'])
+                except Exception as e:
+                    log.exception(e)
+            self.__save_persistent_devices(*changed_devices)
 
     def __load_persistent_connector_keys(self):
         persistent_keys = {}
@@ -1273,22 +1522,14 @@ class TBGatewayService:
             log.exception(e)
 
     def __load_persistent_devices(self):
-        devices = None
-        if CONNECTED_DEVICES_FILENAME in listdir(self._config_dir) and \
-                path.getsize(self._config_dir + CONNECTED_DEVICES_FILENAME) > 0:
-            try:
-                devices = load_file(self._config_dir + CONNECTED_DEVICES_FILENAME)
-            except Exception as e:
-                log.exception(e)
-        else:
-            open(self._config_dir + CONNECTED_DEVICES_FILENAME, 'w').close()
+        devices = self.__device_registry.load()
 
-        if devices is not None:
+        if devices:
             log.debug("Loaded devices:\n %s", devices)
             for device_name in devices:
                 try:
                     if not isinstance(devices[device_name], list):
-                        open(self._config_dir + CONNECTED_DEVICES_FILENAME, 'w').close()
+                        self.__device_registry.clear()
                         log.debug("Old connected_devices file, new file will be created")
                         return
                     if self.available_connectors.get(devices[device_name][0]):
@@ -1307,24 +1548,21 @@ class TBGatewayService:
             log.debug("No device found in connected device file.")
             self.__connected_devices = {} if self.__connected_devices is None else self.__connected_devices
 
-    def __save_persistent_devices(self):
+    def __get_persistent_device(self, device_name):
+        device = self.__connected_devices.get(device_name)
+        if device is None or device.get("connector") is None:
+            return None
+        persistent_device = [device["connector"].get_name(), device["device_type"]]
+        if device_name in self.__renamed_devices:
+            persistent_device.append(self.__renamed_devices[device_name])
+        return persistent_device
+
+    def __save_persistent_devices(self, *device_names):
+        if not device_names:
+            return
         with self.__lock:
-            data_to_save = {}
-            for device in self.__connected_devices:
-                if self.__connected_devices[device]["connector"] is not None:
-                    data_to_save[device] = [self.__connected_devices[device]["connector"].get_name(),
-                                            self.__connected_devices[device]["device_type"]]
-
-                    if device in self.__renamed_devices:
-                        data_to_save[device].append(self.__renamed_devices.get(device))
-
-            with open(self._config_dir + CONNECTED_DEVICES_FILENAME, 'w') as config_file:
-                try:
-                    config_file.write(dumps(data_to_save, indent=2, sort_keys=True))
-                except Exception as e:
-                    log.exception(e)
-
-            log.debug("Saved connected devices.")
+            self.__device_registry.save_many({device_name: self.__get_persistent_device(device_name)
+                                              for device_name in device_names})
 
     def __check_devices_idle_time(self):
         check_devices_idle_every_sec = self.__devices_idle_checker.get('inactivityCheckPeriodSeconds', 1)
@@ -1332,7 +1570,9 @@ class TBGatewayService:
 
         while not self.stopped:
             for_deleting = []
-            for (device_name, device) in self.__connected_devices.items():
+            with self.__lock:
+                connected_devices = list(self.__connected_devices.items())
+            for (device_name, device) in connected_devices:
                 ts = time()
 
                 if not device.get('last_receiving_data'):
@@ -0,0 +1,80 @@
+#      Copyright 2022. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+
+from thingsboard_gateway.gateway.constants import ATTRIBUTES_PARAMETER, DEFAULT_SEND_ON_CHANGE_INFINITE_TTL_VALUE, \
+    DEFAULT_SEND_ON_CHANGE_VALUE, DEVICE_NAME_PARAMETER, SEND_ON_CHANGE_PARAMETER, SEND_ON_CHANGE_TTL_PARAMETER, \
+    TELEMETRY_PARAMETER, TELEMETRY_TIMESTAMP_PARAMETER, TELEMETRY_VALUES_PARAMETER
+
+
+class TelemetryCoalescer:
+    """
+    Merges events of one pack into one event per device, telemetry entries with the same timestamp are
+    merged into one entry. With "sendDataOnlyOnChange" a value equal to the previous sent value of the key
+    is dropped, unless "sendDataOnlyOnChangeTtl" milliseconds passed since that value was sent.
+    Only the events of one pack are compared, so a pack that is sent again gives the same result.
+    """
+
+    def __init__(self, config):
+        self.__send_on_change = config.get(SEND_ON_CHANGE_PARAMETER, DEFAULT_SEND_ON_CHANGE_VALUE)
+        self.__send_on_change_ttl = config.get(SEND_ON_CHANGE_TTL_PARAMETER, DEFAULT_SEND_ON_CHANGE_INFINITE_TTL_VALUE)
+
+    def coalesce(self, events):
+        devices = {}
+        for event in events:
+            device = devices.get(event[DEVICE_NAME_PARAMETER])
+            if device is None:
+                device = devices[event[DEVICE_NAME_PARAMETER]] = {"telemetry": {}, "no_ts_telemetry": [],
+                                                                  "attributes": {}}
+            telemetry = event.get(TELEMETRY_PARAMETER) or []
+            for item in (telemetry if isinstance(telemetry, list) else [telemetry]):
+                ts = item.get(TELEMETRY_TIMESTAMP_PARAMETER) if isinstance(item, dict) else None
+                if ts is None:
+                    device["no_ts_telemetry"].append(item)
+                    continue
+                values = device["telemetry"].get(ts)
+                if values is None:
+                    values = device["telemetry"][ts] = {}
+                values.update(item[TELEMETRY_VALUES_PARAMETER])
+            attributes = event.get(ATTRIBUTES_PARAMETER) or []
+            for item in (attributes if isinstance(attributes, list) else [attributes]):
+                device["attributes"].update(item)
+
+        coalesced_events = []
+        for device_name, device in devices.items():
+            telemetry = [{TELEMETRY_TIMESTAMP_PARAMETER: ts, TELEMETRY_VALUES_PARAMETER: values}
+                         for ts, values in sorted(device["telemetry"].items())]
+            if self.__send_on_change:
+                telemetry = self.__drop_unchanged_values(telemetry)
+            coalesced_events.append({DEVICE_NAME_PARAMETER: device_name,
+                                     TELEMETRY_PARAMETER: telemetry + device["no_ts_telemetry"],
+                                     ATTRIBUTES_PARAMETER: device["attributes"]})
+        return coalesced_events
+
+    def __drop_unchanged_values(self, telemetry):
+        sent_values = {}
+        result = []
+        for entry in telemetry:
+            ts = entry[TELEMETRY_TIMESTAMP_PARAMETER]
+            changed_values = {}
+            for key, value in entry[TELEMETRY_VALUES_PARAMETER].items():
+                sent_value = sent_values.get(key)
+                if sent_value is not None and sent_value[0] == value and (
+                        self.__send_on_change_ttl == DEFAULT_SEND_ON_CHANGE_INFINITE_TTL_VALUE or
+                        ts - sent_value[1] < self.__send_on_change_ttl):
+                    continue
+                sent_values[key] = (value, ts)
+                changed_values[key] = value
+            if changed_values:
+                result.append({TELEMETRY_TIMESTAMP_PARAMETER: ts, TELEMETRY_VALUES_PARAMETER: changed_values})
+        return result
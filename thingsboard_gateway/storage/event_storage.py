@@ -14,6 +14,9 @@
 
 from abc import ABC, abstractmethod
 from logging import getLogger
+from time import sleep
+
+from simplejson import dumps
 
 log = getLogger("storage")
 
@@ -24,14 +27,24 @@ class EventStorage(ABC):
     def put(self, event):
         pass
 
+    def put_many(self, events):
+        # Returns True when all events are saved
+        results = [self.put(event) for event in events]
+        return all(results)
+
     @abstractmethod
     def get_event_pack(self):
-        # Returns max "10" events from pack
+        # Returns max "10" events from pack, the oldest not confirmed pack is returned again
         pass
 
+    def get_next_event_pack(self):
+        # Returns the pack after the ones returned since the last "get_event_pack" call, so several packs
+        # may be in flight. Storages that cannot read ahead return nothing
+        return []
+
     @abstractmethod
     def event_pack_processing_done(self):
-        # Indicates that events from previous "get_event_pack" may be cleared
+        # Indicates that events from the oldest not confirmed pack may be cleared
         pass
 
     @abstractmethod
@@ -42,3 +55,23 @@ class EventStorage(ABC):
     @abstractmethod
     def len(self):
         pass
+
+    def wait_for_data(self, timeout):
+        # Blocks until new events may be available or the timeout in seconds expires
+        sleep(timeout)
+
+    def is_structured_events_supported(self):
+        # Storages that keep events in memory may accept dicts instead of JSON strings
+        return False
+
+    def get_event_size(self, event):
+        # Size of the event in bytes, storages that accept dicts may estimate it without serialization
+        return len(event) if isinstance(event, (str, bytes)) else len(dumps(event))
+
+    def get_statistics(self):
+        # Returns storage specific counters that are sent with the gateway statistics
+        return {}
+
+    def on_connection_state_changed(self, connected):
+        # Called by the gateway when the connection to ThingsBoard is lost or restored
+        pass
@@ -0,0 +1,173 @@
+#     Copyright 2022. ThingsBoard
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+
+"""
+Data file formats of the file event storage.
+
+"base64" (v1) files contain one base64 encoded event per line.
+
+"binary" (v2) files start with BINARY_FILE_MAGIC followed by blocks:
+
+    codec (1 byte) | records count (2 bytes) | payload size (4 bytes) | payload crc32 (4 bytes) | payload
+
+The payload, after decompression with the block codec, is a sequence of length-prefixed records:
+
+    record size (4 bytes) | UTF-8 encoded event
+"""
+
+from logging import getLogger
+from struct import Struct
+from zlib import compress as zlib_compress, crc32, decompress as zlib_decompress
+
+log = getLogger("storage")
+
+BASE64_FORMAT = 'base64'
+BINARY_FORMAT = 'binary'
+DATA_FILE_FORMATS = (BASE64_FORMAT, BINARY_FORMAT)
+
+BINARY_FILE_MAGIC = b'TBES\x00\x02'
+BLOCK_HEADER = Struct('>BHII')
+RECORD_HEADER = Struct('>I')
+MAX_RECORDS_PER_BLOCK = 0xFFFF
+
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+CODECS = {'none': CODEC_NONE, 'zlib': CODEC_ZLIB, 'zstd': CODEC_ZSTD}
+
+_zstandard = None
+
+
+class CorruptedBlockError(Exception):
+    pass
+
+
+def _load_zstandard():
+    global _zstandard
+    if _zstandard is None:
+        try:
+            import zstandard
+        except ImportError:
+            from thingsboard_gateway.tb_utility.tb_utility import TBUtility
+            TBUtility.install_package('zstandard')
+            import zstandard
+        _zstandard = zstandard
+    return _zstandard
+
+
+def detect_data_file_format(first_bytes: bytes):
+    """
+    Returns the format of a data file by its first bytes or None if there is not enough data to decide
+    """
+    if first_bytes.startswith(BINARY_FILE_MAGIC):
+        return BINARY_FORMAT
+    if len(first_bytes) >= len(BINARY_FILE_MAGIC) or b'\n' in first_bytes:
+        return BASE64_FORMAT
+    return None
+
+
+def read_data_file_format(file_path):
+    try:
+        with open(file_path, 'rb') as data_file:
+            return detect_data_file_format(data_file.read(len(BINARY_FILE_MAGIC)))
+    except IOError:
+        return None
+
+
+class BlockCodec:
+    def __init__(self, codec='none', level=None, min_size=256):
+        if codec not in CODECS:
+            log.warning("Unknown file storage compression %s, data will be stored uncompressed", codec)
+            codec = 'none'
+        self.codec = CODECS[codec]
+        self.level = level
+        self.min_size = min_size
+        self.__zstd_compressor = None
+
+        if self.codec == CODEC_ZSTD:
+            try:
+                self.__zstd_compressor = _load_zstandard().ZstdCompressor(level=level if level is not None else 3)
+            except Exception as e:
+                log.warning("zstd compression is not available (%s), zlib will be used", e)
+                self.codec = CODEC_ZLIB
+
+    def encode(self, messages):
+        """
+        Packs messages into one block, blocks hold at most MAX_RECORDS_PER_BLOCK records
+        """
+        records = []
+        for message in messages:
+            encoded = message.encode('utf-8')
+            records.append(RECORD_HEADER.pack(len(encoded)))
+            records.append(encoded)
+        payload = b''.join(records)
+
+        codec = CODEC_NONE
+        if self.codec != CODEC_NONE and len(payload) >= self.min_size:
+            if self.codec == CODEC_ZSTD:
+                compressed = self.__zstd_compressor.compress(payload)
+            else:
+                compressed = zlib_compress(payload, self.level if self.level is not None else 6)
+            if len(compressed) < len(payload):
+                codec = self.codec
+                payload = compressed
+
+        return BLOCK_HEADER.pack(codec, len(messages), len(payload), crc32(payload)) + payload
+
+    @staticmethod
+    def decode_header(header):
+        codec, records_count, payload_size, checksum = BLOCK_HEADER.unpack(header)
+        if codec not in CODECS.values():
+            raise CorruptedBlockError("Unknown block codec %i" % codec)
+        return codec, records_count, payload_size, checksum
+
+    @staticmethod
+    def decode_payload(codec, records_count, payload, checksum):
+        if crc32(payload) != checksum:
+            raise CorruptedBlockError("Block checksum mismatch")
+
+        if codec == CODEC_ZLIB:
+            payload = zlib_decompress(payload)
+        elif codec == CODEC_ZSTD:
+            payload = _load_zstandard().ZstdDecompressor().decompress(payload)
+
+        payload = memoryview(payload)
+        messages = []
+        position = 0
+        for _ in range(records_count):
+            record_size, = RECORD_HEADER.unpack_from(payload, position)
+            position += RECORD_HEADER.size
+            messages.append(str(payload[position:position + record_size], 'utf-8'))
+            position += record_size
+        if position != len(payload):
+            raise CorruptedBlockError("Block records do not match the payload size")
+        return messages
+
+
+def count_binary_records(file_path):
+    """
+    Counts records of a binary data file using block headers only
+    """
+    records = 0
+    with open(file_path, 'rb') as data_file:
+        if data_file.read(len(BINARY_FILE_MAGIC)) != BINARY_FILE_MAGIC:
+            return records
+        while True:
+            header = data_file.read(BLOCK_HEADER.size)
+            if len(header) < BLOCK_HEADER.size:
+                break
+            _, records_count, payload_size, _ = BLOCK_HEADER.unpack(header)
+            records += records_count
+            data_file.seek(payload_size, 1)
+    return records
@@ -0,0 +1,95 @@
+#     Copyright 2022. ThingsBoard
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+
+from os import remove
+from os.path import exists
+
+from thingsboard_gateway.storage.file.file_event_storage import log
+from thingsboard_gateway.storage.file.file_event_storage_settings import FileEventStorageSettings
+
+INDEX_FILE_PREFIX = 'index_'
+
+
+class EventStorageIndex:
+    """
+    Sparse sidecar index of a data file, every line is "<record number> <byte offset>" of a record start.
+    It is used to find the reading position when the offset from the state file is missing or invalid.
+    """
+
+    def __init__(self, settings: FileEventStorageSettings):
+        self.settings = settings
+        self.index_file = None
+        self.next_indexed_record = 0
+
+    @staticmethod
+    def get_index_file_name(data_file):
+        return INDEX_FILE_PREFIX + data_file
+
+    def get_index_file_path(self, data_file):
+        return self.settings.get_data_folder_path() + self.get_index_file_name(data_file)
+
+    def open(self, data_file, records_count):
+        self.close()
+        try:
+            self.index_file = open(self.get_index_file_path(data_file), 'a')
+        except IOError as e:
+            log.warning("Failed to open index file for %s! %s", data_file, e)
+        interval = self.settings.get_index_interval_records()
+        self.next_indexed_record = (records_count // interval + 1) * interval
+
+    def add_entry(self, record, offset):
+        """
+        Called by the writer before every write, an entry is stored once per index interval
+        """
+        if self.index_file is None or record < self.next_indexed_record:
+            return
+        try:
+            self.index_file.write("%i %i\n" % (record, offset))
+            self.index_file.flush()
+        except IOError as e:
+            log.warning("Failed to update index file! %s", e)
+        interval = self.settings.get_index_interval_records()
+        self.next_indexed_record = (record // interval + 1) * interval
+
+    def close(self):
+        if self.index_file is not None and not self.index_file.closed:
+            self.index_file.close()
+        self.index_file = None
+
+    def find(self, data_file, record):
+        """
+        Returns the closest indexed (record number, byte offset) that is not after the record
+        """
+        found_record, found_offset = 0, 0
+        try:
+            with open(self.get_index_file_path(data_file)) as index_file:
+                for line in index_file:
+                    try:
+                        indexed_record, indexed_offset = (int(value) for value in line.split())
+                    except ValueError:
+                        continue
+                    if indexed_record > record:
+                        break
+                    found_record, found_offset = indexed_record, indexed_offset
+        except IOError:
+            pass
+        return found_record, found_offset
+
+    def delete(self, data_file):
+        try:
+            index_file_path = self.get_index_file_path(data_file)
+            if exists(index_file_path):
+                remove(index_file_path)
+        except Exception as e:
+            log.exception(e)
@@ -0,0 +1,129 @@
+#     Copyright 2022. ThingsBoard
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+
+from binascii import a2b_base64
+from mmap import ACCESS_READ, mmap
+
+from thingsboard_gateway.storage.file.event_storage_data_format import BINARY_FORMAT, BLOCK_HEADER, BlockCodec, \
+    CorruptedBlockError
+from thingsboard_gateway.storage.file.event_storage_reader import EventStorageReader
+from thingsboard_gateway.storage.file.file_event_storage import log
+
+
+class EventStorageMmapReader(EventStorageReader):
+    """
+    Reads fully written data files through a memory map, records are decoded straight from the mapped
+    memory without per-line read calls. The file that is still being written is read by the buffered reader.
+    """
+
+    def __init__(self, files, settings):
+        self.mapped_file = None
+        self.mapped_file_name = None
+        super().__init__(files, settings)
+
+    def read_records(self, buffered_reader, records_to_read):
+        if self.data_file_format is None:
+            self.data_file_format = self.detect_format(buffered_reader, self.new_pos)
+        if self.data_file_format is None or self.get_next_file(self.files, self.new_pos) is None:
+            return super().read_records(buffered_reader, records_to_read)
+
+        mapped_file = self.get_or_init_mapped_file(buffered_reader)
+        if mapped_file is None:
+            return 0
+        if self.data_file_format == BINARY_FORMAT:
+            records_count = self.read_mapped_binary_records(mapped_file, records_to_read)
+        else:
+            records_count = self.read_mapped_base64_records(mapped_file, records_to_read)
+        buffered_reader.seek(self.new_pos.get_offset())
+        return records_count
+
+    def read_mapped_base64_records(self, mapped_file, records_to_read):
+        records_count = 0
+        position = self.new_pos.get_offset()
+        current_line_in_file = self.new_pos.get_line()
+        with memoryview(mapped_file) as mapped_view:
+            while records_count < records_to_read:
+                line_end = mapped_file.find(b'\n', position)
+                if line_end < 0:
+                    break
+                current_line_in_file += 1
+                try:
+                    self.current_batch.append(a2b_base64(mapped_view[position:line_end]).decode("utf-8"))
+                    records_count += 1
+                except Exception as e:
+                    log.warning("Could not parse line [%s] to uplink message! %s",
+                                bytes(mapped_view[position:line_end]), e)
+                position = line_end + 1
+        self.new_pos.set_line(current_line_in_file)
+        self.new_pos.set_offset(position)
+        return records_count
+
+    def read_mapped_binary_records(self, mapped_file, records_to_read):
+        records_count = 0
+        position = self.new_pos.get_offset()
+        file_size = len(mapped_file)
+        with memoryview(mapped_file) as mapped_view:
+            while records_count < records_to_read and position + BLOCK_HEADER.size <= file_size:
+                try:
+                    codec, block_records_count, payload_size, checksum = \
+                        BlockCodec.decode_header(mapped_view[position:position + BLOCK_HEADER.size])
+                    payload_start = position + BLOCK_HEADER.size
+                    if payload_start + payload_size > file_size:
+                        raise CorruptedBlockError("Block is truncated")
+                    messages = BlockCodec.decode_payload(codec, block_records_count,
+                                                         mapped_view[payload_start:payload_start + payload_size],
+                                                         checksum)
+                except CorruptedBlockError as e:
+                    log.error("[%s] Corrupted data block at %i, the rest of the file will be skipped! %s",
+                              self.new_pos.get_file(), position, e)
+                    position = file_size
+                    break
+                self.current_batch.extend(messages)
+                records_count += len(messages)
+                self.new_pos.set_line(self.new_pos.get_line() + len(messages))
+                position = payload_start + payload_size
+        self.new_pos.set_offset(position)
+        return records_count
+
+    def get_or_init_mapped_file(self, buffered_reader):
+        if self.mapped_file is not None and self.mapped_file_name == self.new_pos.get_file():
+            return self.mapped_file
+        self.close_mapped_file()
+        try:
+            self.mapped_file = mmap(buffered_reader.fileno(), 0, access=ACCESS_READ)
+            self.mapped_file_name = self.new_pos.get_file()
+        except ValueError:
+            # Empty files cannot be mapped
+            return None
+        except (IOError, OSError) as e:
+            log.warning("[%s] Failed to map the file! Error: %s", self.new_pos.get_file(), e)
+            return None
+        return self.mapped_file
+
+    def close_mapped_file(self):
+        if self.mapped_file is not None:
+            try:
+                self.mapped_file.close()
+            except BufferError as e:
+                log.debug("Mapped file is still in use and will be released later: %s", e)
+        self.mapped_file = None
+        self.mapped_file_name = None
+
+    def close_buffered_reader(self):
+        self.close_mapped_file()
+        super().close_buffered_reader()
+
+    def destroy(self):
+        self.close_mapped_file()
+        super().destroy()
@@ -13,13 +13,17 @@
 #     limitations under the License.
 
 from base64 import b64decode
-from io import BufferedReader, FileIO
+from collections import deque
+from io import SEEK_CUR, SEEK_END, BufferedReader, FileIO
 from os import remove
 from os.path import exists
 
 from simplejson import JSONDecodeError, dumps, load
 
+from thingsboard_gateway.storage.file.event_storage_data_format import BASE64_FORMAT, BINARY_FILE_MAGIC, \
+    BINARY_FORMAT, BLOCK_HEADER, BlockCodec, CorruptedBlockError, detect_data_file_format
 from thingsboard_gateway.storage.file.event_storage_files import EventStorageFiles
+from thingsboard_gateway.storage.file.event_storage_index import EventStorageIndex
 from thingsboard_gateway.storage.file.event_storage_reader_pointer import EventStorageReaderPointer
 from thingsboard_gateway.storage.file.file_event_storage import log
 from thingsboard_gateway.storage.file.file_event_storage_settings import FileEventStorageSettings
@@ -31,74 +35,133 @@ class EventStorageReader:
         self.files = files
         self.settings = settings
         self.current_batch = None
+        # Batches that are read and not discarded yet, every item is (batch, position after the batch)
+        self.pending_batches = deque()
+        self.read_ahead_count = 0
         self.buffered_reader = None
+        self.data_file_format = None
+        self.index = EventStorageIndex(settings)
         self.current_pos = self.read_state_file()
-        self.new_pos = self.current_pos
+        self.new_pos = self.current_pos.copy()
 
     def read(self):
-        if self.current_batch is not None and self.current_batch:
+        if self.pending_batches:
             log.debug("The previous batch was not discarded!")
-            return self.current_batch
+            self.read_ahead_count = 1
+            return self.pending_batches[0][0]
+        self.read_ahead_count = 0
+        return self.read_next()
+
+    def read_next(self):
+        """
+        Returns the batch that follows the batches returned since the last read() call
+        """
+        if self.read_ahead_count < len(self.pending_batches):
+            self.read_ahead_count += 1
+            return self.pending_batches[self.read_ahead_count - 1][0]
+        self.read_batch()
+        if self.current_batch:
+            self.pending_batches.append((self.current_batch, self.new_pos.copy()))
+            self.read_ahead_count += 1
+        return self.current_batch
+
+    def read_batch(self):
         self.current_batch = []
         records_to_read = self.settings.get_max_read_records_count()
         while records_to_read > 0:
             try:
-                current_line_in_file = self.new_pos.get_line()
-                self.buffered_reader = self.get_or_init_buffered_reader(self.new_pos)
-                if self.buffered_reader is not None:
-                    line = self.buffered_reader.readline()
-                    while line != b'':
-                        try:
-                            self.current_batch.append(b64decode(line).decode("utf-8"))
-                            records_to_read -= 1
-                        except IOError as e:
-                            log.warning("Could not parse line [%s] to uplink message! %s", line, e)
-                        except Exception as e:
-                            log.exception(e)
-                            current_line_in_file += 1
-                            self.new_pos.set_line(current_line_in_file)
-                            self.write_info_to_state_file(self.new_pos)
-                            break
-                        finally:
-                            current_line_in_file += 1
-                            if records_to_read > 0:
-                                line = self.buffered_reader.readline()
-                        self.new_pos.set_line(current_line_in_file)
-                        if records_to_read == 0:
-                            break
-
-                    if (self.settings.get_max_records_per_file() >= current_line_in_file >= 0) or \
-                            (line == b'' and current_line_in_file >= self.settings.get_max_records_per_file() - 1):
-                        previous_file = self.current_pos
-                        next_file = self.get_next_file(self.files, self.new_pos)
-                        # self.write_info_to_state_file(self.new_pos)
-                        if next_file is None:
-                            break
-                        self.delete_read_file(previous_file)
-                        if self.buffered_reader is not None:
-                            self.buffered_reader.close()
-                        # self.buffered_reader = None
-                        self.new_pos = EventStorageReaderPointer(next_file, 0)
-                        self.get_or_init_buffered_reader(self.new_pos)
-                        continue
-                    if line == b'':
+                buffered_reader = self.get_or_init_buffered_reader(self.new_pos)
+                if buffered_reader is None:
+                    break
+                records_to_read -= self.read_records(buffered_reader, records_to_read)
+                if records_to_read > 0:
+                    # End of the current file, switch to the next one if the writer has already created it
+                    next_file = self.get_next_file(self.files, self.new_pos)
+                    if next_file is None:
                         break
-                    continue
+                    # The current file may have been completed right before the switch
+                    tail_records_count = self.read_records(buffered_reader, records_to_read)
+                    if tail_records_count:
+                        records_to_read -= tail_records_count
+                        continue
+                    self.close_buffered_reader()
+                    self.new_pos = EventStorageReaderPointer(next_file, 0)
             except IOError as e:
                 log.warning("[%s] Failed to read file! Error: %s", self.new_pos.get_file(), e)
                 break
             except Exception as e:
                 log.exception(e)
+                break
         return self.current_batch
 
+    def read_records(self, buffered_reader, records_to_read):
+        if self.data_file_format is None:
+            self.data_file_format = self.detect_format(buffered_reader, self.new_pos)
+        if self.data_file_format == BINARY_FORMAT:
+            return self.read_binary_records(buffered_reader, records_to_read)
+        if self.data_file_format == BASE64_FORMAT:
+            return self.read_base64_records(buffered_reader, records_to_read)
+        return 0
+
+    def read_base64_records(self, buffered_reader, records_to_read):
+        records_count = 0
+        current_line_in_file = self.new_pos.get_line()
+        while records_count < records_to_read:
+            line = buffered_reader.readline()
+            if not line.endswith(b'\n'):
+                # Nothing or only a part of the record has been written yet
+                buffered_reader.seek(-len(line), SEEK_CUR)
+                break
+            current_line_in_file += 1
+            try:
+                self.current_batch.append(b64decode(line).decode("utf-8"))
+                records_count += 1
+            except Exception as e:
+                log.warning("Could not parse line [%s] to uplink message! %s", line, e)
+        self.new_pos.set_line(current_line_in_file)
+        self.new_pos.set_offset(buffered_reader.tell())
+        return records_count
+
+    def read_binary_records(self, buffered_reader, records_to_read):
+        records_count = 0
+        while records_count < records_to_read:
+            block_offset = buffered_reader.tell()
+            header = buffered_reader.read(BLOCK_HEADER.size)
+            try:
+                if len(header) < BLOCK_HEADER.size:
+                    buffered_reader.seek(block_offset)
+                    break
+                codec, block_records_count, payload_size, checksum = BlockCodec.decode_header(header)
+                payload = buffered_reader.read(payload_size)
+                if len(payload) < payload_size:
+                    buffered_reader.seek(block_offset)
+                    break
+                messages = BlockCodec.decode_payload(codec, block_records_count, payload, checksum)
+            except CorruptedBlockError as e:
+                log.error("[%s] Corrupted data block at %i, the rest of the file will be skipped! %s",
+                          self.new_pos.get_file(), block_offset, e)
+                buffered_reader.seek(0, SEEK_END)
+                self.new_pos.set_offset(buffered_reader.tell())
+                break
+            self.current_batch.extend(messages)
+            records_count += len(messages)
+            self.new_pos.set_line(self.new_pos.get_line() + len(messages))
+            self.new_pos.set_offset(buffered_reader.tell())
+        return records_count
+
     def discard_batch(self):
         try:
-            if self.current_pos.get_line() >= self.settings.get_max_records_per_file() - 1:
-                if self.buffered_reader is not None and not self.buffered_reader.closed:
-                    self.buffered_reader.close()
-            self.write_info_to_state_file(self.new_pos)
-            self.current_pos = self.new_pos
-            self.current_batch = None
+            if self.pending_batches:
+                _, discarded_pos = self.pending_batches.popleft()
+                self.read_ahead_count = max(self.read_ahead_count - 1, 0)
+            else:
+                discarded_pos = self.new_pos.copy()
+            self.write_info_to_state_file(discarded_pos)
+            for data_file in self.files.get_data_files():
+                if data_file >= discarded_pos.get_file():
+                    break
+                self.delete_read_file(EventStorageReaderPointer(data_file, 0))
+            self.current_pos = discarded_pos
         except Exception as e:
             log.exception(e)
 
@@ -107,13 +170,7 @@ class EventStorageReader:
             if self.buffered_reader is None or self.buffered_reader.closed:
                 new_file_to_read_path = self.settings.get_data_folder_path() + pointer.get_file()
                 self.buffered_reader = BufferedReader(FileIO(new_file_to_read_path, 'r'))
-                lines_to_skip = pointer.get_line()
-                if lines_to_skip > 0:
-                    while self.buffered_reader.readline() is not None:
-                        if lines_to_skip > 0:
-                            lines_to_skip -= 1
-                        else:
-                            break
+                self.data_file_format = self.detect_format(self.buffered_reader, pointer)
 
             return self.buffered_reader
 
@@ -123,6 +180,63 @@ class EventStorageReader:
         except Exception as e:
             log.exception(e)
 
+    def detect_format(self, buffered_reader, pointer):
+        """
+        Detects the data file format and moves the reader to the pointer position
+        """
+        buffered_reader.seek(0)
+        data_file_format = detect_data_file_format(buffered_reader.peek(len(BINARY_FILE_MAGIC))[:len(BINARY_FILE_MAGIC)])
+        if data_file_format is None:
+            return data_file_format
+
+        offset = pointer.get_offset()
+        if self.is_valid_offset(buffered_reader, data_file_format, offset, pointer.get_line()):
+            if data_file_format == BINARY_FORMAT:
+                offset = max(offset, len(BINARY_FILE_MAGIC))
+                pointer.set_offset(offset)
+            buffered_reader.seek(offset)
+            return data_file_format
+
+        # State file has no offset (written by an older version) or it is broken, use the index to recover
+        indexed_record, indexed_offset = self.index.find(pointer.get_file(), pointer.get_line())
+        if data_file_format == BINARY_FORMAT:
+            buffered_reader.seek(max(indexed_offset, len(BINARY_FILE_MAGIC)))
+            records_to_skip = pointer.get_line() - indexed_record
+            while records_to_skip > 0:
+                header = buffered_reader.read(BLOCK_HEADER.size)
+                if len(header) < BLOCK_HEADER.size:
+                    break
+                _, block_records_count, payload_size, _ = BLOCK_HEADER.unpack(header)
+                buffered_reader.seek(payload_size, SEEK_CUR)
+                records_to_skip -= block_records_count
+        else:
+            buffered_reader.seek(indexed_offset)
+            lines_to_skip = pointer.get_line() - indexed_record
+            while lines_to_skip > 0 and buffered_reader.readline().endswith(b'\n'):
+                lines_to_skip -= 1
+        log.info("FileStorage_reader -- Position in %s recovered using the index", pointer.get_file())
+        pointer.set_offset(buffered_reader.tell())
+        return data_file_format
+
+    @staticmethod
+    def is_valid_offset(buffered_reader, data_file_format, offset, line):
+        if data_file_format == BINARY_FORMAT:
+            if offset < len(BINARY_FILE_MAGIC):
+                return line == 0
+            return offset <= buffered_reader.seek(0, SEEK_END)
+        if offset == 0:
+            return line == 0
+        if offset > buffered_reader.seek(0, SEEK_END):
+            return False
+        # Offset must point to the beginning of a line
+        buffered_reader.seek(offset - 1)
+        return buffered_reader.read(1) == b'\n'
+
+    def close_buffered_reader(self):
+        if self.buffered_reader is not None and not self.buffered_reader.closed:
+            self.buffered_reader.close()
+        self.data_file_format = None
+
     def read_state_file(self):
         try:
             state_data_node = {}
@@ -136,8 +250,10 @@ class EventStorageReader:
                 log.warning("Failed to fetch info from state file! Error: %s", e)
             reader_file = None
             reader_pos = 0
+            reader_offset = 0
             if state_data_node:
                 reader_pos = state_data_node['position']
+                reader_offset = state_data_node.get('offset', 0)
                 for file in sorted(self.files.get_data_files()):
                     if file == state_data_node['file']:
                         reader_file = file
@@ -145,16 +261,17 @@ class EventStorageReader:
             if reader_file is None:
                 reader_file = sorted(self.files.get_data_files())[0]
                 reader_pos = 0
+                reader_offset = 0
             log.info("FileStorage_reader -- Initializing from state file: [%s:%i]",
                      self.settings.get_data_folder_path() + reader_file,
                      reader_pos)
-            return EventStorageReaderPointer(reader_file, reader_pos)
+            return EventStorageReaderPointer(reader_file, reader_pos, reader_offset)
         except Exception as e:
             log.exception(e)
 
     def write_info_to_state_file(self, pointer: EventStorageReaderPointer):
         try:
-            state_file_node = {'file': pointer.get_file(), 'position': pointer.get_line()}
+            state_file_node = {'file': pointer.get_file(), 'position': pointer.get_line(), 'offset': pointer.get_offset()}
             with open(self.settings.get_data_folder_path() + self.files.get_state_file(), 'w') as outfile:
                 outfile.write(dumps(state_file_node))
         except IOError as e:
@@ -167,6 +284,7 @@ class EventStorageReader:
         try:
             if exists(self.settings.get_data_folder_path() + current_file.file) and len(data_files) > 1:
                 remove(self.settings.get_data_folder_path() + current_file.file)
+            self.index.delete(current_file.file)
             if current_file.file in data_files:
                 self.files.data_files.remove(current_file.file)
                 log.info("FileStorage_reader -- Cleanup old data file: %s%s!", self.settings.get_data_folder_path(), current_file.file)
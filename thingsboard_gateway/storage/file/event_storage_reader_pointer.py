@@ -14,15 +14,16 @@
 
 
 class EventStorageReaderPointer:
-    def __init__(self, file, line):
+    def __init__(self, file, line, offset=0):
         self.file = file
         self.line = line
+        self.offset = offset
 
     def __eq__(self, other):
-        return self.file == other.file and self.line == other.line
+        return self.file == other.file and self.line == other.line and self.offset == other.offset
 
     def __hash__(self):
-        return hash((self.file, self.line))
+        return hash((self.file, self.line, self.offset))
 
     def get_file(self):
         return self.file
@@ -35,3 +36,12 @@ class EventStorageReaderPointer:
 
     def set_line(self, line):
         self.line = line
+
+    def get_offset(self):
+        return self.offset
+
+    def set_offset(self, offset):
+        self.offset = offset
+
+    def copy(self):
+        return EventStorageReaderPointer(self.file, self.line, self.offset)
@@ -14,11 +14,16 @@
 
 from base64 import b64encode
 from io import BufferedWriter, FileIO
-from os import O_CREAT, O_EXCL, close as os_close, linesep, open as os_open
+from os import O_CREAT, O_EXCL, close as os_close, fsync, linesep, open as os_open
 from os.path import exists
+from threading import Event, RLock, Thread
 from time import time
 
+from thingsboard_gateway.storage.file.event_storage_data_format import BINARY_FILE_MAGIC, BINARY_FORMAT, \
+    BASE64_FORMAT, DATA_FILE_FORMATS, MAX_RECORDS_PER_BLOCK, BlockCodec, count_binary_records, \
+    read_data_file_format
 from thingsboard_gateway.storage.file.event_storage_files import EventStorageFiles
+from thingsboard_gateway.storage.file.event_storage_index import EventStorageIndex
 from thingsboard_gateway.storage.file.file_event_storage import log
 from thingsboard_gateway.storage.file.file_event_storage_settings import FileEventStorageSettings
 
@@ -32,52 +37,156 @@ class EventStorageWriter:
         self.files = files
         self.settings = settings
         self.buffered_writer = None
+        self.lock = RLock()
         self.current_file = sorted(files.get_data_files())[-1]
         self.current_file_records_count = [0]
         self.previous_file_records_count = [0]
+        self.last_fsync_time = time()
+        # Fsyncs records that are not followed by more writes, when max_time_between_fsync passes
+        self.fsync_requested = Event()
+        self.stopped = Event()
+        self.fsync_thread = Thread(target=self.fsync_pending_records, daemon=True, name="Storage fsync thread")
+        self.index = EventStorageIndex(settings)
+        self.data_file_format = settings.get_data_file_format()
+        if self.data_file_format not in DATA_FILE_FORMATS:
+            log.warning("Unknown data file format %s, %s will be used", self.data_file_format, BASE64_FORMAT)
+            self.data_file_format = BASE64_FORMAT
+        self.block_codec = BlockCodec(settings.get_compression(), settings.get_compression_level(),
+                                      settings.get_compression_min_size())
         self.get_number_of_records_in_file(self.current_file)
+        current_file_format = read_data_file_format(self.settings.get_data_folder_path() + self.current_file)
+        if current_file_format is not None and current_file_format != self.data_file_format:
+            # Never mix formats in one file, the next write will switch to a new data file
+            self.current_file_records_count[0] = self.settings.get_max_records_per_file()
+        self.fsync_thread.start()
 
     def write(self, msg):
-        if len(self.files.data_files) <= self.settings.get_max_files_count():
-            if self.current_file_records_count[0] >= self.settings.get_max_records_per_file() or not exists(
-                    self.settings.get_data_folder_path() + self.current_file):
-                try:
-                    self.current_file = self.create_datafile()
-                    log.debug("FileStorage_writer -- Created new data file: %s", self.current_file)
-                except IOError as e:
-                    log.error("Failed to create a new file! %s", e)
-                self.files.get_data_files().append(self.current_file)
-                self.current_file_records_count[0] = 0
-                try:
-                    if self.buffered_writer is not None and self.buffered_writer.closed is False:
-                        self.buffered_writer.close()
-                except IOError as e:
-                    log.warning("Failed to close buffered writer! %s", e)
-                self.buffered_writer = None
-            try:
-                encoded = b64encode(msg.encode("utf-8"))
-                if not exists(self.settings.get_data_folder_path() + self.current_file):
-                    self.current_file = self.create_datafile()
-                self.buffered_writer = self.get_or_init_buffered_writer(self.current_file)
-                self.buffered_writer.write(encoded + linesep.encode('utf-8'))
-                self.current_file_records_count[0] += 1
-                if self.current_file_records_count[0] - self.previous_file_records_count[0] >= self.settings.get_max_records_between_fsync():
-                    self.previous_file_records_count = self.current_file_records_count[:]
-                    self.buffered_writer.flush()
+        self.write_many([msg])
+
+    def write_many(self, messages):
+        """
+        Writes messages with one flush per data file, binary files get a block per
+        max_read_records_count messages so the read pack size is kept
+        """
+        with self.lock:
+            written_count = 0
+            while written_count < len(messages):
+                if len(self.files.data_files) > self.settings.get_max_files_count():
+                    raise DataFileCountError("The number of data files has been exceeded - change the settings or check the connection. New data will be lost.")
+                if self.current_file_records_count[0] >= self.settings.get_max_records_per_file():
+                    self.close_buffered_writer()
+                    try:
+                        self.current_file = self.create_datafile()
+                        log.debug("FileStorage_writer -- Created new data file: %s", self.current_file)
+                    except IOError as e:
+                        log.error("Failed to create a new file! %s", e)
+                    self.current_file_records_count[0] = 0
+                    self.previous_file_records_count[0] = 0
+                chunk_size = self.settings.get_max_records_per_file() - self.current_file_records_count[0]
+                chunk = messages[written_count:written_count + chunk_size]
                 try:
-                    if self.buffered_writer is not None and self.buffered_writer.closed is False:
-                        self.buffered_writer.close()
+                    self.write_records(chunk)
                 except IOError as e:
-                    log.warning("Failed to close buffered writer! %s", e)
-            except IOError as e:
-                log.warning("Failed to update data file![%s]\n%s", self.current_file, e)
+                    log.warning("Failed to update data file![%s]\n%s", self.current_file, e)
+                    self.close_buffered_writer()
+                    # The storage has to report the messages as not saved
+                    raise
+                written_count += len(chunk)
+
+    def write_records(self, messages):
+        buffered_writer = self.get_or_init_buffered_writer(self.current_file)
+        offset = buffered_writer.tell()
+        if self.data_file_format == BINARY_FORMAT:
+            block_size = max(min(self.settings.get_max_read_records_count(), MAX_RECORDS_PER_BLOCK), 1)
+            for block_start in range(0, len(messages), block_size):
+                encoded = self.encode(messages[block_start:block_start + block_size])
+                self.index.add_entry(self.current_file_records_count[0] + block_start, offset)
+                buffered_writer.write(encoded)
+                offset += len(encoded)
         else:
-            raise DataFileCountError("The number of data files has been exceeded - change the settings or check the connection. New data will be lost.")
+            line_separator = linesep.encode('utf-8')
+            for record_number, msg in enumerate(messages, self.current_file_records_count[0]):
+                encoded = b64encode(msg.encode("utf-8")) + line_separator
+                self.index.add_entry(record_number, offset)
+                buffered_writer.write(encoded)
+                offset += len(encoded)
+        # The data file is kept open, so flush to make the records visible for the reader
+        buffered_writer.flush()
+        self.current_file_records_count[0] += len(messages)
+        self.fsync_if_needed()
+
+    def encode(self, messages):
+        if self.data_file_format == BINARY_FORMAT:
+            return self.block_codec.encode(messages)
+        line_separator = linesep.encode('utf-8')
+        return b''.join(b64encode(msg.encode("utf-8")) + line_separator for msg in messages)
+
+    def fsync_if_needed(self):
+        records_since_fsync = self.current_file_records_count[0] - self.previous_file_records_count[0]
+        if records_since_fsync >= self.settings.get_max_records_between_fsync() or \
+                (records_since_fsync > 0 and time() - self.last_fsync_time >= self.settings.get_max_time_between_fsync()):
+            self.fsync()
+        elif records_since_fsync > 0:
+            self.fsync_requested.set()
+
+    def fsync_pending_records(self):
+        while not self.stopped.is_set():
+            self.fsync_requested.wait()
+            with self.lock:
+                if self.stopped.is_set() or \
+                        self.current_file_records_count[0] <= self.previous_file_records_count[0]:
+                    self.fsync_requested.clear()
+                    continue
+                delay = self.settings.get_max_time_between_fsync() - (time() - self.last_fsync_time)
+                if delay <= 0:
+                    try:
+                        self.fsync()
+                    except (IOError, ValueError) as e:
+                        log.warning("Failed to fsync data file![%s]\n%s", self.current_file, e)
+                        self.fsync_requested.clear()
+                    continue
+            self.stopped.wait(delay)
+
+    def fsync(self):
+        if self.buffered_writer is not None and not self.buffered_writer.closed:
+            self.buffered_writer.flush()
+            fsync(self.buffered_writer.fileno())
+        self.previous_file_records_count = self.current_file_records_count[:]
+        self.last_fsync_time = time()
+        self.fsync_requested.clear()
+
+    def close_buffered_writer(self):
+        try:
+            if self.buffered_writer is not None and self.buffered_writer.closed is False:
+                self.fsync()
+                self.buffered_writer.close()
+        except IOError as e:
+            log.warning("Failed to close buffered writer! %s", e)
+        self.buffered_writer = None
+        self.index.close()
+
+    def close(self):
+        self.stopped.set()
+        with self.lock:
+            self.close_buffered_writer()
+        # Wakes the fsync thread up after the last fsync has cleared the request
+        self.fsync_requested.set()
+        self.fsync_thread.join()
 
     def get_or_init_buffered_writer(self, file):
         try:
             if self.buffered_writer is None or self.buffered_writer.closed:
-                self.buffered_writer = BufferedWriter(FileIO(self.settings.get_data_folder_path() + file, 'a'))
+                file_path = self.settings.get_data_folder_path() + file
+                if not exists(file_path):
+                    self.current_file = file = self.create_datafile()
+                    file_path = self.settings.get_data_folder_path() + file
+                    self.current_file_records_count[0] = 0
+                    self.previous_file_records_count[0] = 0
+                self.buffered_writer = BufferedWriter(FileIO(file_path, 'a'))
+                if self.data_file_format == BINARY_FORMAT and self.buffered_writer.tell() == 0:
+                    self.buffered_writer.write(BINARY_FILE_MAGIC)
+                    self.buffered_writer.flush()
+                self.index.open(file, self.current_file_records_count[0])
             return self.buffered_writer
         except IOError as e:
             log.error("Failed to initialize buffered writer! Error: %s", e)
@@ -85,7 +194,11 @@ class EventStorageWriter:
 
     def create_datafile(self):
         prefix = 'data_'
-        datafile_name = str(int(time() * 1000))
+        datafile_timestamp = int(time() * 1000)
+        # Files may roll over faster than once per millisecond, names have to stay unique and ordered
+        while exists("%s%s%i.txt" % (self.settings.get_data_folder_path(), prefix, datafile_timestamp)):
+            datafile_timestamp += 1
+        datafile_name = str(datafile_timestamp)
         self.files.data_files.append("%s%s.txt" % (prefix, datafile_name))
         return self.create_file(prefix, datafile_name)
 
@@ -102,9 +215,13 @@ class EventStorageWriter:
     def get_number_of_records_in_file(self, file):
         if self.current_file_records_count[0] <= 0:
             try:
-                with open(self.settings.get_data_folder_path() + file) as data_file:
-                    for i, _ in enumerate(data_file):
-                        self.current_file_records_count[0] = i + 1
+                file_path = self.settings.get_data_folder_path() + file
+                if read_data_file_format(file_path) == BINARY_FORMAT:
+                    self.current_file_records_count[0] = count_binary_records(file_path)
+                else:
+                    with open(file_path) as data_file:
+                        for i, _ in enumerate(data_file):
+                            self.current_file_records_count[0] = i + 1
             except IOError as e:
                 log.warning("Could not get the records count from the file![%s] with error: %s", file, e)
             except Exception as e:
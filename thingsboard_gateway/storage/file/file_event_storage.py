@@ -14,11 +14,13 @@
 
 import os
 import time
+from threading import Event
 
 from simplejson import dump
 
 from thingsboard_gateway.storage.event_storage import EventStorage, log
 from thingsboard_gateway.storage.file.event_storage_files import EventStorageFiles
+from thingsboard_gateway.storage.file.event_storage_mmap_reader import EventStorageMmapReader
 from thingsboard_gateway.storage.file.event_storage_reader import EventStorageReader
 from thingsboard_gateway.storage.file.event_storage_writer import DataFileCountError, EventStorageWriter
 from thingsboard_gateway.storage.file.file_event_storage_settings import FileEventStorageSettings
@@ -32,20 +34,28 @@ class FileEventStorage(EventStorage):
         self.data_files = self.event_storage_files.get_data_files()
         self.state_file = self.event_storage_files.get_state_file()
         self.__writer = EventStorageWriter(self.event_storage_files, self.settings)
-        self.__reader = EventStorageReader(self.event_storage_files, self.settings)
+        if self.settings.get_reader_mode() == 'mmap':
+            self.__reader = EventStorageMmapReader(self.event_storage_files, self.settings)
+        else:
+            self.__reader = EventStorageReader(self.event_storage_files, self.settings)
+        self.__data_available = Event()
         self.__stopped = False
 
     def put(self, event):
+        return self.put_many([event])
+
+    def put_many(self, events):
         success = False
         if not self.__stopped:
             try:
-                self.__writer.write(event)
+                self.__writer.write_many(events)
             except DataFileCountError as e:
                 log.error(e)
             except Exception as e:
                 log.exception(e)
             else:
                 success = True
+                self.__data_available.set()
         else:
             log.error("Storage is closed!")
         return success
@@ -53,9 +63,16 @@ class FileEventStorage(EventStorage):
     def get_event_pack(self):
         return self.__reader.read()
 
+    def get_next_event_pack(self):
+        return self.__reader.read_next()
+
     def event_pack_processing_done(self):
         self.__reader.discard_batch()
 
+    def wait_for_data(self, timeout):
+        if self.__data_available.wait(timeout):
+            self.__data_available.clear()
+
     def init_data_folder_if_not_exist(self):
         path = self.settings.get_data_folder_path()
         if not os.path.exists(path):
@@ -100,6 +117,7 @@ class FileEventStorage(EventStorage):
 
     def stop(self):
         self.__stopped = True
+        self.__writer.close()
 
     def len(self):
         return len(self.__writer.files.data_files)
@@ -18,8 +18,15 @@ class FileEventStorageSettings:
         self.data_folder_path = config.get("data_folder_path", "./")
         self.max_files_count = config.get("max_file_count", 5)
         self.max_records_per_file = config.get("max_records_per_file", 3)
-        self.max_records_between_fsync = config.get("max_records_between_fsync", 1)
+        self.max_records_between_fsync = config.get("max_records_between_fsync", 100)
+        self.max_time_between_fsync = config.get("max_time_between_fsync_ms", 1000) / 1000
         self.max_read_records_count = config.get("max_read_records_count", 1000)
+        self.data_file_format = config.get("data_file_format", "base64")
+        self.compression = config.get("compression", "none")
+        self.compression_level = config.get("compression_level")
+        self.compression_min_size = config.get("compression_min_size_bytes", 256)
+        self.reader_mode = config.get("reader_mode", "buffered")
+        self.index_interval_records = max(config.get("index_interval_records", 1000), 1)
 
     def get_data_folder_path(self):
         return self.data_folder_path
@@ -33,5 +40,26 @@ class FileEventStorageSettings:
     def get_max_records_between_fsync(self):
         return self.max_records_between_fsync
 
+    def get_max_time_between_fsync(self):
+        return self.max_time_between_fsync
+
     def get_max_read_records_count(self):
         return self.max_read_records_count
+
+    def get_data_file_format(self):
+        return self.data_file_format
+
+    def get_compression(self):
+        return self.compression
+
+    def get_compression_level(self):
+        return self.compression_level
+
+    def get_compression_min_size(self):
+        return self.compression_min_size
+
+    def get_reader_mode(self):
+        return self.reader_mode
+
+    def get_index_interval_records(self):
+        return self.index_interval_records
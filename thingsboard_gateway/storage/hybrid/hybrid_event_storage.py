@@ -0,0 +1,36 @@
+#     Copyright 2022. ThingsBoard
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+
+from thingsboard_gateway.storage.event_storage import log
+from thingsboard_gateway.storage.memory.memory_event_storage import SPILL_POLICY, MemoryEventStorage
+
+
+class HybridEventStorage(MemoryEventStorage):
+    """
+    Keeps events in memory while ThingsBoard is reachable and the memory budget is not exceeded,
+    otherwise events go to the file or SQLite storage configured in "spill".
+    """
+
+    def __init__(self, config):
+        super().__init__({**config, "overflow_policy": SPILL_POLICY, "spill": config.get("spill", {"type": "file"})})
+
+    def on_connection_state_changed(self, connected):
+        if not connected:
+            log.info("Connection to ThingsBoard lost, events will be stored on disk.")
+        self.set_spill_forced(not connected)
+
+    def stop(self):
+        # Memory content would be lost on exit, so it is drained to disk
+        self.spill_events(include_event_pack=True)
+        super().stop()
@@ -12,47 +12,254 @@
 #     See the License for the specific language governing permissions and
 #     limitations under the License.
 
-from queue import Empty, Full, Queue
+from collections import deque
+from sys import getsizeof
+from threading import Condition, RLock
+
+from simplejson import dumps
 
 from thingsboard_gateway.storage.event_storage import EventStorage, log
 
+DROP_NEWEST_POLICY = 'drop_newest'
+DROP_OLDEST_POLICY = 'drop_oldest'
+SPILL_POLICY = 'spill'
+OVERFLOW_POLICIES = (DROP_NEWEST_POLICY, DROP_OLDEST_POLICY, SPILL_POLICY)
+
 
 class MemoryEventStorage(EventStorage):
     def __init__(self, config):
         self.__queue_len = config.get("max_records_count", 10000)
+        self.__max_size_bytes = config.get("max_size_bytes", 0)
         self.__events_per_time = config.get("read_records_count", 1000)
-        self.__events_queue = Queue(self.__queue_len)
-        self.__event_pack = []
+        self.__overflow_policy = config.get("overflow_policy", DROP_NEWEST_POLICY)
+        if self.__overflow_policy not in OVERFLOW_POLICIES:
+            log.error("Unknown overflow policy %s, %s will be used", self.__overflow_policy, DROP_NEWEST_POLICY)
+            self.__overflow_policy = DROP_NEWEST_POLICY
+        self.__lock = RLock()
+        self.__data_available = Condition(self.__lock)
+        self.__events_queue = deque()
+        # Sizes of the queued events, so events are sized only once
+        self.__events_sizes = deque()
+        self.__events_size = 0
+        # Packs returned to the reader and not confirmed yet, every item is (events, read from the spill storage)
+        self.__event_packs = deque()
+        self.__read_ahead_count = 0
+        self.__spill_storage = None
+        # While active, the spill storage may have events to read, so new events go there to keep the order.
+        # Cleared only when the spill storage returns nothing and none of its packs is in flight
+        self.__spill_active = False
+        # Approximate, the spill storage may lose events (IO errors, TTL), it is used only by len()
+        self.__spilled_events_count = 0
+        self.__spill_forced = False
+        if self.__overflow_policy == SPILL_POLICY:
+            self.__spill_storage = self.__create_spill_storage(config.get("spill", {}))
+            # Events spilled before restart are older than any new one, so they have to be read first
+            self.__spill_active = bool(self.__spill_storage.get_event_pack())
         self.__stopped = False
-        log.debug("Memory storage created with following configuration: \nMax size: %i\n Read records per time: %i",
-                  self.__queue_len, self.__events_per_time)
+        self.__statistics = {
+            "droppedNewestEvents": 0,
+            "droppedOldestEvents": 0,
+            "spilledEvents": 0,
+            "highWaterRecords": 0,
+            "highWaterBytes": 0
+        }
+        log.debug("Memory storage created with following configuration: \nMax size: %i\n Max size in bytes: %i\n"
+                  " Read records per time: %i\n Overflow policy: %s",
+                  self.__queue_len, self.__max_size_bytes, self.__events_per_time, self.__overflow_policy)
+
+    @staticmethod
+    def __create_spill_storage(spill_config):
+        spill_type = spill_config.get("type", "file")
+        if spill_type == "sqlite":
+            from thingsboard_gateway.storage.sqlite.sqlite_event_storage import SQLiteEventStorage
+            return SQLiteEventStorage(spill_config)
+        from thingsboard_gateway.storage.file.file_event_storage import FileEventStorage
+        return FileEventStorage(spill_config)
+
+    @staticmethod
+    def get_event_size(event):
+        if isinstance(event, (str, bytes)):
+            return len(event)
+        if isinstance(event, dict):
+            return MemoryEventStorage.__estimate_structured_size(event)
+        return getsizeof(event)
+
+    @staticmethod
+    def __estimate_structured_size(data):
+        # Rough size of the data serialized to JSON, walking the structure is cheaper than serializing it
+        if isinstance(data, dict):
+            return 2 + sum(len(key) + 4 + MemoryEventStorage.__estimate_structured_size(value)
+                           for key, value in data.items())
+        if isinstance(data, (list, tuple)):
+            return 2 + sum(2 + MemoryEventStorage.__estimate_structured_size(item) for item in data)
+        if isinstance(data, str):
+            return len(data) + 2
+        return 8
+
+    def is_structured_events_supported(self):
+        return True
 
     def put(self, event):
-        success = False
-        if not self.__stopped:
-            try:
-                self.__events_queue.put(event)
-                success = True
-            except Full:
-                log.error("Memory storage is full!")
-        else:
+        if self.__stopped:
+            log.error("Storage is stopped!")
+            return False
+
+        with self.__lock:
+            self.__data_available.notify_all()
+            return self.__put(event)
+
+    def put_many(self, events):
+        if self.__stopped:
             log.error("Storage is stopped!")
-        return success
+            return False
+
+        with self.__lock:
+            self.__data_available.notify_all()
+            results = [self.__put(event) for event in events]
+            return all(results)
+
+    def __put(self, event):
+        # Keep the order of events, new events go to the spill storage until it is drained
+        if self.__spill_forced or self.__spill_active:
+            return self.__spill(event)
+
+        event_size = self.get_event_size(event)
+        if not self.__has_space_for(event_size):
+            if self.__overflow_policy == SPILL_POLICY:
+                self.__spill_queued_events()
+                return self.__spill(event)
+            if self.__overflow_policy == DROP_OLDEST_POLICY:
+                while self.__events_queue and not self.__has_space_for(event_size):
+                    self.__events_queue.popleft()
+                    self.__events_size -= self.__events_sizes.popleft()
+                    self.__statistics["droppedOldestEvents"] += 1
+            if not self.__has_space_for(event_size):
+                self.__statistics["droppedNewestEvents"] += 1
+                log.error("Memory storage is full!")
+                return False
+
+        self.__events_queue.append(event)
+        self.__events_sizes.append(event_size)
+        self.__events_size += event_size
+        self.__statistics["highWaterRecords"] = max(self.__statistics["highWaterRecords"],
+                                                    len(self.__events_queue))
+        self.__statistics["highWaterBytes"] = max(self.__statistics["highWaterBytes"], self.__events_size)
+        return True
+
+    def __has_space_for(self, event_size):
+        if 0 < self.__queue_len <= len(self.__events_queue):
+            return False
+        return not self.__max_size_bytes or self.__events_size + event_size <= self.__max_size_bytes
+
+    def __spill_queued_events(self):
+        # Queued events are older than any spilled one, so the spill storage must get them first
+        while self.__events_queue:
+            event = self.__events_queue.popleft()
+            self.__events_size -= self.__events_sizes.popleft()
+            self.__spill(event)
+
+    def spill_events(self, include_event_pack=False):
+        """
+        Moves events kept in memory to the spill storage. With include_event_pack the packs returned to the reader
+        are spilled too and later confirmations are ignored, so it is used only when the reader is stopped.
+        """
+        if self.__spill_storage is None:
+            return
+        with self.__lock:
+            if include_event_pack:
+                for events, from_spill in self.__event_packs:
+                    if not from_spill:
+                        for event in events:
+                            self.__spill(event)
+                # Not confirmed spill packs are read again from the spill storage
+                self.__event_packs.clear()
+                self.__read_ahead_count = 0
+            self.__spill_queued_events()
+
+    def set_spill_forced(self, forced):
+        """
+        While forced, queued events and all new events go to the spill storage. Packs returned to the reader
+        stay in memory until they are confirmed or read again, confirmations are matched to packs by order.
+        """
+        if self.__spill_storage is None:
+            return
+        with self.__lock:
+            self.__spill_forced = forced
+            if forced:
+                self.spill_events()
+
+    def __spill(self, event):
+        # Structured events are kept only in memory, durable storages work with JSON strings
+        if isinstance(event, dict):
+            event = dumps(event)
+        if self.__spill_storage.put(event):
+            self.__spill_active = True
+            self.__spilled_events_count += 1
+            self.__statistics["spilledEvents"] += 1
+            return True
+        self.__statistics["droppedNewestEvents"] += 1
+        return False
+
+    def wait_for_data(self, timeout):
+        with self.__data_available:
+            if self.__events_queue or self.__event_packs:
+                return
+            if not self.__spill_active:
+                self.__data_available.wait(timeout)
+                return
+        # New events go to the spill storage while it is active, so it is the one to be notified
+        self.__spill_storage.wait_for_data(timeout)
 
     def get_event_pack(self):
-        try:
-            if not self.__event_pack:
-                self.__event_pack = [self.__events_queue.get(False) for _ in
-                                     range(min(self.__events_per_time, self.__events_queue.qsize()))]
-        except Empty:
-            pass
-        return self.__event_pack
+        with self.__lock:
+            self.__read_ahead_count = 0
+            return self.get_next_event_pack()
+
+    def get_next_event_pack(self):
+        with self.__lock:
+            if self.__read_ahead_count < len(self.__event_packs):
+                events = self.__event_packs[self.__read_ahead_count][0]
+                self.__read_ahead_count += 1
+                return events
+            if self.__events_queue:
+                events_count = min(self.__events_per_time, len(self.__events_queue))
+                events = [self.__events_queue.popleft() for _ in range(events_count)]
+                self.__events_size -= sum(self.__events_sizes.popleft() for _ in range(events_count))
+                from_spill = False
+            elif self.__spill_active:
+                if any(pack[1] for pack in self.__event_packs):
+                    events = list(self.__spill_storage.get_next_event_pack())
+                else:
+                    events = list(self.__spill_storage.get_event_pack())
+                    if not events:
+                        # Drained, events lost by the spill storage are not waited for
+                        self.__spill_active = False
+                        self.__spilled_events_count = 0
+                from_spill = True
+            else:
+                events = []
+            if events:
+                self.__event_packs.append((events, from_spill))
+                self.__read_ahead_count += 1
+            return events
 
     def event_pack_processing_done(self):
-        self.__event_pack = []
+        with self.__lock:
+            if not self.__event_packs:
+                return
+            events, from_spill = self.__event_packs.popleft()
+            self.__read_ahead_count = max(self.__read_ahead_count - 1, 0)
+            if from_spill:
+                self.__spill_storage.event_pack_processing_done()
+                self.__spilled_events_count = max(self.__spilled_events_count - len(events), 0)
 
     def stop(self):
         self.__stopped = True
+        if self.__spill_storage is not None:
+            self.__spill_storage.stop()
 
     def len(self):
-        return self.__events_queue.qsize()
+        return len(self.__events_queue) + self.__spilled_events_count
+
+    def get_statistics(self):
+        return {**self.__statistics, "eventsInMemory": len(self.__events_queue), "bytesInMemory": self.__events_size}
@@ -13,10 +13,10 @@
 #     limitations under the License.
 
 from os.path import exists
-from time import time, sleep
+from time import time
 from logging import getLogger
-from threading import Thread
-from queue import Queue
+from threading import Event, Thread
+from queue import Empty, Queue
 import datetime
 
 from thingsboard_gateway.storage.sqlite.database_connector import DatabaseConnector
@@ -52,6 +52,8 @@ class Database(Thread):
 
         # process Queue
         self.processQueue = processing_queue
+        # Set after new messages are committed
+        self.data_available = Event()
 
         self.__stopped = False
 
@@ -62,59 +64,112 @@ class Database(Thread):
 
     def init_table(self):
         try:
-            self.db.execute('''CREATE TABLE IF NOT EXISTS messages (timestamp INTEGER, message TEXT); ''')
-            self.db.commit()
+            with self.db.lock:
+                self.__migrate_legacy_table()
+                self.db.execute('''CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                   timestamp INTEGER, message TEXT); ''')
+                self.db.execute('''CREATE INDEX IF NOT EXISTS messages_timestamp ON messages (timestamp); ''')
+                self.db.commit()
         except Exception as e:
             self.db.rollback()
             log.exception(e)
 
+    def __migrate_legacy_table(self):
+        """
+        Tables created by previous versions have no id column, their rows are copied
+        into the new schema in the original timestamp order
+        """
+        columns = [column[1] for column in self.db.execute('''PRAGMA table_info(messages);''').fetchall()]
+        if not columns or 'id' in columns:
+            return
+
+        log.info("Migrating messages table to the id based schema...")
+        self.db.execute('''ALTER TABLE messages RENAME TO messages_legacy;''')
+        self.db.execute('''CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                           timestamp INTEGER, message TEXT); ''')
+        self.db.execute('''INSERT INTO messages (timestamp, message)
+                           SELECT timestamp, message FROM messages_legacy ORDER BY timestamp ASC;''')
+        self.db.execute('''DROP TABLE messages_legacy;''')
+        log.info("Messages table migrated.")
+
     def run(self):
-        while True:
+        while not self.__stopped:
             self.process()
 
-            sleep(.2)
-
     def process(self):
         try:
             if time() - self.__last_msg_check >= self.settings.messages_ttl_check_in_hours:
                 self.__last_msg_check = time()
                 self.delete_data_lte(self.settings.messages_ttl_in_days)
 
-            # Signalization so that we can spam call process()
-            if not self.__stopped and self.processQueue:
-                while self.processQueue.qsize() > 0:
-
-                    req = self.processQueue.get()
-
-                    log.debug("Processing %s" % req.type)
-                    if req.type is DatabaseActionType.WRITE_DATA_STORAGE:
-
-                        message = req.data
-
-                        timestamp = time()
-
-                        self.db.execute('''INSERT INTO messages (timestamp, message) VALUES (?, ?);''',
-                                        [timestamp, message])
-
-                        self.db.commit()
-            else:
-                log.error("Storage is closed!")
-
+            batch = self.__collect_batch()
+            if batch:
+                self.__write_batch(batch)
         except Exception as e:
             self.db.rollback()
             log.exception(e)
 
-    def read_data(self):
+    def __collect_batch(self):
+        """
+        Waits for the first request and then gathers the following ones into one group commit,
+        the group is bounded by max_records_per_commit and max_commit_delay_ms
+        """
+        batch = []
         try:
-            data = self.db.execute('''SELECT timestamp, message FROM messages ORDER BY timestamp ASC LIMIT 0, 50;''')
-            return data
+            batch.append(self.processQueue.get(timeout=self.settings.max_commit_delay or .1))
+        except Empty:
+            return batch
+
+        deadline = time() + self.settings.max_commit_delay
+        while len(batch) < self.settings.max_records_per_commit:
+            try:
+                batch.append(self.processQueue.get_nowait())
+            except Empty:
+                remaining = deadline - time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.processQueue.get(timeout=remaining))
+                except Empty:
+                    break
+        return batch
+
+    def __write_batch(self, batch):
+        rows = []
+        for req in batch:
+            if req.type is DatabaseActionType.WRITE_DATA_STORAGE:
+                rows.append([time(), req.data])
+            elif req.type is DatabaseActionType.WRITE_MANY_DATA_STORAGE:
+                timestamp = time()
+                rows.extend([timestamp, message] for message in req.data)
+        if not rows:
+            return
+
+        log.debug("Writing %i messages to storage", len(rows))
+        with self.db.lock:
+            try:
+                self.db.connection.executemany('''INSERT INTO messages (timestamp, message) VALUES (?, ?);''', rows)
+                self.db.connection.commit()
+            except Exception:
+                self.db.rollback()
+                raise
+        self.data_available.set()
+
+    def read_data(self, after_id=0):
+        try:
+            with self.db.lock:
+                cursor = self.db.execute('''SELECT id, message FROM messages WHERE id > ? ORDER BY id ASC LIMIT ?;''',
+                                         [after_id, self.settings.max_read_records_count])
+                return cursor.fetchall() if cursor is not None else []
         except Exception as e:
             self.db.rollback()
             log.exception(e)
 
-    def delete_data(self, ts):
+    def delete_data(self, last_id):
         try:
-            data = self.db.execute('''DELETE FROM messages WHERE timestamp <= ?;''', [ts,])
+            with self.db.lock:
+                data = self.db.execute('''DELETE FROM messages WHERE id <= ?;''', [last_id])
+                self.db.commit()
             return data
         except Exception as e:
             self.db.rollback()
@@ -133,4 +188,5 @@ class Database(Thread):
         self.processQueue = process_queue
 
     def closeDB(self):
+        self.__stopped = True
         self.db.close()
@@ -17,4 +17,5 @@ from enum import Enum, auto
 
 class DatabaseActionType(Enum):
     WRITE_DATA_STORAGE = auto()  # Writes do not require a response on the request
+    WRITE_MANY_DATA_STORAGE = auto()  # Same as WRITE_DATA_STORAGE, data is a list of messages
 
@@ -24,9 +24,12 @@ from logging import getLogger
 
 log = getLogger("storage")
 
+SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
 
 class DatabaseConnector:
     def __init__(self, settings: StorageSettings):
+        self.settings = settings
         self.data_file_path = settings.data_folder_path
         self.connection: Optional[Connection] = None
         self.lock = RLock()
@@ -37,9 +40,25 @@ class DatabaseConnector:
         """
         try:
             self.connection = connect(self.data_file_path, check_same_thread=False)
+            self.apply_pragmas()
         except Exception as e:
             log.exception(e)
 
+    def apply_pragmas(self):
+        """
+        Configure journal and durability settings, they trade durability for write throughput
+        """
+        synchronous = self.settings.synchronous
+        if synchronous not in SYNCHRONOUS_MODES:
+            log.warning("Unknown synchronous mode %s, NORMAL will be used", synchronous)
+            synchronous = 'NORMAL'
+
+        with self.lock:
+            if self.settings.wal_mode:
+                self.connection.execute('PRAGMA journal_mode=WAL;')
+            self.connection.execute('PRAGMA synchronous=%s;' % synchronous)
+            self.connection.execute('PRAGMA journal_size_limit=%i;' % int(self.settings.journal_size_limit))
+
     def commit(self):
         """
         Commit changes
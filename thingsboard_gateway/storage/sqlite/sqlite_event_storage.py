@@ -12,6 +12,7 @@
 #     See the License for the specific language governing permissions and
 #     limitations under the License.
 
+from collections import deque
 from time import time
 
 from thingsboard_gateway.storage.event_storage import EventStorage
@@ -40,34 +41,43 @@ class SQLiteEventStorage(EventStorage):
         self.db.setProcessQueue(self.processQueue)
         self.db.init_table()
         log.info("Sqlite storage initialized!")
-        self.delete_time_point = None
+        self.last_acked_id = 0
+        # Last ids of the packs that are read and not confirmed yet
+        self.pending_pack_last_ids = deque()
         self.last_read = time()
         self.stopped = False
 
     def get_event_pack(self):
+        # Packs read ahead will be read again, the ids of the messages do not change
+        self.pending_pack_last_ids.clear()
+        return self.get_next_event_pack()
+
+    def get_next_event_pack(self):
         if not self.stopped:
-            data_from_storage = self.read_data()
-            try:                
-                event_pack_timestamps, event_pack_messages = zip(*([(item[0],item[1]) for item in data_from_storage]))
-            except ValueError as e:
+            data_from_storage = self.read_data(self.pending_pack_last_ids[-1] if self.pending_pack_last_ids
+                                               else self.last_acked_id)
+            if not data_from_storage:
                 return []
-            self.delete_time_point = max(event_pack_timestamps)            
-            return event_pack_messages
+            self.pending_pack_last_ids.append(data_from_storage[-1][0])
+            return [item[1] for item in data_from_storage]
         else:
             return []
 
     def event_pack_processing_done(self):
-        if not self.stopped:
-            self.delete_data(self.delete_time_point)
+        if not self.stopped and self.pending_pack_last_ids:
+            last_id = self.pending_pack_last_ids.popleft()
+            self.delete_data(last_id)
+            self.last_acked_id = last_id
 
-    def read_data(self):
-        self.db.__stopped = True
-        data = self.db.read_data()
-        self.db.__stopped = False
-        return data
+    def wait_for_data(self, timeout):
+        if self.db.data_available.wait(timeout):
+            self.db.data_available.clear()
 
-    def delete_data(self, ts):
-        return self.db.delete_data(ts)
+    def read_data(self, after_id):
+        return self.db.read_data(after_id) or []
+
+    def delete_data(self, last_id):
+        return self.db.delete_data(last_id)
 
     def put(self, message):
         try:
@@ -83,6 +93,16 @@ class SQLiteEventStorage(EventStorage):
         except Exception as e:
             log.exception(e)
 
+    def put_many(self, messages):
+        try:
+            if not self.stopped:
+                self.processQueue.put(DatabaseRequest(DatabaseActionType.WRITE_MANY_DATA_STORAGE, list(messages)))
+                return True
+            else:
+                return False
+        except Exception as e:
+            log.exception(e)
+
     def stop(self):
         self.stopped = True
         self.db.__stopped = True
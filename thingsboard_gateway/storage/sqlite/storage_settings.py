@@ -17,3 +17,9 @@ class StorageSettings:
         self.data_folder_path = config.get("data_file_path", "./")
         self.messages_ttl_check_in_hours = config.get('messages_ttl_check_in_hours', 1) * 3600
         self.messages_ttl_in_days = config.get('messages_ttl_in_days', 7)
+        self.max_read_records_count = config.get('max_read_records_count', 50)
+        self.max_records_per_commit = config.get('max_records_per_commit', 1000)
+        self.max_commit_delay = config.get('max_commit_delay_ms', 100) / 1000
+        self.wal_mode = config.get('wal_mode', True)
+        self.synchronous = config.get('synchronous', 'NORMAL').upper()
+        self.journal_size_limit = config.get('journal_size_limit', 4194304)
@@ -0,0 +1,81 @@
+#     Copyright 2022. ThingsBoard
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+
+from collections import OrderedDict
+from threading import Lock
+
+DEFAULT_EXPRESSION_CACHE_SIZE = 10000
+
+
+class CompilationFailure:
+    __slots__ = ('exception',)
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+class ExpressionCache:
+    """
+    Bounded LRU cache of compiled expressions, safe to share between threads.
+    Compilation errors are cached too and raised again on every get.
+    """
+
+    def __init__(self, compile_function, max_size=DEFAULT_EXPRESSION_CACHE_SIZE):
+        self.__compile = compile_function
+        self.__max_size = max_size
+        self.__lock = Lock()
+        self.__cache = OrderedDict()
+        self.__hits = 0
+        self.__misses = 0
+
+    def get(self, expression):
+        with self.__lock:
+            compiled = self.__cache.get(expression)
+            if compiled is not None:
+                self.__cache.move_to_end(expression)
+                self.__hits += 1
+            else:
+                self.__misses += 1
+        if compiled is None:
+            # Compiled out of the lock, a concurrent miss of the same expression only compiles it twice
+            try:
+                compiled = self.__compile(expression)
+            except Exception as e:
+                compiled = CompilationFailure(e)
+            with self.__lock:
+                self.__cache[expression] = compiled
+                self.__cache.move_to_end(expression)
+                while len(self.__cache) > self.__max_size:
+                    self.__cache.popitem(last=False)
+        if isinstance(compiled, CompilationFailure):
+            raise compiled.exception.with_traceback(None)
+        return compiled
+
+    def set_max_size(self, max_size):
+        with self.__lock:
+            self.__max_size = max_size
+            while len(self.__cache) > self.__max_size:
+                self.__cache.popitem(last=False)
+
+    def clear(self):
+        with self.__lock:
+            self.__cache.clear()
+            self.__hits = 0
+            self.__misses = 0
+
+    def get_statistics(self, prefix):
+        with self.__lock:
+            return {prefix + 'Hits': self.__hits,
+                    prefix + 'Misses': self.__misses,
+                    prefix + 'Size': len(self.__cache)}
@@ -0,0 +1,74 @@
+#     Copyright 2022. ThingsBoard
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+
+from thingsboard_gateway.tb_utility.tb_utility import TBUtility, log
+
+
+class TagAccessor:
+    """
+    Reads the value of one "${tag}" from a dict: the tag as a direct key first, then as a JSONPath
+    parsed once. Other bodies are passed to TBUtility.get_value.
+    """
+    __slots__ = ('expression', 'tag', 'jsonpath')
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tag = expression[2:-1]
+        self.jsonpath = None
+        if self.tag:
+            try:
+                self.jsonpath = TBUtility.get_jsonpath(self.tag)
+            except Exception as e:
+                log.debug(e)
+
+    def get(self, body, expression_instead_none=False):
+        if not isinstance(body, dict):
+            return TBUtility.get_value(self.expression, body, expression_instead_none=expression_instead_none)
+        if not self.tag:
+            return None
+        if self.tag in body:
+            return body[self.tag]
+        value = None
+        if self.jsonpath is not None:
+            try:
+                jsonpath_match = self.jsonpath.find(body)
+                if jsonpath_match:
+                    value = jsonpath_match[0].value
+            except Exception as e:
+                log.debug(e)
+        if expression_instead_none and value is None:
+            return self.expression
+        return value
+
+
+class ExpressionPlan:
+    """
+    Compiled form of a key, value or device info expression. An expression without tags is a constant,
+    otherwise every tag is replaced with the string of its value, as TBUtility.get_values does.
+    """
+    __slots__ = ('expression', 'accessors')
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.accessors = [TagAccessor(tag_expression)
+                          for tag_expression in TBUtility.get_expression_tags(expression)]
+
+    def is_constant(self):
+        return not self.accessors
+
+    def execute(self, body, expression_instead_none=False):
+        result = self.expression
+        for accessor in self.accessors:
+            result = result.replace(accessor.expression, str(accessor.get(body, expression_instead_none)))
+        return result
@@ -13,7 +13,7 @@
 #     limitations under the License.
 import datetime
 from logging import getLogger
-from re import search, findall
+from re import compile as compile_regex, search, findall
 
 from cryptography import x509
 from cryptography.x509.oid import NameOID
@@ -23,8 +23,33 @@ from cryptography.hazmat.primitives import serialization
 from jsonpath_rw import parse
 from simplejson import JSONDecodeError, dumps, loads
 
+from thingsboard_gateway.tb_utility.tb_expression_cache import ExpressionCache
+
 log = getLogger("service")
 
+# Matches every "${...}" tag of an expression
+EXPRESSION_TAG_REGEX = r'\$\{[${A-Za-z0-9.^\]\[*_:]*\}'
+
+
+def find_tag_positions(expression):
+    positions = search(r'\${(?:(.*))}', expression)
+    if positions is not None:
+        return positions.regs[-1]
+    return 0, len(expression)
+
+
+# Compiled expressions shared by all converters and connectors, jsonpath_rw parsing is the most expensive part
+JSONPATH_CACHE = ExpressionCache(parse)
+TAG_POSITIONS_CACHE = ExpressionCache(find_tag_positions)
+EXPRESSION_TAGS_CACHE = ExpressionCache(lambda expression: tuple(findall(EXPRESSION_TAG_REGEX, expression)))
+REGEX_CACHE = ExpressionCache(compile_regex)
+EXPRESSION_CACHES = {
+    'jsonPath': JSONPATH_CACHE,
+    'tagPositions': TAG_POSITIONS_CACHE,
+    'expressionTags': EXPRESSION_TAGS_CACHE,
+    'regex': REGEX_CACHE,
+}
+
 
 class TBUtility:
 
@@ -87,13 +112,7 @@ class TBUtility:
             body = loads(body)
         if not expression:
             return ''
-        positions = search(r'\${(?:(.*))}', expression)
-        if positions is not None:
-            p1 = positions.regs[-1][0]
-            p2 = positions.regs[-1][1]
-        else:
-            p1 = 0
-            p2 = len(expression)
+        p1, p2 = TAG_POSITIONS_CACHE.get(expression)
         target_str = str(expression[p1:p2])
         if get_tag:
             return target_str
@@ -108,14 +127,14 @@ class TBUtility:
                     full_value = body.get(target_str.split()[0])
             elif isinstance(body, (dict, list)):
                 try:
-                    jsonpath_expression = parse(target_str)
+                    jsonpath_expression = JSONPATH_CACHE.get(target_str)
                     jsonpath_match = jsonpath_expression.find(body)
                     if jsonpath_match:
                         full_value = jsonpath_match[0].value
                 except Exception as e:
                     log.debug(e)
             elif isinstance(body, (str, bytes)):
-                search_result = search(expression, body)
+                search_result = REGEX_CACHE.get(expression).search(body)
                 if search_result.groups():
                     full_value = search_result.group(0)
             if expression_instead_none and full_value is None:
@@ -126,7 +145,7 @@ class TBUtility:
 
     @staticmethod
     def get_values(expression, body=None, value_type="string", get_tag=False, expression_instead_none=False):
-        expression_arr = findall(r'\$\{[${A-Za-z0-9.^\]\[*_:]*\}', expression)
+        expression_arr = EXPRESSION_TAGS_CACHE.get(expression)
 
         values = [TBUtility.get_value(exp, body, value_type=value_type, get_tag=get_tag,
                                       expression_instead_none=expression_instead_none) for exp in expression_arr]
@@ -136,6 +155,29 @@ class TBUtility:
 
         return values
 
+    @staticmethod
+    def get_jsonpath(expression):
+        """
+        Returns the parsed JSONPath from the shared cache, raises the parsing error for invalid expressions
+        """
+        return JSONPATH_CACHE.get(expression)
+
+    @staticmethod
+    def get_expression_tags(expression):
+        return EXPRESSION_TAGS_CACHE.get(expression)
+
+    @staticmethod
+    def set_expression_cache_size(max_size):
+        for cache in EXPRESSION_CACHES.values():
+            cache.set_max_size(max_size)
+
+    @staticmethod
+    def get_expression_cache_statistics(prefix):
+        statistics = {}
+        for (cache_name, cache) in EXPRESSION_CACHES.items():
+            statistics.update(cache.get_statistics(prefix + cache_name[0].upper() + cache_name[1:]))
+        return statistics
+
     @staticmethod
     def install_package(package, version="upgrade", force_install=False):
         from sys import executable